@@ -2,15 +2,20 @@ import logging
 from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from app.db.session import get_db
-from app.db.models import Users, InternalPolicy
-from app.schemas.auth import Token, UserCreate
+from app.db.models import Users
+from app.db.queries import get_user
+from app.services.policy_catalogue import policy_catalogue, etag_matches
+from app.schemas.auth import Token, UserCreate, Principal, UserUpdate
+from app.services.cache import cache_service
 from app.core.security import (
     verify_password, 
     get_password_hash, 
     create_access_token, 
     decode_access_token, 
-    ACCESS_TOKEN_EXPIRE_MINUTES
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+    HashingPoolSaturated
 )
 from sqlalchemy.exc import IntegrityError
 import os
@@ -24,7 +29,11 @@ oauth2_schema = OAuth2PasswordBearer(tokenUrl="auth/login", auto_error=False)
 
 IS_PROD = os.getenv("ENVIRONMENT","").lower()=="production"
 
-def get_token_from_request(request: Request, bearer_token: str = Depends(oauth2_schema)):
+def _hashing_busy()->HTTPException:
+    """login storms are shed instead of starving the threadpool that serves /audit"""
+    return HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Authentication service busy, retry shortly", headers={"Retry-After": "1"})
+
+async def get_token_from_request(request: Request, bearer_token: str = Depends(oauth2_schema)): #async: no threadpool hop for a cookie read
     cookie_token = request.cookies.get("access_token")
     # if cookie_token: return cookie_token
     # return bearer_token
@@ -34,7 +43,13 @@ def get_token_from_request(request: Request, bearer_token: str = Depends(oauth2_
         return bearer_token
     return None
 
-def get_current_user(token: str=Depends(get_token_from_request),db= Depends(get_db)):
+async def get_current_user(token: str=Depends(get_token_from_request))->Principal:
+    """
+    -validates the JWT
+    -principal comes from the cache keyed by (user id, token iat), postgres is only hit on a miss
+    (async lookup, a session is only opened on a miss)
+    -the cache client is sync redis-py: its calls run on the threadpool, never on the event loop
+    """
     credentials_exception=HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="could not validate credentials",
@@ -64,19 +79,31 @@ def get_current_user(token: str=Depends(get_token_from_request),db= Depends(get_
         logger.warning({"event": "auth_failed", "reason": "invalid_sub_format"})
         raise credentials_exception
     
-    user = db.query(Users).filter(Users.id == user_id).first() #not optimized, since each attempt leads to DB lookup , will refactor
-    if user is None:
-        logger.warning({"event": "auth_failed", "reason": "user_not_found"})
-        raise credentials_exception
-
-    if not user.is_active:
+    iat = payload.get("iat", 0)
+    cached = await run_in_threadpool(cache_service.get_principal, user_id, iat)
+    if cached:
+        principal = Principal(**cached)
+    else:
+        user = await get_user(user_id)
+        if user is None:
+            logger.warning({"event": "auth_failed", "reason": "user_not_found"})
+            raise credentials_exception
+        principal = Principal(id=str(user.id), username=user.username, role=user.role, is_active=user.is_active)
+        await run_in_threadpool(cache_service.set_principal, user_id, iat, principal.model_dump())
+
+    if not principal.is_active:
         logger.warning({"event": "auth_failed", "reason": "inactive_user"})
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Inactive user")
+
+    #role claim is baked into the token at login, a mismatch means the role changed since: force a fresh login
+    if payload.get("role") != principal.role:
+        logger.warning({"event": "auth_failed", "reason": "stale_role_claim", "user_id": principal.id})
+        raise credentials_exception
         
-    return user
+    return principal
 
 def require_role(required_role: str):
-    def role_checker(current_user: Users = Depends(get_current_user)):
+    async def role_checker(current_user: Principal = Depends(get_current_user)):
         if current_user.role != required_role and current_user.role != "admin":
             logger.warning({
                 "event": "rbac_blocked", 
@@ -89,7 +116,10 @@ def require_role(required_role: str):
 
 @router.post("/register", response_model=dict)
 def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
-    hashed_pw = get_password_hash(user_data.password)
+    try:
+        hashed_pw = get_password_hash(user_data.password)
+    except HashingPoolSaturated:
+        raise _hashing_busy()
     new_user = Users(username = user_data.username, hashed_password=hashed_pw, role="auditor")
 
     try:
@@ -111,7 +141,12 @@ def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
 def login_for_access_token(response: Response, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     user = db.query(Users).filter(Users.username ==form_data.username).first()
 
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    try:
+        password_ok = bool(user) and verify_password(form_data.password, user.hashed_password)
+    except HashingPoolSaturated:
+        raise _hashing_busy()
+
+    if not password_ok:
         logger.warning({"event": "login_failed", "reason": "invalid_credentials"})
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -139,17 +174,43 @@ def logout(response: Response):
     response.delete_cookie("access_token", secure=IS_PROD, samesite="none" if IS_PROD else "lax")
     return {"message": "log out successful"}
 
+@router.patch("/users/{user_id}", response_model=dict)
+def update_user(user_id: str, changes: UserUpdate, db: Session = Depends(get_db), current_user: Principal = Depends(require_role("admin"))):
+    """role change / deactivation, cached principals of the user are dropped so it takes effect on the next request"""
+    user = db.query(Users).filter(Users.id == user_id).first()
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    if changes.role is not None: user.role = changes.role
+    if changes.is_active is not None: user.is_active = changes.is_active
+
+    try:
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error({"event": "user_update_failed", "error": type(e).__name__})
+        raise HTTPException(status_code=500, detail="Database transaction failed")
+
+    cache_service.invalidate_principal(user_id)
+    logger.info({"event": "user_updated", "user_id": user_id, "by": current_user.id, "role": user.role, "is_active": user.is_active})
+    return {"message": "User updated", "user_id": user_id, "role": user.role, "is_active": user.is_active}
+
 @router.get("/bootstrap") #the Bootstrap Endpoint (Combines /me and /policies to cut latency)
-def bootstrap_app(current_user: Users = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Single network call to initialize the frontend."""
-    policies = db.query(InternalPolicy).all()
+async def bootstrap_app(request: Request, response: Response, current_user: Principal = Depends(get_current_user)):
+    """Single network call to initialize the frontend. ETag covers the catalogue version & the user's identity/role"""
+    version, policies = await policy_catalogue.snapshot()
+    etag = f'"{version}-{current_user.id}-{current_user.role}"'
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
     return {
         "user": {
             "id": str(current_user.id),
             "username": current_user.username,
             "role": current_user.role
         },
-        "policies": [{"id": str(p.id), "name": str(p.name)} for p in policies]
+        "policies": policies
     }
 
 
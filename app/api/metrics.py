@@ -0,0 +1,144 @@
+import time
+import logging
+from typing import Literal, Optional
+from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app.db.models import RequestProfile
+from app.db import session as db_session
+from app.db.session import get_db
+from app.api.auth import require_role
+from app.schemas.auth import Principal
+from app.services.rollups import summarize
+from app.services.cache_warmer import cache_warmer
+from app.core.security import get_hashing_pool_stats
+from app.services.metrics_writer import metrics_writer
+from app.services.metrics_registry import metrics_registry, REQUEST_LATENCY, REQUESTS_IN_FLIGHT, DB_POOL, HASHING_POOL, METRICS_BUFFER
+
+logger = logging.getLogger("json_logger")
+
+router = APIRouter(tags=["Metrics"])
+
+def _collect_runtime():
+    """scrape time gauges, nothing here runs on the request path"""
+    engine = db_session.engine
+    if engine is not None and hasattr(engine.pool, "checkedout"):
+        DB_POOL.set(engine.pool.size(), state="size")
+        DB_POOL.set(engine.pool.checkedout(), state="checked_out")
+        DB_POOL.set(engine.pool.checkedin(), state="idle")
+        DB_POOL.set(max(0, engine.pool.overflow()), state="overflow")
+
+    async_engine = db_session.async_engine
+    if async_engine is not None and hasattr(async_engine.pool, "checkedout"):
+        DB_POOL.set(async_engine.pool.size(), state="async_size")
+        DB_POOL.set(async_engine.pool.checkedout(), state="async_checked_out")
+        DB_POOL.set(async_engine.pool.checkedin(), state="async_idle")
+        DB_POOL.set(max(0, async_engine.pool.overflow()), state="async_overflow")
+
+    for stat, value in get_hashing_pool_stats().items():
+        HASHING_POOL.set(value, stat=stat)
+
+    METRICS_BUFFER.set(metrics_writer.buffered(), stat="buffered")
+    for stat, value in metrics_writer.stats.items():
+        METRICS_BUFFER.set(value, stat=stat)
+
+metrics_registry.register_collector(_collect_runtime)
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def prometheus_metrics():
+    """prometheus text format, merged across workers when METRICS_MULTIPROC_DIR is set"""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@router.get("/metrics/summary")
+def metrics_summary(
+    hours: int = Query(24, ge=1, le=24*400),
+    group_by: Optional[Literal["endpoint", "intent", "cache_layer", "model_name"]] = None,
+    granularity: Optional[Literal["minute", "hour"]] = None,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(require_role("admin"))
+):
+    """dashboard aggregates (error/cache hit rate, p50/p95/p99, cost) served from metric_rollups"""
+    return summarize(db, hours=hours, group_by=group_by, granularity=granularity)
+
+
+@router.get("/metrics/profiles")
+def list_profiles(
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(require_role("admin"))
+):
+    """recent request profiles, summary columns only (the report itself can be large)"""
+    rows = db.execute(
+        select(RequestProfile.request_id, RequestProfile.created_at, RequestProfile.endpoint, RequestProfile.reason,
+               RequestProfile.profiler, RequestProfile.wall_ms, RequestProfile.cpu_ms, RequestProfile.alloc_peak_kb)
+        .order_by(RequestProfile.created_at.desc()).limit(limit)
+    ).all()
+    return [dict(r._mapping) for r in rows]
+
+@router.get("/metrics/profiles/{request_id}")
+def get_profile(
+    request_id: str,
+    format: Literal["json", "text"] = "json",
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(require_role("admin"))
+):
+    """one request's profile: call tree, top functions & allocation sites. format=text returns just the call tree"""
+    profile = db.execute(select(RequestProfile).where(RequestProfile.request_id == request_id).order_by(RequestProfile.created_at.desc())).scalars().first()
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "text":
+        return PlainTextResponse(profile.report.get("call_tree", ""))
+    return {
+        "request_id": profile.request_id,
+        "created_at": profile.created_at,
+        "endpoint": profile.endpoint,
+        "reason": profile.reason,
+        **profile.report,
+    }
+
+
+@router.post("/metrics/cache/warm", status_code=202)
+def request_cache_warm(
+    top_n: Optional[int] = Query(None, ge=1, le=5000),
+    current_user: Principal = Depends(require_role("admin"))
+):
+    """queue a cache warm run (e.g. after invalidating a policy), one api worker picks it up in the background"""
+    return {"queued": cache_warmer.request("admin", top_n), "last_run": cache_warmer.status()}
+
+@router.get("/metrics/cache/warm")
+def cache_warm_status(current_user: Principal = Depends(require_role("admin"))):
+    """progress of the current warm run or the report of the last one (hit rate before/after, tokens & cost spent)"""
+    return {"last_run": cache_warmer.status()}
+
+
+class MetricsMiddleware:
+    """
+    pure ASGI middleware (no BaseHTTPMiddleware task overhead):
+    -in flight gauge
+    -request latency histogram labelled by route template, not raw path (keeps label cardinality bounded)
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status_holder = {"status": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            route = scope.get("route")
+            endpoint = getattr(route, "path", "unmatched")
+            REQUEST_LATENCY.observe((time.perf_counter()-t0)*1000, endpoint=endpoint, status=status_holder["status"])
@@ -1,15 +1,18 @@
 import logging
 from typing import List
-from fastapi import Depends, APIRouter, HTTPException, Request, BackgroundTasks
+from fastapi import Depends, APIRouter, HTTPException, Request, BackgroundTasks, Response, Query
 from sqlalchemy.orm import Session
 from app.db.session import get_db
-from app.db.models import InternalPolicy, RequestMetric, Users
+from app.services.policy_catalogue import policy_catalogue, etag_for, etag_matches
+from app.schemas.auth import Principal
 from app.schemas.audit import PolicyItem, ComplianceResponse, AuditRequest
 from app.services.telemetry import TelemetryService
-from app.db.session import SessionLocal
+from app.services.metrics_writer import metrics_writer, build_metric_row
+from app.services.profiling import maybe_profile, save_profile, PROFILE_HEADER
+from app.services.cache import cache_service
+from app.services.cache_warmer import cache_warmer
 import uuid
 from typing import Optional
-from sqlalchemy.exc import SQLAlchemyError
 from app.api.auth import require_role
 
 # logger = logging.getLogger("API")
@@ -19,82 +22,57 @@ router = APIRouter()
 
 def save_metrics_background(intent: str, status_code: int, endpoint: str, telemetry: TelemetryService,user_id: Optional[str] = None):
     """
-    -runs in bg to collect metrics
-    -creates own db session to avoid race condition with fastAPI request loop
+    -runs in bg after the response is sent
+    -only buffers the row, the metrics writer persists it in bulk off the request path
     """
-
-    db = SessionLocal()
     try:
         data = telemetry.get_summary()
-        metric = RequestMetric(
-            request_id=data["request_id"],
-            endpoint=endpoint,
-            user_id = user_id,
-            intent=intent,
-            status_code=status_code,
-            error_type=data.get("error_type"),
-            cache_layer = data.get("cache_layer"),
-            is_cache_hit = data.get("is_cache_hit",False),
-            cache_lookup_ms = data.get("cache_lookup_ms",0.0),
-
-            total_latency_ms=data["total_latency_ms"],
-            routing_latency_ms=data["routing_ms"],
-            retrieval_latency_ms=data["retrieval_ms"],
-            llm_latency_ms=data["llm_ms"],
-            prompt_tokens=data["prompt_tokens"],
-            completion_tokens=data["completion_tokens"],
-            total_tokens=data["prompt_tokens"] + data["completion_tokens"],
-            cost_usd=data["cost_usd"],
-
-            model_name=data["model_str"]
-        )
-        
-        for attempt in range(2):
-            try:
-                db.add(metric)
-                db.commit()
-                logger.info({
-                    "event": "metrics_persisted", 
-                    "request_id": telemetry.request_id,
-                    "user_id": user_id,
-                    "cost_usd": data["cost_usd"],
-                    "total_latency_ms": data["total_latency_ms"]
-                })
-                break
-            except SQLAlchemyError as db_err:
-                db.rollback()
-                if attempt == 1: # Log only if the final attempt fails
-                    logger.error({
-                        "event": "metrics_save_failed", 
-                        "error": str(db_err), 
-                        "request_id": telemetry.request_id
-                    })
-        # logger.info({
-        #     "event": "metrics_persisted", 
-        #     "request_id": telemetry.request_id, 
-        #     "cost_usd": data["cost_usd"],
-        #     "total_latency_ms": data["total_latency_ms"]
-        # })
+        metrics_writer.enqueue(build_metric_row(data, intent=intent, status_code=status_code, endpoint=endpoint, user_id=user_id))
     except Exception as e:
-        logger.error({"event": "metrics_save_failed", "error": type(e).__name__}) 
-    finally:
-        db.close()     
+        logger.error({"event": "metrics_save_failed", "error": type(e).__name__, "request_id": telemetry.request_id})
 
 
 
 
 @router.get("/policies", response_model=List[PolicyItem])
-def list_policies(db: Session = Depends(get_db), current_user: Users = Depends(require_role("auditor"))):
-    db: Session = Depends(get_db),
+async def list_policies(
+    request: Request,
+    response: Response,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    current_user: Principal = Depends(require_role("auditor"))
+):
+    """
+    -served from the in-memory catalogue, ETag = catalogue version (+ page), unchanged -> 304 without a body
+    -no limit = full list (what the frontend expects), limit/offset pages through large catalogues, total in X-Total-Count
+    """
     try:
-        policies = db.query(InternalPolicy).all() #not optimal, this is for mvp only
-        return [{"id":str(p.id), "name": str(p.name)} for p in policies]
+        page = await policy_catalogue.page(offset, limit)
+        etag = etag_for(page["version"], offset, limit)
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache", "X-Total-Count": str(page["total"])}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+
+        response.headers.update(headers)
+        if limit is not None and offset + limit < page["total"]:
+            response.headers["Link"] = f'<{request.url.include_query_params(offset=offset+limit, limit=limit)}>; rel="next"'
+        return page["items"]
     except Exception as e:
         logger.error({"event": "policy_list_error", "error": type(e).__name__})
         raise HTTPException(status_code=500, detail="Internal Error")
+
+@router.delete("/policies/{policy_id}/cache")
+def invalidate_policy_cache(policy_id: str, current_user: Principal = Depends(require_role("admin"))):
+    """
+    a policy changed outside of ingest: its cached audits go (policy scope + global answers citing it),
+    then one worker re-warms the popular queries in the background
+    """
+    stats = cache_service.invalidate_policy(policy_id)
+    stats["warm_queued"] = cache_warmer.request("invalidate")
+    return stats
     
 @router.post("/audit", response_model=ComplianceResponse)
-def run_audit(request:AuditRequest, request_ctx: Request,background_tasks: BackgroundTasks,current_user: Users = Depends(require_role("auditor")),db: Session = Depends(get_db)):
+def run_audit(request:AuditRequest, request_ctx: Request, response: Response, background_tasks: BackgroundTasks,current_user: Principal = Depends(require_role("auditor")),db: Session = Depends(get_db)):
     req_id = str(uuid.uuid4())
     telemetry = TelemetryService(request_id=req_id)
     logger.info({
@@ -105,12 +83,17 @@ def run_audit(request:AuditRequest, request_ctx: Request,background_tasks: Backg
     try:
         agent = request_ctx.app.state.agent # agent = ComplianceAgent() would load agent to memory at every POST, that's not optimal
 
-        result = agent.analyze(
-            query=request.query,
-            session=db,
-            policy_filter_id = request.policy_id,
-            telemetry= telemetry
-        )
+        #opt-in profile (admin X-Profile header or PROFILE_SAMPLE_RATE), a shared no-op context otherwise
+        with maybe_profile(req_id, "/audit", request_ctx.headers.get(PROFILE_HEADER), current_user.role) as profile:
+            result = agent.analyze(
+                query=request.query,
+                session=db,
+                policy_filter_id = request.policy_id,
+                telemetry= telemetry
+            )
+        if profile is not None:
+            background_tasks.add_task(save_profile, profile)
+            response.headers["X-Profile-Id"] = req_id # GET /metrics/profiles/{request_id}
         intent = result.get("intent", "UNKNOWN")
         background_tasks.add_task(
             save_metrics_background,
@@ -120,6 +103,8 @@ def run_audit(request:AuditRequest, request_ctx: Request,background_tasks: Backg
             endpoint="/audit",
             user_id=str(current_user.id)
         )
+        if intent not in ("REJECT", "ERROR") and not telemetry.metrics["error_type"]:
+            background_tasks.add_task(cache_service.record_query, request.query, request.policy_id) # cache warmer input
 
         return result
     except Exception as e:
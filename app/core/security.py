@@ -1,9 +1,16 @@
 import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from typing import Dict, Optional, Any
 from datetime import datetime, timedelta, timezone
 import jwt
 import bcrypt
 
+logger = logging.getLogger("json_logger")
+
 SECRET_KEY = os.getenv("SECRET_KEY")
 if not SECRET_KEY: raise ValueError("SECRET_KEY env variable not set. Insecure, aborting.")
 
@@ -13,16 +20,95 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 60))
 #BYCRTPY SETUP
 #pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+#HASHING EXECUTOR
+#bcrypt is ~250ms of pure CPU per call. Running it inline in sync routes ties up the same threadpool that serves /audit,
+#so hashing runs in a small dedicated process pool & callers beyond HASH_QUEUE_LIMIT are shed (429) instead of queueing
+HASH_POOL_SIZE = int(os.getenv("HASH_POOL_SIZE", 2))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", 8)) # running + waiting jobs per api worker
+HASH_TIMEOUT = 10.0
+
+class HashingPoolSaturated(Exception):
+    """raised when the hashing pool is full or a job timed out waiting for it, routes map it to 429"""
+
+_hash_pool: Optional[ProcessPoolExecutor] = None
+_hash_pool_lock = threading.Lock()
+_hash_slots = threading.BoundedSemaphore(HASH_QUEUE_LIMIT)
+_hash_stats = {"in_flight": 0, "completed": 0, "rejected": 0, "timed_out": 0, "failed": 0}
+_hash_stats_lock = threading.Lock()
+
+def _get_hash_pool()->ProcessPoolExecutor:
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool is None:
+            #spawn, not fork: the api process is multi-threaded
+            _hash_pool = ProcessPoolExecutor(max_workers=HASH_POOL_SIZE, mp_context=multiprocessing.get_context("spawn"))
+        return _hash_pool
+
+def _reset_hash_pool():
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool is not None:
+            _hash_pool.shutdown(wait=False, cancel_futures=True)
+        _hash_pool = None
+
+def _checkpw(password_bytes: bytes, hash_bytes: bytes)->bool:
+    return bcrypt.checkpw(password_bytes, hash_bytes)
+
+def _hashpw(password_bytes: bytes)->bytes:
+    return bcrypt.hashpw(password_bytes, bcrypt.gensalt())
+
+def _run_hash_job(fn, *args):
+    if not _hash_slots.acquire(blocking=False):
+        with _hash_stats_lock:
+            _hash_stats["rejected"] += 1
+        logger.warning({"event": "hashing_pool_saturated", "in_flight": _hash_stats["in_flight"], "limit": HASH_QUEUE_LIMIT})
+        raise HashingPoolSaturated()
+    with _hash_stats_lock:
+        _hash_stats["in_flight"] += 1
+    outcome = "failed"
+    try:
+        future = _get_hash_pool().submit(fn, *args)
+        try:
+            result = future.result(timeout=HASH_TIMEOUT)
+        except FutureTimeoutError:
+            future.cancel() # still queued = never runs, already running = finishes & is discarded
+            outcome = "timed_out"
+            logger.warning({"event": "hashing_timeout", "timeout_s": HASH_TIMEOUT})
+            raise HashingPoolSaturated()
+        outcome = "completed"
+        return result
+    except BrokenProcessPool:
+        _reset_hash_pool() # a child died, next call gets a fresh pool
+        raise
+    finally:
+        with _hash_stats_lock:
+            _hash_stats["in_flight"] -= 1
+            _hash_stats[outcome] += 1
+        _hash_slots.release()
+
+def get_hashing_pool_stats()->dict:
+    return {
+        "pool_size": HASH_POOL_SIZE,
+        "queue_limit": HASH_QUEUE_LIMIT,
+        "queue_depth": _hash_stats["in_flight"],
+        "completed": _hash_stats["completed"],
+        "rejected": _hash_stats["rejected"],
+        "timed_out": _hash_stats["timed_out"],
+        "failed": _hash_stats["failed"]
+    }
+
+def shutdown_hashing_pool():
+    _reset_hash_pool()
+
 def verify_password(plain_password: str,hashed_password: str)-> bool: # verification: compares password to hashed password
-    """verifies plain text against hashed version using bcrypt"""
+    """verifies plain text against hashed version using bcrypt (runs in the hashing pool)"""
     password_bytes = plain_password.encode('utf-8')
     hash_bytes = hashed_password.encode('utf-8')
-    return bcrypt.checkpw(password_bytes, hash_bytes)
+    return _run_hash_job(_checkpw, password_bytes, hash_bytes)
 
 def get_password_hash(password: str)->str:
     password_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
-    hashed_password = bcrypt.hashpw(password_bytes, salt)
+    hashed_password = _run_hash_job(_hashpw, password_bytes)
     return hashed_password.decode('utf-8') 
 
 #JWT MANAGEMENT
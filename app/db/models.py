@@ -1,7 +1,7 @@
 import uuid
 from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy import Column, String, JSON, ForeignKey, UniqueConstraint, Text, DateTime, func, Integer, Float, Enum, Boolean
+from sqlalchemy import Column, String, JSON, ForeignKey, UniqueConstraint, Text, DateTime, func, Integer, Float, Enum, Boolean, Index
 import datetime
 
 Base = declarative_base() # lauches a fresh drawing board
@@ -127,8 +127,13 @@ class RequestMetric(Base):
     prompt_tokens = Column(Integer, default=0)
     completion_tokens = Column(Integer, default=0)
     total_tokens = Column(Integer, default=0)
+    cached_tokens = Column(Integer, default=0) # prompt tokens served from openai prompt cache
     cost_usd = Column(Float, default=0.0)
 
+    # cascade mode: escalated to the second tier & per tier model/calls/tokens/cost/context (null outside cascade mode)
+    escalated = Column(Boolean, default=False)
+    llm_tiers = Column(JSON, nullable=True)
+
     # cache layer
     is_cache_hit = Column(Boolean, default=False,nullable=False)
     cache_lookup_ms = Column(Float,default=0.0)
@@ -137,6 +142,63 @@ class RequestMetric(Base):
     
     model_name = Column(String, nullable=True)
 
+    __table_args__ = (
+        #brin: tiny index, good for append-only time ranges (rollup rebuilds, retention deletes)
+        Index("ix_request_metrics_timestamp_brin", "timestamp", postgresql_using="brin"),
+    )
+
+class RequestProfile(Base):
+    """
+    opt-in per request profile (call tree + allocation stats), joined to request_metrics on request_id.
+    written only for profiled requests (admin header or PROFILE_SAMPLE_RATE), see app/services/profiling.py
+    """
+    __tablename__ = "request_profiles"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    request_id = Column(String, index=True, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    endpoint = Column(String)
+    reason = Column(String, nullable=False) # header | sampled
+    profiler = Column(String, nullable=False) # pyinstrument | cprofile
+
+    wall_ms = Column(Float)
+    cpu_ms = Column(Float) # thread cpu time, wall - cpu = waiting on upstreams / locks
+    alloc_peak_kb = Column(Float, nullable=True) # tracemalloc peak, null when allocation tracing was off
+    report = Column(JSON, nullable=False) # call tree, top functions, top allocation sites
+
+class MetricRollup(Base):
+    """
+    pre-aggregated request_metrics per time bucket (minute & hour), maintained incrementally by the metrics writer.
+    latency_sketch is a mergeable log-bucket histogram (see app/services/rollups.py) for approximate percentiles
+    """
+    __tablename__ = "metric_rollups"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    granularity = Column(String, nullable=False) # minute | hour
+    bucket_start = Column(DateTime(timezone=True), nullable=False)
+
+    #dimensions ("none" instead of NULL so the unique constraint holds)
+    endpoint = Column(String, nullable=False)
+    intent = Column(String, nullable=False)
+    cache_layer = Column(String, nullable=False)
+    model_name = Column(String, nullable=False)
+
+    request_count = Column(Integer, default=0, nullable=False)
+    error_count = Column(Integer, default=0, nullable=False)
+    cache_hit_count = Column(Integer, default=0, nullable=False)
+    latency_sum_ms = Column(Float, default=0.0, nullable=False)
+    prompt_tokens = Column(Integer, default=0, nullable=False)
+    completion_tokens = Column(Integer, default=0, nullable=False)
+    cost_usd = Column(Float, default=0.0, nullable=False)
+    escalated_count = Column(Integer, default=0, nullable=False) # cascade requests that needed the second tier
+    escalation_cost_usd = Column(Float, default=0.0, nullable=False) # share of cost_usd spent on the escalation tier
+    latency_sketch = Column(JSON, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("granularity", "bucket_start", "endpoint", "intent", "cache_layer", "model_name", name="uq_metric_rollup_bucket"),
+        Index("ix_metric_rollups_granularity_bucket", "granularity", "bucket_start"),
+    )
+
 class Users(Base):
     __tablename__= "users"
 
@@ -0,0 +1,113 @@
+import logging
+import os
+import time
+import uuid
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool, NullPool, AsyncAdaptedQueuePool
+from app.services.metrics_registry import metrics_registry
+from app.services.tracing import span
+
+logger = logging.getLogger("json_logger")
+
+#sizing inputs: every worker process gets its own pool, the sum must stay under the server's max_connections
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 4)) # uvicorn reads the same variable for --workers
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", 100)) # postgres default, managed tiers are often lower
+DB_RESERVED_CONNECTIONS = int(os.getenv("DB_RESERVED_CONNECTIONS", 10)) # superuser slots, ingest/batch scripts, psql sessions
+#sync endpoints run on anyio's threadpool (40 threads), a worker can't use more connections than that
+DB_THREADPOOL_SIZE = int(os.getenv("DB_THREADPOOL_SIZE", 40))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 5)) # fail fast, a request stuck 30s in checkout is worse than a 503
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+#"queue" = sqlalchemy QueuePool per worker, "pgbouncer" = NullPool, pgbouncer (transaction mode) does the pooling
+DB_POOL_MODE = os.getenv("DB_POOL_MODE", "queue")
+#fraction of the per worker budget given to the asyncpg engine (request path), the sync engine keeps the rest
+DB_ASYNC_POOL_SHARE = float(os.getenv("DB_ASYNC_POOL_SHARE", 0.5))
+
+POOL_WAIT_BUCKETS_MS = (0.1, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+DB_POOL_CHECKOUT = metrics_registry.histogram("ball_db_pool_checkout_ms", "time spent getting a connection from the pool", buckets=POOL_WAIT_BUCKETS_MS)
+DB_POOL_EVENTS = metrics_registry.counter("ball_db_pool_events_total", "pool timeouts & new physical connections", ("event",))
+
+
+def compute_pool_size(workers: int = WEB_CONCURRENCY, max_connections: int = DB_MAX_CONNECTIONS, reserved: int = DB_RESERVED_CONNECTIONS, share: float = 1.0, overrides: bool = True)->dict:
+    """
+    per worker budget = (max_connections - reserved) / workers, capped by the worker's thread count.
+    share splits that budget between the sync & async engines of the same worker.
+    2/3 of it is the steady pool, the rest is overflow for bursts (closed again once returned).
+    DB_POOL_SIZE / DB_MAX_OVERFLOW override the model (sync engine only)
+    """
+    budget = max(2, int(min((max_connections - reserved)//max(workers, 1), DB_THREADPOOL_SIZE)*share))
+    pool_size = max(1, (budget*2)//3)
+    max_overflow = budget - pool_size
+
+    if overrides:
+        pool_size = int(os.getenv("DB_POOL_SIZE", pool_size))
+        max_overflow = int(os.getenv("DB_MAX_OVERFLOW", max_overflow))
+
+    total = (pool_size + max_overflow)*workers
+    if total > (max_connections - reserved)*share:
+        logger.warning({"event": "db_pool_oversubscribed", "total_connections": total, "max_connections": max_connections, "reserved": reserved})
+    return {"pool_size": pool_size, "max_overflow": max_overflow, "workers": workers, "total_connections": total}
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that times every checkout (wait for a free connection + connect on overflow) & counts timeouts"""
+
+    def _do_get(self):
+        t0 = time.perf_counter()
+        with span("db.pool.checkout", **{"db.pool.size": self.size(), "db.pool.checked_out": self.checkedout()}) as s:
+            try:
+                return super()._do_get()
+            except exc.TimeoutError:
+                DB_POOL_EVENTS.inc(event="timeout")
+                logger.warning({"event": "db_pool_timeout", "pool_size": self.size(), "overflow": self.overflow(), "timeout_s": self._timeout})
+                raise
+            finally:
+                wait_ms = (time.perf_counter()-t0)*1000
+                DB_POOL_CHECKOUT.observe(wait_ms)
+                s.set_attribute("db.pool.wait_ms", wait_ms)
+
+    def _create_connection(self):
+        DB_POOL_EVENTS.inc(event="connect")
+        return super()._create_connection()
+
+
+class InstrumentedAsyncQueuePool(InstrumentedQueuePool):
+    """same instrumentation on the asyncio adapted queue, used by the asyncpg engine"""
+    _is_asyncio = AsyncAdaptedQueuePool._is_asyncio
+    _queue_class = AsyncAdaptedQueuePool._queue_class
+    _dialect = AsyncAdaptedQueuePool._dialect
+
+
+def pgbouncer_connect_args(driver: str)->dict:
+    """
+    pgbouncer in transaction mode hands each transaction to any server connection, so
+    server side prepared statements break. psycopg2 never prepares, asyncpg does by default
+    """
+    if driver == "asyncpg":
+        return {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__", # unnamed statements can still collide across clients
+        }
+    return {}
+
+
+def engine_pool_kwargs(async_engine: bool = False, share: float = 1.0)->dict:
+    """create_engine / create_async_engine kwargs for the configured pool mode"""
+    engine_kind = "async" if async_engine else "sync"
+    if DB_POOL_MODE == "pgbouncer":
+        logger.info({"event": "db_pool_configured", "engine": engine_kind, "mode": "pgbouncer", "poolclass": "NullPool"})
+        kwargs = {"poolclass": NullPool, "pool_pre_ping": False} # every checkout is a fresh pgbouncer connection, nothing to ping
+        if async_engine:
+            kwargs["connect_args"] = pgbouncer_connect_args("asyncpg")
+        return kwargs
+
+    sizing = compute_pool_size(share=share, overrides=not async_engine)
+    logger.info({"event": "db_pool_configured", "engine": engine_kind, "mode": "queue", **sizing, "timeout_s": DB_POOL_TIMEOUT})
+    return {
+        "poolclass": InstrumentedAsyncQueuePool if async_engine else InstrumentedQueuePool,
+        "pool_pre_ping": True,
+        "pool_size": sizing["pool_size"],
+        "max_overflow": sizing["max_overflow"],
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
@@ -0,0 +1,66 @@
+import uuid
+from typing import List, Optional
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from app.db import session as db_session
+from app.db.models import Users, InternalPolicy, DocumentChunk
+
+#request path queries, one statement each, runnable on both engines:
+#-async engine (asyncpg) available: awaited on the event loop, no threadpool hop
+#-otherwise: same statement on the sync engine through the threadpool (tests, sqlite, asyncpg not installed)
+
+
+def _as_uuid(value)->Optional[uuid.UUID]:
+    #asyncpg binds uuid columns strictly, a str id must be converted first
+    if isinstance(value, uuid.UUID):
+        return value
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return None
+
+def user_by_id_stmt(user_id: str):
+    return select(Users).where(Users.id == _as_uuid(user_id))
+
+def policy_items_stmt():
+    return select(InternalPolicy.id, InternalPolicy.name) #only the columns the frontend needs, not full rows
+
+def chunks_by_ids_stmt(chunk_ids: List[str]):
+    ids = [u for u in (_as_uuid(i) for i in chunk_ids) if u is not None]
+    return select(DocumentChunk).where(DocumentChunk.id.in_(ids))
+
+
+def _sync_execute(stmt, mode: str):
+    db = db_session.SessionLocal()
+    try:
+        return _shape(db.execute(stmt), mode)
+    finally:
+        db.close()
+
+def _shape(result, mode: str):
+    if mode == "scalar":
+        return result.scalars().first()
+    if mode == "scalars":
+        return result.scalars().all()
+    return result.all()
+
+async def _execute(stmt, mode: str):
+    if db_session.async_engine is not None:
+        async with db_session.AsyncSessionLocal() as db:
+            return _shape(await db.execute(stmt), mode)
+    return await run_in_threadpool(_sync_execute, stmt, mode)
+
+
+async def get_user(user_id: str)->Optional[Users]:
+    if _as_uuid(user_id) is None:
+        return None
+    return await _execute(user_by_id_stmt(user_id), "scalar")
+
+async def list_policy_items()->List[dict]:
+    rows = await _execute(policy_items_stmt(), "rows")
+    return [{"id": str(r.id), "name": str(r.name)} for r in rows]
+
+#the retriever runs inside the sync rag pipeline (threadpool, caller's session), so chunks only have a sync fetch
+def fetch_chunks_sync(session: Session, chunk_ids: List[str])->List[DocumentChunk]:
+    return session.execute(chunks_by_ids_stmt(chunk_ids)).scalars().all()
@@ -3,7 +3,10 @@ from dotenv import load_dotenv
 import logging
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from app.db.models import Base
+from app.services.tracing import instrument_engine
+from app.db.pool import engine_pool_kwargs, DB_ASYNC_POOL_SHARE
 import time
 
 logging.basicConfig(level=logging.INFO)
@@ -23,6 +26,10 @@ def get_db_url():
 engine = None
 SessionLocal = sessionmaker(autocommit=False, autoflush=False)
 
+#asyncpg engine for request path queries on the event loop, None when the driver isn't installed (callers fall back to the sync engine)
+async_engine = None
+AsyncSessionLocal = None
+
 def init_db_connection():
     """
     initialization db connection & opens session pool 
@@ -39,7 +46,11 @@ def init_db_connection():
 
     while retries > 0: 
         try:
-            engine = create_engine(db_url, pool_pre_ping=True, pool_size=50, pool_timeout=30, max_overflow=50, pool_recycle=1800)
+            #sized from WEB_CONCURRENCY & DB_MAX_CONNECTIONS (was a fixed 50+50 per worker, 400 connections with 4 workers)
+            #the async engine's share is only given up when it exists (init_async_db runs first), scripts & fallback keep the whole budget
+            share = 1.0-DB_ASYNC_POOL_SHARE if async_engine is not None else 1.0
+            engine = create_engine(db_url, **engine_pool_kwargs(share=share))
+            instrument_engine(engine)
             #quick connection test
             connection = engine.connect()
             connection.close()
@@ -60,6 +71,46 @@ def init_db_connection():
             retries -=1
 
     raise Exception("Failed to connect to Postgres DB after multiple retries.")
+
+
+_ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+def get_async_db_url(db_url: str):
+    """DATABASE_URL (psycopg2) -> the same database on its async driver"""
+    url = make_url(db_url)
+    backend = url.get_backend_name()
+    if backend not in _ASYNC_DRIVERS:
+        raise ValueError(f"no async driver for {backend}")
+    url = url.set(drivername=f"{backend}+{_ASYNC_DRIVERS[backend]}")
+    if backend == "postgresql" and "sslmode" in url.query: # libpq option, asyncpg calls it ssl
+        url = url.difference_update_query(["sslmode"]).update_query_dict({"ssl": url.query["sslmode"]})
+    return url
+
+def init_async_db():
+    """
+    async engine next to the sync one, sharing the worker's connection budget (DB_ASYNC_POOL_SHARE).
+    schema is owned by the sync engine (create_all), this only opens the pool.
+    call it before init_db_connection, the sync pool is sized from whether this succeeded
+    """
+    global async_engine, AsyncSessionLocal
+
+    if async_engine is not None:
+        return
+    try:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker # needs greenlet
+        async_engine = create_async_engine(get_async_db_url(get_db_url()), **engine_pool_kwargs(async_engine=True, share=DB_ASYNC_POOL_SHARE))
+    except Exception as e: # ImportError when asyncpg / greenlet aren't installed
+        logger.warning(f'Async engine unavailable, request path queries stay on the sync engine. Error: {e}')
+        return
+    instrument_engine(async_engine.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, autocommit=False, autoflush=False, expire_on_commit=False)
+    logger.info("Async engine initialized.")
+
+async def dispose_async_db():
+    global async_engine
+    if async_engine is not None:
+        await async_engine.dispose()
+        async_engine = None
     
 
 def get_db():
@@ -75,6 +126,11 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    """async counterpart of get_db, sessions are lazy so nothing is checked out until the first query"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
             
 
 
@@ -3,10 +3,20 @@ import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
-from app.db.session import init_db_connection
+from app.db import session as db_session
+from app.core.logger import stop_logging # configures json_logger (async queue handler) on import
+from app.db.session import init_db_connection, init_async_db, dispose_async_db
+from app.db.pool import WEB_CONCURRENCY
 from app.api.routes import router as api_router
 from app.api.auth import router as auth_router
+from app.api.metrics import router as metrics_router, MetricsMiddleware
 from app.services.compliance_agent import ComplianceAgent
+from app.services.cache_warmer import cache_warmer, WARM_ON_STARTUP
+from app.core.security import shutdown_hashing_pool
+from app.services.metrics_writer import metrics_writer
+from app.services.metrics_registry import metrics_registry
+from app.services.rollups import ensure_metrics_storage
+from app.services.tracing import init_tracing, shutdown_tracing, TracingMiddleware
 from dotenv import load_dotenv
 
 
@@ -17,21 +27,36 @@ logger = logging.getLogger("json_logger")
 
 @asynccontextmanager
 async def  lifespan(app: FastAPI):
+    init_tracing() # before any OpenAI client is built, they pick up the tracing transport
     try:
+        init_async_db() # first: the sync pool only gives up the async share when this engine exists
         init_db_connection()
         logger.info({"event": "db_connected"})
+        ensure_metrics_storage(db_session.engine)
+        metrics_writer.start()
+        metrics_registry.start()
     except Exception as e:
         logger.critical({"event": "db_connection_failed", "error": str(e)})
     
     try:
         app.state.agent = ComplianceAgent()
         logger.info({"event": "agent_initialized"})
+        cache_warmer.start(app.state.agent)
+        if WARM_ON_STARTUP:
+            cache_warmer.request("startup") # deploy: one worker replays the popular queries, the others find it queued/done
     except Exception as e:
         logger.critical({"event": "agent_initialization_failed", "error": str(e)})
 
     yield
 
     logger.info({"event": "shutting_down"})
+    cache_warmer.stop()
+    shutdown_hashing_pool()
+    metrics_writer.stop() # flush buffered request_metrics before the process exits
+    await dispose_async_db()
+    metrics_registry.stop()
+    shutdown_tracing()
+    stop_logging() # last, drains queued log records
 
 app= FastAPI(
         title="BALL Compliance Engine",
@@ -49,9 +74,12 @@ app.add_middleware(
 
 app.include_router(api_router)
 app.include_router(auth_router)
+app.include_router(metrics_router)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware) # outermost, the root span covers the whole request
 
 if __name__=="__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000, workers=4)
+    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, workers=WEB_CONCURRENCY) # pool sizing assumes this worker count
 
 
 
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from uuid import UUID
-from typing import Optional
+from typing import Optional, Literal
 
 class Token(BaseModel):
     access_token: str
@@ -17,4 +17,18 @@ class TokenData(BaseModel):
 class UserCreate(BaseModel):
     """new user schema"""
     username: str
-    password: str
\ No newline at end of file
+    password: str
+
+class Principal(BaseModel):
+    """
+    authenticated caller, cached per token so most requests skip the users table
+    """
+    id: str
+    username: str
+    role: str
+    is_active: bool = True
+
+class UserUpdate(BaseModel):
+    """admin changes to an account, both invalidate cached principals"""
+    role: Optional[Literal["admin", "auditor"]] = None
+    is_active: Optional[bool] = None
@@ -0,0 +1,258 @@
+import argparse
+import json
+import logging
+import os
+import time
+import uuid
+from types import SimpleNamespace
+from typing import List, Optional
+from openai import OpenAI
+from sqlalchemy.orm import Session
+from app.db.models import ComplianceResult
+from app.db.session import init_db_connection, SessionLocal
+from app.services.cache import cache_service
+from app.services.compliance_agent import ComplianceAgent, ComplianceResponse, AUDIT_SYSTEM_PROMPT, AUDIT_PROMPT_CACHE_KEY, LLM_MODEL, SOURCE_CITATION
+from app.services.retriever import retrieve_balanced_chunks
+from app.services.telemetry import TelemetryService
+
+logger = logging.getLogger("json_logger")
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_PRICE_MULTIPLIER = 0.5 # batch api bills at half the synchronous rate
+BATCH_POLL_INTERVAL = int(os.getenv("BATCH_POLL_INTERVAL", 60))
+BATCH_OUTPUT_DIR = os.getenv("BATCH_OUTPUT_DIR", "batch_runs")
+TERMINAL_STATES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchAuditRunner:
+    """
+    **Bulk / offline audits via the OpenAI Batch API**
+
+    -retrieval & context assembly run locally, same as the live path (same prompt, same source numbering)
+    -every audit becomes one line of a JSONL request file, submitted as a single batch
+    -results are validated against ComplianceResponse, citation-checked, written to compliance_results & the response cache
+
+    OPENAI_BATCH_BASE_URL points the client at a local fake batch server for offline runs (benchmarks.fakes.serve_batch_api,
+    exercised end to end by python -m benchmarks.batch_check).
+    """
+
+    def __init__(self, agent: Optional[ComplianceAgent]=None, client: Optional[OpenAI]=None, model: str = LLM_MODEL):
+        self.agent = agent or ComplianceAgent()
+        self.client = client or OpenAI(base_url=os.getenv("OPENAI_BATCH_BASE_URL") or None)
+        self.model = model
+
+    def build_requests(self, queries: List[str], session: Session, policy_filter_id: Optional[str]=None, run_id: Optional[str]=None)->tuple[str, str]:
+        """
+        -retrieve & assemble context per query
+        -queries that trip a circuit breaker (no regs / no policy) are skipped, there is nothing to audit
+        returns: (jsonl path, manifest path)
+        """
+        run_id = run_id or time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+        os.makedirs(BATCH_OUTPUT_DIR, exist_ok=True)
+        jsonl_path = os.path.join(BATCH_OUTPUT_DIR, f"{run_id}.requests.jsonl")
+        manifest_path = os.path.join(BATCH_OUTPUT_DIR, f"{run_id}.manifest.json")
+
+        manifest = {"run_id": run_id, "model": self.model, "policy_filter_id": policy_filter_id, "requests": {}}
+        skipped = 0
+
+        with open(jsonl_path, "w", encoding="utf-8") as f:
+            for i, query in enumerate(queries):
+                chunks = retrieve_balanced_chunks(query, session, policy_filter_id=policy_filter_id)
+                if not chunks:
+                    skipped += 1
+                    continue
+
+                context_text, valid_sources, entity_counts = self.agent.assemble_context(chunks, query)
+                if entity_counts["regulation"]==0 or entity_counts["policy"]==0:
+                    skipped += 1
+                    continue
+
+                custom_id = f"audit-{i}"
+                source_ids = {f"Source {n+1}": (c.source_type.lower(), str(c.source_id)) for n, (c, _) in enumerate(chunks)}
+                manifest["requests"][custom_id] = {"query": query, "valid_sources": valid_sources, "source_ids": source_ids}
+
+                line = {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": BATCH_ENDPOINT,
+                    "body": {
+                        "model": self.model,
+                        "messages": [
+                            {"role": "system", "content": AUDIT_SYSTEM_PROMPT},
+                            {"role": "user", "content": f'QUERY: {query}\n\n--- sources ---\n{context_text}'}
+                        ],
+                        "temperature": 0.0,
+                        "prompt_cache_key": AUDIT_PROMPT_CACHE_KEY,
+                        "response_format": {"type": "json_object"}
+                    }
+                }
+                f.write(json.dumps(line) + "\n")
+
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+
+        logger.info({"event": "batch_requests_built", "run_id": run_id, "requests": len(manifest["requests"]), "skipped": skipped})
+        return jsonl_path, manifest_path
+
+    def submit(self, jsonl_path: str, run_id: str)->str:
+        with open(jsonl_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=BATCH_COMPLETION_WINDOW,
+            metadata={"run_id": run_id, "source": "ball_bulk_audit"}
+        )
+        logger.info({"event": "batch_submitted", "run_id": run_id, "batch_id": batch.id})
+        return batch.id
+
+    def poll(self, batch_id: str, interval: int = BATCH_POLL_INTERVAL, timeout: Optional[int]=None):
+        t0 = time.time()
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            counts = batch.request_counts
+            logger.info({
+                "event": "batch_status",
+                "batch_id": batch_id,
+                "status": batch.status,
+                "completed": counts.completed if counts else None,
+                "failed": counts.failed if counts else None,
+                "total": counts.total if counts else None
+            })
+            if batch.status in TERMINAL_STATES:
+                return batch
+            if timeout and time.time()-t0 > timeout:
+                raise TimeoutError(f"batch {batch_id} still {batch.status} after {timeout}s")
+            time.sleep(interval)
+
+    def load_results(self, batch, manifest_path: str, session: Session)->dict:
+        """
+        -parse the batch output file, one ComplianceResponse per custom_id
+        -persist to compliance_results & warm the response cache
+        """
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+
+        summary = {"loaded": 0, "invalid": 0, "errored": 0}
+        if not batch.output_file_id and not batch.error_file_id:
+            logger.error({"event": "batch_no_output", "batch_id": batch.id, "status": batch.status})
+            return summary
+
+        telemetry = TelemetryService(request_id=f"batch-{manifest['run_id']}")
+        #requests that failed inside the batch are only listed in the error file, never in the output file
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                lines += self.client.files.content(file_id).text.splitlines()
+        policy_filter_id = manifest.get("policy_filter_id")
+
+        for line in lines:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            meta = manifest["requests"].get(record.get("custom_id"))
+            response = record.get("response") or {}
+            if meta is None or record.get("error") or response.get("status_code") != 200:
+                logger.warning({"event": "batch_request_failed", "custom_id": record.get("custom_id"), "error": record.get("error") or response.get("status_code")})
+                summary["errored"] += 1
+                continue
+
+            body = response["body"]
+            usage = body.get("usage") or {}
+            telemetry.track_llm(_usage(usage), manifest["model"]) # response model is a dated snapshot name, price by the requested one
+
+            try:
+                data = json.loads(body["choices"][0]["message"]["content"])
+                data["intent"] = "COMPLIANCE_AUDIT"
+                result = self.agent.verify_citations(ComplianceResponse(**data), meta["valid_sources"])
+            except Exception as e:
+                logger.warning({"event": "batch_result_invalid", "custom_id": record["custom_id"], "error": type(e).__name__})
+                summary["invalid"] += 1
+                continue
+
+            regulation_id, policy_id = _cited_source_ids(result.citations, meta["source_ids"])
+            session.add(ComplianceResult(
+                regulation_id=uuid.UUID(regulation_id) if regulation_id else None, # manifest keeps ids as json strings
+                policy_id=uuid.UUID(policy_id) if policy_id else None,
+                status=result.status,
+                confidence_score=result.confidence,
+                reasoning=result.reasoning,
+                model_name=body.get("model", manifest["model"]),
+                agent_metadata={
+                    "query": meta["query"],
+                    "citations": result.citations,
+                    "batch_id": batch.id,
+                    "custom_id": record["custom_id"],
+                    "prompt_tokens": usage.get("prompt_tokens", 0),
+                    "completion_tokens": usage.get("completion_tokens", 0)
+                }
+            ))
+            cache_service.set_response(meta["query"], policy_filter_id, result.model_dump(),
+                                       tags={meta["source_ids"].get(label, (None, None))[1] for label in _citation_labels(result.citations)} - {None})
+            summary["loaded"] += 1
+
+        session.commit()
+
+        summary["cost_usd"] = round(telemetry.metrics["cost_usd"]*BATCH_PRICE_MULTIPLIER, 6)
+        summary["prompt_tokens"] = telemetry.metrics["prompt_tokens"]
+        summary["completion_tokens"] = telemetry.metrics["completion_tokens"]
+        logger.info({"event": "batch_results_loaded", "batch_id": batch.id, **summary})
+        return summary
+
+    def run(self, queries: List[str], session: Session, policy_filter_id: Optional[str]=None, poll_interval: int = BATCH_POLL_INTERVAL)->dict:
+        jsonl_path, manifest_path = self.build_requests(queries, session, policy_filter_id)
+        with open(manifest_path, encoding="utf-8") as f:
+            run_id = json.load(f)["run_id"]
+        batch_id = self.submit(jsonl_path, run_id)
+        batch = self.poll(batch_id, interval=poll_interval)
+        return self.load_results(batch, manifest_path, session)
+
+
+def _usage(usage: dict)->SimpleNamespace:
+    """adapts the raw usage dict from the batch output to what TelemetryService.track_llm reads"""
+    details = usage.get("prompt_tokens_details") or {}
+    return SimpleNamespace(
+        prompt_tokens=usage.get("prompt_tokens", 0),
+        completion_tokens=usage.get("completion_tokens", 0),
+        prompt_tokens_details=SimpleNamespace(cached_tokens=details.get("cached_tokens", 0))
+    )
+
+def _citation_labels(citations: List[str])->List[str]:
+    """"source 2 (policy)" -> "Source 2", same parsing as verify_citations"""
+    return [f"Source {match.group(1)}" for match in map(SOURCE_CITATION.search, citations) if match]
+
+def _cited_source_ids(citations: List[str], source_ids: dict)->tuple[Optional[str], Optional[str]]:
+    """first cited regulation & first cited policy, used as the compliance_results foreign keys"""
+    regulation_id = policy_id = None
+    for label in _citation_labels(citations):
+        source_type, source_id = source_ids.get(label, (None, None))
+        if source_type == "regulation" and not regulation_id:
+            regulation_id = source_id
+        elif source_type == "policy" and not policy_id:
+            policy_id = source_id
+    return regulation_id, policy_id
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="bulk re-audit through the OpenAI Batch API")
+    parser.add_argument("queries_file", nargs="?", help="text file, one audit query per line")
+    parser.add_argument("--policy-id", default=None)
+    parser.add_argument("--poll-interval", type=int, default=BATCH_POLL_INTERVAL)
+    parser.add_argument("--collect", nargs=2, metavar=("BATCH_ID", "MANIFEST"), help="only load results of an already submitted batch")
+    args = parser.parse_args()
+
+    init_db_connection()
+    session = SessionLocal()
+    try:
+        runner = BatchAuditRunner()
+        if args.collect:
+            batch_id, manifest_path = args.collect
+            summary = runner.load_results(runner.poll(batch_id, interval=args.poll_interval), manifest_path, session)
+        else:
+            with open(args.queries_file, encoding="utf-8") as f:
+                queries = [q.strip() for q in f if q.strip()]
+            summary = runner.run(queries, session, policy_filter_id=args.policy_id, poll_interval=args.poll_interval)
+        print(json.dumps(summary, indent=4))
+    finally:
+        session.close()
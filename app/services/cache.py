@@ -2,31 +2,109 @@ import os
 import hashlib
 import logging
 import json
+import queue
 import uuid
 import random
-from typing import Optional
+import threading
+import time
+from typing import Iterable, Optional
 import redis
+from redis.cache import CacheConfig, CacheKey, CacheEntryStatus
+from redis.exceptions import ResponseError
+from app.services.metrics_registry import metrics_registry, CACHE_LOOKUPS
+from app.services.cache_codec import cache_codec, CodecError
+from app.services.redis_breaker import RedisCircuitBreaker, GuardedRedis, LocalCache, LocalLocks, BREAKER_STATE
 
 
 logger = logging.getLogger("json_logger")
 # REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 
+CLIENT_CACHE = metrics_registry.gauge("ball_redis_client_cache", "RESP3 client side cache (hot responses, intents & generations): enabled, size, hits, misses", ("stat",))
+#hot keys read by pipeline (not kept by redis-py's client cache) are re-read by a background GET to enter it, queue bounded
+CLIENT_CACHE_REFILL_QUEUE = 1000
+
+#a degraded redis costs at most one socket timeout per call until the breaker trips, no retry on top of it
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", 1))
+#in-process fallback while the breaker is open: responses & intents are mirrored here on every redis read/write,
+#so a trip starts with this worker's hot entries. 0 = no local fallback
+CACHE_LOCAL_SIZE = int(os.getenv("CACHE_LOCAL_SIZE", 2000))
+CACHE_LOCAL_TTL = float(os.getenv("CACHE_LOCAL_TTL", 300)) # staleness bound, bumps made by other workers aren't seen while open
+
 class CacheService:
     def __init__(self):
         redis_url = os.getenv("REDIS_URL", "redis://ball_redis:6379/0")
+        #every command goes through the breaker (GuardedRedis, see client setter), its probe pings the raw client
+        self.breaker = RedisCircuitBreaker(ping=lambda: self.client.raw.ping())
+        self.breaker.on_change(self._on_breaker_change)
+        self.local_responses = LocalCache(CACHE_LOCAL_SIZE, CACHE_LOCAL_TTL)
+        self.local_intents = LocalCache(CACHE_LOCAL_SIZE, CACHE_LOCAL_TTL)
+        self.local_locks = LocalLocks() # single flight while redis locks are unavailable
         self.client = redis.from_url(redis_url, 
-                                     decode_responses=True,
-                                     socket_timeout=2,
-                                    socket_connect_timeout=2,
-                                    retry_on_timeout=True,
+                                     decode_responses=False, # values are codec bytes (msgpack/zstd), text is decoded where read
+                                     socket_timeout=REDIS_SOCKET_TIMEOUT,
+                                    socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+                                    retry_on_timeout=False,
                                     health_check_interval=30)
 
+        #hot reads (generations, responses, intents) go through a RESP3 connection with server assisted client side caching:
+        #redis remembers what this worker read & pushes an invalidation when a key changes, so repeated reads of popular
+        #entries are answered from process memory & stay coherent with every write/INCR/UNLINK. needs redis >= 7.4,
+        #off by default until verified against the deployed redis
+        self.tracked = None
+        self._client_cache_lookups = {"hits": 0, "misses": 0}
+        self._client_cache_lock = threading.Lock()
+        self._refill = queue.Queue(maxsize=CLIENT_CACHE_REFILL_QUEUE)
+        self._refill_thread: Optional[threading.Thread] = None
+        if os.getenv("CACHE_CLIENT_TRACKING", "false").lower() == "true":
+            self.tracked = redis.from_url(redis_url,
+                                          decode_responses=False,
+                                          protocol=3,
+                                          cache_config=CacheConfig(max_size=int(os.getenv("CACHE_CLIENT_CACHE_SIZE", 5000))),
+                                          socket_timeout=REDIS_SOCKET_TIMEOUT,
+                                          socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+                                          retry_on_timeout=False,
+                                          health_check_interval=30)
+
         #TTL for intent routing, LLM response & embedding layers
         self.NEGATIVE_TTL = 300 #5 mins
         self.INTENT_TTL = 604800#7 days
         self.RESPONSE_TTL = 86400#24hours
         self.EMBED_TTL = 2592000#30 days
+        self.PRINCIPAL_TTL = 300 #5 mins, upper bound on staleness if an invalidation is ever missed
         self.EMBED_VERSION = "v1"
+        self.MAX_VALUE_BYTES = int(os.getenv("CACHE_MAX_VALUE_BYTES", 100_000)) # encoded (compressed) size
+        self.codec = cache_codec
+        #popular queries (cache warmer input): one sorted set per day, trimmed to the top POPULAR_MAX members
+        self.POPULAR_DAYS = int(os.getenv("CACHE_POPULAR_DAYS", 7))
+        self.POPULAR_MAX = int(os.getenv("CACHE_POPULAR_MAX", 5000))
+        self.INVALIDATE_BATCH = 500 # keys per UNLINK
+        self.CORPUS_GEN_KEY = "gen:corpus"
+        self._generations = {} # last seen generations (gen key -> int), refreshed by every get_response
+        self._local = threading.local() # generations the current request's lookup saw & its prefetched intent
+
+    @property
+    def client(self):
+        return self._client
+
+    @client.setter
+    def client(self, value):
+        self._client = GuardedRedis(value, self.breaker) if value is not None and not isinstance(value, GuardedRedis) else value
+
+    @property
+    def tracked(self):
+        return self._tracked
+
+    @tracked.setter
+    def tracked(self, value):
+        self._tracked = GuardedRedis(value, self.breaker) if value is not None and not isinstance(value, GuardedRedis) else value
+
+    def _on_breaker_change(self, state: str):
+        if state == "open":
+            logger.warning({"event": "cache_local_fallback", "local_responses": len(self.local_responses), "local_intents": len(self.local_intents)})
+        elif state == "closed" and self.tracked is not None:
+            #invalidation pushes sent while the connection was down are lost, locally cached reads can't be trusted
+            cache = self.tracked.get_cache()
+            if cache: cache.flush()
 
     def _hash(self, text: str)->str:
         """redis is going to return a long hashcode that might be difficult to manage, so this func renders a shorter one"""
@@ -46,117 +124,491 @@ class CacheService:
         - once cache expires, the 1st user is locked & goes through full route (intent routing, embedding, retrieval->llm reponse).
         -cache is now populated again, lock is released & then the subsequent users hit the cache layers
         """
+        token = str(uuid.uuid4())
         try:
-            token = str(uuid.uuid4())
             acquired = self.client.set(lock_key, token,nx=True, ex=expire)
             return token if acquired else None
         except Exception:
-            return str(uuid.uuid4()) # no lock if redis is down
+            #redis is down: single flight inside this worker instead of no lock at all
+            return token if self.local_locks.acquire(lock_key, token, expire) else None
         
     def release_lock(self, lock_key: str, token: str):
+        if self.local_locks.release(lock_key, token):
+            return
         try: 
-            if self.client.get(lock_key)==token: self.client.delete(lock_key)
+            if self.client.get(lock_key)==token.encode(): self.client.delete(lock_key)
         except Exception:
             pass
 
+    def extend_lock(self, lock_key: str, token: str, expire: int)->Optional[bool]:
+        """
+        push a held lock's expiry out (long running holders). False when the lock expired or changed hands,
+        None when redis can't be reached (the lock may still be held, retry later)
+        """
+        if self.local_locks.extend(lock_key, token, expire):
+            return True
+        try:
+            if self.client.get(lock_key)==token.encode():
+                return bool(self.client.expire(lock_key, expire))
+            return False
+        except Exception:
+            return None
+
+    def acquire_lock_and_get_response(self, lock_key: str, query: str, policy_id: Optional[str], expire: int=45)->tuple[Optional[str], Optional[dict]]:
+        """
+        SET NX + the double-check lookup in one pipeline, the lock is queued first so the re-read sees anything written before it.
+        a hit while holding the lock releases it here. returns (token or None, cached response or None)
+        """
+        token = str(uuid.uuid4())
+        gen_keys = self._generation_keys(policy_id)
+        seen = getattr(self._local, "generations", None)
+        guess = seen[1] if seen and seen[0] == self._scope(policy_id) else self._known_generations(policy_id)
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.set(lock_key, token, nx=True, ex=expire)
+            pipe.mget(gen_keys)
+            pipe.get(self._response_key(query, policy_id, guess))
+            acquired, remote, data = pipe.execute()
+        except Exception:
+            #redis is down: local double check & single flight, concurrent misses of this worker wait for the first one
+            response = self._get_local_response(query, policy_id)
+            if response is not None:
+                return None, response
+            return (token if self.local_locks.acquire(lock_key, token, expire) else None), None
+
+        current = tuple(int(g or 0) for g in remote)
+        self._local.generations = (self._scope(policy_id), current)
+        if current != guess: # bumped since this worker last looked, the entry may exist under the new generations
+            self._generations.update(zip(gen_keys, current))
+            try:
+                data = self._hot_get([self._response_key(query, policy_id, current)])[0]
+            except Exception:
+                data = None # lock is held either way, a miss only costs the rebuild
+        if data:
+            self.local_responses.set(self._response_key(query, policy_id, current), data)
+        response = self._decode_response(data)
+        if response is not None and acquired:
+            self.release_lock(lock_key, token)
+        return (token if acquired else None), response
+
+    def _hot_get(self, keys: list)->list:
+        """
+        GETs of hot keys, one round trip at most
+        -tracking client on: keys held by the client side cache are read through it (no round trip), the rest in one pipeline
+        -otherwise one pipeline
+        """
+        if self.tracked is not None:
+            try:
+                return self._tracked_get(keys)
+            except (ResponseError, redis.ConnectionError) as e:
+                if not isinstance(e, ResponseError) and "client-side caching" not in str(e):
+                    raise
+                #server without RESP3 / CLIENT TRACKING (< 7.4): plain pipelined reads from now on
+                logger.warning({"event": "redis_client_tracking_disabled", "error": str(e)})
+                self.tracked = None
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.get(key)
+        return pipe.execute()
+
+    def _tracked_get(self, keys: list)->list:
+        #cached keys still go through tracked.get: redis-py applies pending invalidation pushes first, a peek alone could be stale
+        cache = self.tracked.get_cache()
+        values = [None]*len(keys)
+        missed = []
+        for i, key in enumerate(keys):
+            entry = cache.get(CacheKey(command="GET", redis_keys=(key,), redis_args=("GET", key))) if cache else None
+            if entry is not None and entry.status == CacheEntryStatus.VALID:
+                values[i] = self.tracked.get(key)
+            else:
+                missed.append(i)
+        with self._client_cache_lock:
+            self._client_cache_lookups["hits"] += len(keys)-len(missed)
+            self._client_cache_lookups["misses"] += len(missed)
+        if not missed:
+            return values
+
+        pipe = self.client.pipeline(transaction=False)
+        for i in missed:
+            pipe.get(keys[i])
+        for i, value in zip(missed, pipe.execute()):
+            values[i] = value
+            if value is not None:
+                self._queue_refill(keys[i])
+        return values
+
+    def _queue_refill(self, key: str):
+        try:
+            self._refill.put_nowait(key)
+        except queue.Full:
+            return # the key is re-queued by its next miss
+        if self._refill_thread is None or not self._refill_thread.is_alive():
+            self._refill_thread = threading.Thread(target=self._run_refill, name="redis-client-cache-refill", daemon=True)
+            self._refill_thread.start()
+
+    def _run_refill(self):
+        """single GETs on the tracking client, off the request path: the reply is kept & tracked from then on"""
+        while True:
+            key = self._refill.get()
+            tracked = self.tracked
+            if tracked is None:
+                continue
+            try:
+                tracked.get(key)
+            except Exception:
+                pass # breaker open / redis down, the key comes back with its next miss
+
+    def local_stats(self)->dict:
+        return {"local_responses": len(self.local_responses), "local_intents": len(self.local_intents), "local_locks": len(self.local_locks)}
+
+    def client_cache_stats(self)->dict:
+        with self._client_cache_lock:
+            lookups = dict(self._client_cache_lookups)
+        if self.tracked is None:
+            return {"enabled": 0, "size": 0, **lookups}
+        cache = self.tracked.get_cache()
+        return {"enabled": 1, "size": cache.size if cache else 0, **lookups}
+
     #RESPONSE LAYER
+    #keys: response:{scope}:c{corpus generation}g{scope generation}:{hash}, scope = policy_{id} | global
+    #-corpus generation (gen:corpus): bumped when the retrievable corpus changes (vector_ingest), orphans every response
+    #-scope generation (gen:scope:{scope}): one INCR orphans every entry of the scope for all workers
+    #orphaned entries are never read again & expire with their TTL, no scan or delete needed
+    #-keys:{scope}: members of the scope, for batched memory reclaim after a scope bump
+    #-tags:source:{source_id}: responses that cited the source, whatever their scope
+    def _scope(self, policy_id: Optional[str])->str:
+        return f"policy_{policy_id}" if policy_id else "global"
+
+    def _generation_keys(self, policy_id: Optional[str])->tuple[str, str]:
+        return self.CORPUS_GEN_KEY, f"gen:scope:{self._scope(policy_id)}"
+
+    def _response_key(self, query: str, policy_id: Optional[str], generations: tuple[int, int])->str:
+        key_suffix = self._hash(f"{self._normalize(query)}_{policy_id}")
+        return f"response:{self._scope(policy_id)}:c{generations[0]}g{generations[1]}:{key_suffix}"
+
+    def _known_generations(self, policy_id: Optional[str])->tuple[int, int]:
+        """last generations this worker read, no round trip"""
+        return tuple(self._generations.get(k, 0) for k in self._generation_keys(policy_id))
+
+    def _read_generations(self, policy_id: Optional[str])->tuple[int, int]:
+        gen_keys = self._generation_keys(policy_id)
+        current = tuple(int(g or 0) for g in self.client.mget(gen_keys))
+        self._generations.update(zip(gen_keys, current))
+        return current
+
     def get_response(self, query: str, policy_id: Optional[str])->Optional[str]:
-        """stages the reponse for redis"""
-        normalized = self._normalize(query)
-        key_suffix = self._hash(f"{normalized}_{policy_id}")
-        key = f"response:policy_{policy_id}:{key_suffix}" if policy_id else f"response:global:{key_suffix}"
+        """
+        stages the reponse for redis
+        -one batch: generations + entry (key built from the last generations this worker saw) + the intent,
+        prefetched for classify_intent in case this is a miss. a bump made by any process is honoured on the next read
+        -tracking client on: keys of the batch held by the client side cache are answered from process memory,
+        only the rest cost the round trip (see _hot_get)
+        -the generations read here are kept for this thread's set_response: an answer built from corpus N is stored
+        under corpus N even if the corpus moves on mid request (it's orphaned right away instead of served as fresh)
+        -breaker open or redis error: the local mirror, keyed by the last generations this worker saw
+        """
+        if not self.breaker.allow():
+            return self._get_local_response(query, policy_id)
+        gen_keys = self._generation_keys(policy_id)
 
         try:
-            data = self.client.get(key)
-            if data:
-                logger.info({"event": "cache_hit", "layer": "response"})
-                return json.loads(data)
-            logger.info({"event": "cache_miss", "layer": "response"})
+            guess = self._known_generations(policy_id)
+            intent_key = self._intent_key(query)
+            *remote, data, intent = self._hot_get([*gen_keys, self._response_key(query, policy_id, guess), intent_key])
+            self._local.intent = (intent_key, intent)
+            current = tuple(int(g or 0) for g in remote)
+            if current != guess: # corpus or scope bumped since this worker last looked
+                self._generations.update(zip(gen_keys, current))
+                data = self._hot_get([self._response_key(query, policy_id, current)])[0]
+            self._local.generations = (self._scope(policy_id), current)
         except Exception as e:
             logger.error({"event": "redis_read_error", "layer": "response", "error": type(e).__name__})
+            return self._get_local_response(query, policy_id)
+        if data:
+            self.local_responses.set(self._response_key(query, policy_id, current), data)
+        return self._decode_response(data)
+
+    def _get_local_response(self, query: str, policy_id: Optional[str])->Optional[dict]:
+        generations = self._known_generations(policy_id)
+        self._local.generations = (self._scope(policy_id), generations) # set_response stores the answer under the same key
+        data = self.local_responses.get(self._response_key(query, policy_id, generations))
+        CACHE_LOOKUPS.inc(cache_layer="response_local", result="hit" if data else "miss")
+        try:
+            return self.codec.decode(data, "response") if data else None
+        except CodecError:
             return None
-        
 
-    def set_response(self, query: str, policy_id: Optional[str], response_dict: dict, is_negative: bool = False):
-        """saves response to redis"""
-        payload = json.dumps(response_dict)
+    def _decode_response(self, data: Optional[bytes])->Optional[dict]:
+        try:
+            if data:
+                logger.debug({"event": "cache_hit", "layer": "response"})
+                CACHE_LOOKUPS.inc(cache_layer="response", result="hit")
+                return self.codec.decode(data, "response")
+        except CodecError as e: # written by a newer worker during a rolling upgrade
+            logger.warning({"event": "cache_decode_error", "layer": "response", "error": str(e)})
+        logger.debug({"event": "cache_miss", "layer": "response"})
+        CACHE_LOOKUPS.inc(cache_layer="response", result="miss")
+        return None
+
+    def set_response(self, query: str, policy_id: Optional[str], response_dict: dict, is_negative: bool = False, tags: Iterable[str] = ()):
+        """
+        saves response to redis, entry + scope membership + one tag set per cited source_id in one pipeline
+        (generations = the ones this thread's get_response saw, read fresh when there was no lookup e.g. batch loads).
+        the entry is mirrored in the local fallback cache, the only copy written while the breaker is open
+        """
+        payload = self.codec.encode(response_dict, "response")
 
-        if len(payload) > 100_000: 
+        if len(payload) > self.MAX_VALUE_BYTES: 
             logger.warning({"event": "cache_skip_oversized", "layer": "response", "size": len(payload)})
             return
-        normalized = self._normalize(query)
-        key_suffix = self._hash(f"{normalized}_{policy_id}")
-        key = f"response:policy_{policy_id}:{key_suffix}" if policy_id else f"response:global:{key_suffix}"
-
-        set_key  = f"keys:{policy_id}" if policy_id else "keys:global"
+        scope = self._scope(policy_id)
+        seen = getattr(self._local, "generations", None)
+        self._local.generations = None
 
         base_ttl = self.NEGATIVE_TTL if is_negative else self.RESPONSE_TTL
         ttl = self._get_ttl_with_jitter(base_ttl)
+        index_ttl = self.RESPONSE_TTL + 300 # index sets outlive their longest member, refreshed on every write
 
         try:
-            self.client.setex(key, ttl, payload)
-            self.client.sadd(set_key, key)
+            generations = seen[1] if seen and seen[0] == scope else self._read_generations(policy_id)
+        except Exception:
+            generations = self._known_generations(policy_id)
+        key = self._response_key(query, policy_id, generations)
+        self.local_responses.set(key, payload, min(ttl, self.local_responses.ttl))
+        if not self.breaker.allow():
+            return
+
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.setex(key, ttl, payload)
+            for set_key in (f"keys:{scope}", *(f"tags:source:{tag}" for tag in tags)):
+                pipe.sadd(set_key, key)
+                pipe.expire(set_key, index_ttl)
+            pipe.execute()
             logger.info({"event": "cache_write", "layer": "response", "key": key, "is_negative": is_negative})
         except Exception as e:
             logger.error({"event": "redis_write_error", "layer": "response", "error": type(e).__name__})
 
+    def cached_responses(self, items: list[tuple[str, Optional[str]]])->list[bool]:
+        """which (query, policy_id) pairs currently have a response entry: current generations + pipelined EXISTS, two round trips"""
+        try:
+            gen_keys = sorted({k for _, policy_id in items for k in self._generation_keys(policy_id)})
+            generations = dict(zip(gen_keys, (int(g or 0) for g in self.client.mget(gen_keys)))) if gen_keys else {}
+            pipe = self.client.pipeline(transaction=False)
+            for query, policy_id in items:
+                pipe.exists(self._response_key(query, policy_id, tuple(generations[k] for k in self._generation_keys(policy_id))))
+            return [bool(n) for n in pipe.execute()]
+        except Exception:
+            return [False]*len(items)
+
+    #POPULAR QUERIES (cache warmer)
+    def record_query(self, query: str, policy_id: Optional[str]):
+        """+1 for the normalized query in today's sorted set, one pipelined round trip, off the request path (background task)"""
+        key = f"popular:queries:{time.strftime('%Y%m%d', time.gmtime())}"
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.zincrby(key, 1, json.dumps([self._normalize(query), policy_id]))
+            pipe.expire(key, (self.POPULAR_DAYS+1)*86400)
+            if random.random() < 0.01: # occasional trim keeps the long tail from growing the set without bound
+                pipe.zremrangebyrank(key, 0, -(self.POPULAR_MAX+1))
+            pipe.execute()
+        except Exception as e:
+            logger.error({"event": "redis_write_error", "layer": "popular_queries", "error": type(e).__name__})
+
+    def top_queries(self, n: int, days: Optional[int] = None)->list[tuple[str, Optional[str], float]]:
+        """most frequent (normalized query, policy_id, count) over the last <days> daily sets"""
+        now = time.time()
+        day_keys = [f"popular:queries:{time.strftime('%Y%m%d', time.gmtime(now-d*86400))}" for d in range(days or self.POPULAR_DAYS)]
+        tmp_key = f"popular:queries:union:{uuid.uuid4().hex}"
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.zunionstore(tmp_key, day_keys)
+            pipe.zrevrange(tmp_key, 0, n-1, withscores=True)
+            pipe.delete(tmp_key)
+            ranked = pipe.execute()[1]
+        except Exception as e:
+            logger.error({"event": "redis_read_error", "layer": "popular_queries", "error": type(e).__name__})
+            return []
+        return [(*json.loads(member), score) for member, score in ranked]
+
+    def _intent_key(self, query: str)->str:
+        return f"intent:{self._hash(self._normalize(query))}"
+
     def get_intent(self, query: str)->Optional[str]:
-        key = f"intent:{self._hash(self._normalize(query))}"
+        key = self._intent_key(query)
+        prefetched = getattr(self._local, "intent", None) # read along with the response lookup of this request
+        self._local.intent = None
+        if not self.breaker.allow():
+            return self._get_local_intent(key)
         try:
-            data = self.client.get(key)
+            data = prefetched[1] if prefetched and prefetched[0] == key else self._hot_get([key])[0]
             if data: 
-                logger.info({"event": "cache_hit", "layer": "intent"})
-                return data
+                logger.debug({"event": "cache_hit", "layer": "intent"})
+                CACHE_LOOKUPS.inc(cache_layer="intent", result="hit")
+                intent = data.decode()
+                self.local_intents.set(key, intent)
+                return intent
+            CACHE_LOOKUPS.inc(cache_layer="intent", result="miss")
             return None
 
-        except Exception: return None
+        except Exception: return self._get_local_intent(key)
+
+    def _get_local_intent(self, key: str)->Optional[str]:
+        intent = self.local_intents.get(key)
+        CACHE_LOOKUPS.inc(cache_layer="intent_local", result="hit" if intent else "miss")
+        return intent
     
     
     def set_intent(self, query: str, intent: str):
-        key = f"intent:{self._hash(self._normalize(query))}"
+        key = self._intent_key(query)
         ttl = self._get_ttl_with_jitter(self.INTENT_TTL)
+        self.local_intents.set(key, intent)
+        if not self.breaker.allow():
+            return
         try:
             self.client.setex(key, ttl, intent)
         except Exception:
             pass
     
-    def get_embedding(self, text: str) -> Optional[list]:
-        key = f"embed:{self.EMBED_VERSION}:{self._hash(self._normalize(text))}"
+    def get_embedding(self, text: str, version: Optional[str] = None) -> Optional[list]:
+        #version comes from the embedding backend, vectors from different models must never mix
+        key = f"embed:{version or self.EMBED_VERSION}:{self._hash(self._normalize(text))}"
         try:
             data = self.client.get(key)
             if data:
-                logger.info({"event": "cache_hit", "layer": "embedding"})
-                return json.loads(data)
+                logger.debug({"event": "cache_hit", "layer": "embedding"})
+                CACHE_LOOKUPS.inc(cache_layer="embedding", result="hit")
+                return self.codec.decode(data, "embedding")
+            CACHE_LOOKUPS.inc(cache_layer="embedding", result="miss")
             return None
         except Exception:
             return None
 
-    def set_embedding(self, text: str, embedding: list):
-        payload = json.dumps(embedding)
-        if len(payload) > 100_000: return
-        key = f"embed:{self.EMBED_VERSION}:{self._hash(self._normalize(text))}"
+    def set_embedding(self, text: str, embedding: list, version: Optional[str] = None):
+        payload = self.codec.encode(embedding, "embedding")
+        if len(payload) > self.MAX_VALUE_BYTES: return
+        key = f"embed:{version or self.EMBED_VERSION}:{self._hash(self._normalize(text))}"
         ttl = self._get_ttl_with_jitter(self.EMBED_TTL)
         try:
             self.client.setex(key, ttl, payload)
         except Exception:
             pass
     
-    def invalidate_policy(self, policy_id: str):
-        """if a policy is changed or drop, we have to delete corresponding record in cache layer"""
-        set_key = f"keys:policy_{policy_id}" if policy_id else "keys:global"
-        try:
-            count = 0
-            for key in self.client.sscan_iter(set_key):
-                self.client.delete(key)
-                count +=1
+    #PRINCIPAL LAYER (auth)
+    def get_principal(self, user_id: str, iat: int)->Optional[dict]:
+        """cached user principal for one token (user id + issued-at)"""
+        try:
+            data = self.client.get(f"principal:{user_id}:{iat}")
+            CACHE_LOOKUPS.inc(cache_layer="principal", result="hit" if data else "miss")
+            return self.codec.decode(data, "principal") if data else None
+        except Exception:
+            return None
+
+    def set_principal(self, user_id: str, iat: int, principal: dict):
+        """entry + its membership in keys:principal:{user_id} in one MULTI, invalidate_principal never sees one without the other"""
+        key = f"principal:{user_id}:{iat}"
+        try:
+            pipe = self.client.pipeline(transaction=True)
+            pipe.setex(key, self.PRINCIPAL_TTL, self.codec.encode(principal, "principal"))
+            pipe.sadd(f"keys:principal:{user_id}", key)
+            pipe.expire(f"keys:principal:{user_id}", self.PRINCIPAL_TTL)
+            pipe.execute()
+        except Exception:
+            pass
+
+    def invalidate_principal(self, user_id: str):
+        """role change / deactivation: drop every cached principal of the user, across all tokens & workers"""
+        set_key = f"keys:principal:{user_id}"
+        try:
+            keys = list(self.client.sscan_iter(set_key))
+            if keys: self.client.delete(*keys)
             self.client.delete(set_key)
-            logger.info({"event": "cache_invalidated", "policy_id": policy_id, "keys_removed": count})
+            logger.info({"event": "principal_invalidated", "user_id": user_id, "keys_removed": len(keys)})
+        except Exception as e:
+            logger.error({"event": "redis_invalidate_error", "layer": "principal", "error": type(e).__name__})
+
+    def _unlink_members(self, set_key: str)->int:
+        """UNLINK every key listed in <set_key> & the set itself, INVALIDATE_BATCH keys per command (memory freed off the main thread)"""
+        count = 0
+        batch = []
+        for key in self.client.sscan_iter(set_key, count=self.INVALIDATE_BATCH):
+            batch.append(key)
+            if len(batch) >= self.INVALIDATE_BATCH:
+                count += self.client.unlink(*batch)
+                batch = []
+        pipe = self.client.pipeline(transaction=False)
+        if batch:
+            pipe.unlink(*batch)
+        pipe.unlink(set_key)
+        results = pipe.execute() # always runs: the set itself is unlinked even when the last batch is empty
+        if batch:
+            count += results[0]
+        return count
+
+    def invalidate_source(self, source_id: str)->int:
+        """drop every cached response that cited the regulation / policy, in any scope"""
+        self.local_responses.clear() # the mirror has no tag index, a rare admin action can afford to drop it
+        try:
+            count = self._unlink_members(f"tags:source:{source_id}")
+            logger.info({"event": "cache_invalidated", "source_id": source_id, "keys_removed": count})
+            return count
+        except Exception as e:
+            logger.error({"event": "redis_invalidate_error", "layer": "response", "error": type(e).__name__})
+            return 0
+
+    def bump_corpus_generation(self)->Optional[int]:
+        """the retrievable corpus changed (re-ingest): every cached response is orphaned at once, on every worker. returns the new generation"""
+        try:
+            generation = self.client.incr(self.CORPUS_GEN_KEY)
+            self._generations[self.CORPUS_GEN_KEY] = generation
+            logger.info({"event": "cache_corpus_generation_bumped", "generation": generation})
+            return generation
+        except Exception as e:
+            logger.error({"event": "redis_invalidate_error", "layer": "corpus", "error": type(e).__name__})
+            return None
+
+    def invalidate_scope(self, policy_id: Optional[str])->Optional[int]:
+        """O(1): bumps the scope generation, every worker misses the old entries from its next read. returns the new generation"""
+        gen_key = f"gen:scope:{self._scope(policy_id)}"
+        try:
+            generation = self.client.incr(gen_key)
+            self._generations[gen_key] = generation
+            return generation
+        except Exception as e:
+            logger.error({"event": "redis_invalidate_error", "layer": "response", "error": type(e).__name__})
+            return None
+
+    def invalidate_policy(self, policy_id: Optional[str])->dict:
+        """
+        if a policy is changed or drop, we have to delete corresponding record in cache layer
+        -policy scope: generation bump (logical, instant) then batched UNLINK of the orphaned entries (memory)
+        -global scope: responses tagged with the policy as a cited source
+        policy_id None = the whole global scope
+        """
+        stats = {"policy_id": policy_id, "generation": self.invalidate_scope(policy_id), "tagged_removed": 0, "scope_removed": 0}
+        try:
+            if policy_id:
+                stats["tagged_removed"] = self.invalidate_source(policy_id)
+            stats["scope_removed"] = self._unlink_members(f"keys:{self._scope(policy_id)}")
+            logger.info({"event": "cache_invalidated", **stats})
         except Exception as e:
             logger.error({"event": "redis_invalidate_error", "error": type(e).__name__})
+        return stats
 
 
 cache_service = CacheService()
 
+def _collect_client_cache():
+    for stat, value in cache_service.client_cache_stats().items():
+        CLIENT_CACHE.set(value, stat=stat)
+
+def _collect_breaker():
+    for stat, value in {**cache_service.breaker.stats(), **cache_service.local_stats()}.items():
+        BREAKER_STATE.set(value, stat=stat)
+
+metrics_registry.register_collector(_collect_client_cache)
+metrics_registry.register_collector(_collect_breaker)
+
 
 
 
@@ -0,0 +1,157 @@
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from app.services.metrics_registry import metrics_registry
+
+try:
+    import msgpack #optional, compact binary serializer (~30-50% smaller than json for the response & embedding layers)
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard #optional, zlib (stdlib) is the fallback compressor
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger("json_logger")
+
+#write format. "json" writes plain json (no header) below CACHE_COMPRESS_MIN_BYTES, readable by workers older than
+#the codec, & zlib compressed json with a header above it (older workers count those as misses, they swallow decode errors).
+#rolling upgrade = deploy with CACHE_CODEC=json, then switch to msgpack once every worker reads headers
+CACHE_CODEC = os.getenv("CACHE_CODEC", "msgpack" if msgpack else "json").lower()
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", 1024)) # smaller values are stored uncompressed
+CACHE_ZSTD_LEVEL = int(os.getenv("CACHE_ZSTD_LEVEL", 3))
+
+#header: magic, format version, flags (serializer id low nibble, compressor id high nibble), then the payload.
+#legacy values are plain json text & never start with the magic byte
+MAGIC = 0xCA
+FORMAT_VERSION = 1
+
+CODEC_LATENCY = metrics_registry.histogram("ball_cache_codec_ms", "cache value encode / decode time", ("layer", "op"),
+                                           buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+CODEC_BYTES = metrics_registry.counter("ball_cache_codec_bytes_total", "cache value bytes written, serialized vs stored (ratio = compression)", ("layer", "kind"))
+
+
+class CodecError(ValueError):
+    """value written by a newer format or an unavailable codec, callers treat it as a miss"""
+
+
+def _json_dumps(obj)->bytes:
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+def _msgpack_dumps(obj)->bytes:
+    return msgpack.packb(obj, use_bin_type=True)
+
+def _msgpack_loads(data: bytes):
+    return msgpack.unpackb(data, raw=False)
+
+
+class _Zstd:
+    """zstandard (de)compressor objects aren't thread safe, one pair per thread"""
+
+    def __init__(self, level: int):
+        self.level = level
+        self._local = threading.local()
+
+    def compress(self, data: bytes)->bytes:
+        if not hasattr(self._local, "compressor"):
+            self._local.compressor = zstandard.ZstdCompressor(level=self.level)
+        return self._local.compressor.compress(data)
+
+    def decompress(self, data: bytes)->bytes:
+        if not hasattr(self._local, "decompressor"):
+            self._local.decompressor = zstandard.ZstdDecompressor()
+        return self._local.decompressor.decompress(data)
+
+
+#id -> (name, dumps, loads), ids are part of the stored format: never reuse one
+SERIALIZERS = {
+    0: ("json", _json_dumps, json.loads),
+    1: ("msgpack", _msgpack_dumps, _msgpack_loads),
+}
+#compressor ids: 0 none, 1 zstd (per codec instance, it carries the level), 2 zlib
+COMPRESSORS = {
+    2: ("zlib", zlib.compress, zlib.decompress),
+}
+
+
+class CacheCodec:
+    """
+    **Cache value codec**
+
+    -encode: serialize (json / msgpack), compress above CACHE_COMPRESS_MIN_BYTES (msgpack: zstd, zlib without zstandard,
+    json: zlib), prefix a 3 byte versioned header. uncompressed json is written header-less (legacy format)
+    -decode: reads every format ever written, legacy header-less json included
+    -metrics per layer: encode/decode time, serialized vs stored bytes
+    """
+
+    def __init__(self, serializer: str = CACHE_CODEC, compress_min_bytes: int = CACHE_COMPRESS_MIN_BYTES, zstd_level: int = CACHE_ZSTD_LEVEL):
+        if serializer == "msgpack" and msgpack is None:
+            logger.warning({"event": "cache_codec_unavailable", "codec": serializer, "fallback": "json"})
+            serializer = "json"
+        if serializer not in ("json", "msgpack"):
+            raise ValueError(f"unknown CACHE_CODEC: {serializer}")
+        self.serializer = serializer
+        self.compress_min_bytes = compress_min_bytes
+        self._zstd = _Zstd(zstd_level) if zstandard else None
+        self._compressor_id = 1 if zstandard else 2
+
+    def _compressor(self, compressor_id: int):
+        if compressor_id == 1:
+            if self._zstd is None:
+                raise CodecError("zstd value, zstandard is not installed")
+            return self._zstd.compress, self._zstd.decompress
+        if compressor_id not in COMPRESSORS:
+            raise CodecError(f"unknown compressor {compressor_id}")
+        _, compress, decompress = COMPRESSORS[compressor_id]
+        return compress, decompress
+
+    def encode(self, obj, layer: str)->bytes:
+        t0 = time.perf_counter()
+        if self.serializer == "json":
+            #zlib: stdlib, any worker with the codec reads it even without zstandard installed
+            serializer_id, data, compress_with = 0, _json_dumps(obj), 2
+        else:
+            serializer_id, data, compress_with = 1, _msgpack_dumps(obj), self._compressor_id
+        compressor_id = 0
+        body = data
+        if len(data) >= self.compress_min_bytes:
+            compressed = self._compressor(compress_with)[0](data)
+            if len(compressed) < len(data): # incompressible values stay as they are
+                compressor_id, body = compress_with, compressed
+        if serializer_id == 0 and compressor_id == 0:
+            stored = data # legacy format, readable by every worker version
+        else:
+            stored = bytes((MAGIC, FORMAT_VERSION, serializer_id | compressor_id << 4)) + body
+
+        CODEC_LATENCY.observe((time.perf_counter()-t0)*1000, layer=layer, op="encode")
+        CODEC_BYTES.inc(len(data), layer=layer, kind="serialized")
+        CODEC_BYTES.inc(len(stored), layer=layer, kind="stored")
+        return stored
+
+    def decode(self, value: bytes, layer: str):
+        t0 = time.perf_counter()
+        if not value or value[0] != MAGIC:
+            obj = json.loads(value) # header-less json, written before the codec or with CACHE_CODEC=json
+        else:
+            if len(value) < 3 or value[1] > FORMAT_VERSION:
+                raise CodecError(f"unsupported cache format version {value[1] if len(value) > 1 else None}")
+            flags = value[2]
+            if flags & 0x0F not in SERIALIZERS:
+                raise CodecError(f"unknown serializer {flags & 0x0F}")
+            _, _, loads = SERIALIZERS[flags & 0x0F]
+            if loads is _msgpack_loads and msgpack is None:
+                raise CodecError("msgpack value, msgpack is not installed")
+            body = value[3:]
+            if flags >> 4:
+                body = self._compressor(flags >> 4)[1](body)
+            obj = loads(body)
+
+        CODEC_LATENCY.observe((time.perf_counter()-t0)*1000, layer=layer, op="decode")
+        return obj
+
+
+cache_codec = CacheCodec()
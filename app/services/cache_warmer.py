@@ -0,0 +1,241 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from app.db import session as db_session
+from app.services.cache import cache_service
+from app.services.metrics_registry import metrics_registry, REQUESTS_IN_FLIGHT
+from app.services.telemetry import TelemetryService
+
+logger = logging.getLogger("json_logger")
+
+WARM_ON_STARTUP = os.getenv("CACHE_WARM_ON_STARTUP", "true").lower() == "true"
+WARM_TOP_N = int(os.getenv("CACHE_WARM_TOP_N", 200)) # most frequent normalized queries replayed per run
+WARM_CONCURRENCY = int(os.getenv("CACHE_WARM_CONCURRENCY", 2))
+WARM_RATE_PER_S = float(os.getenv("CACHE_WARM_RATE_PER_S", 2.0)) # replay starts per second, bounds the openai spend rate
+#user traffic first: the warmer pauses while this worker serves at least this many requests
+WARM_MAX_IN_FLIGHT = int(os.getenv("CACHE_WARM_MAX_IN_FLIGHT", 4))
+WARM_POLL_INTERVAL = float(os.getenv("CACHE_WARM_POLL_INTERVAL", 15)) # seconds between checks for a pending warm request
+#the run lock is short lived & refreshed every WARM_LOCK_TTL/3 while the run lasts (a run of top_n queries at
+#WARM_RATE_PER_S can take far longer than any fixed ttl), a crashed worker frees it within WARM_LOCK_TTL
+WARM_LOCK_TTL = int(os.getenv("CACHE_WARM_LOCK_TTL", 120))
+WARM_PROGRESS_EVERY = 25
+
+#shared by every worker (and ingest.py): a pending request, the run lock & the last run's status
+REQUEST_KEY = "cache:warm:requested"
+LOCK_KEY = "lock:cache_warm"
+STATUS_KEY = "cache:warm:status"
+
+WARM_QUERIES = metrics_registry.counter("ball_cache_warm_queries_total", "queries replayed by the cache warmer", ("result",))
+WARM_PROGRESS = metrics_registry.gauge("ball_cache_warm", "current / last cache warm run", ("stat",))
+
+
+class _Governor:
+    """paces replay starts to WARM_RATE_PER_S & holds them back while the worker is busy with user requests"""
+
+    def __init__(self, rate_per_s: float, max_in_flight: int, stopping: threading.Event):
+        self.interval = 1/rate_per_s if rate_per_s > 0 else 0.0
+        self.max_in_flight = max_in_flight
+        self.stopping = stopping
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+        self.paused_s = 0.0
+
+    def wait(self)->bool:
+        """False when the warmer is stopping"""
+        with self._lock:
+            now = time.monotonic()
+            delay = max(0.0, self._next - now)
+            self._next = max(now, self._next) + self.interval
+        if delay and self.stopping.wait(delay):
+            return False
+
+        t0 = time.monotonic()
+        while REQUESTS_IN_FLIGHT.value() >= self.max_in_flight:
+            if self.stopping.wait(0.2):
+                return False
+        self.paused_s += time.monotonic()-t0
+        return not self.stopping.is_set()
+
+
+class CacheWarmer:
+    """
+    **Cache warmer**
+
+    -input: the most frequent normalized queries of the last days (CacheService.record_query, fed by /audit)
+    -replays them through ComplianceAgent.analyze in a background thread, bounded concurrency & rate,
+    paused while user requests are in flight, so the intent, embedding & response layers are filled before users ask
+    -triggers: request() from any process (startup, ingest, admin endpoint) sets a redis flag, the first worker to
+    pick it up runs the warm under a redis lock, the others skip it
+    -report: per query outcome, tokens & cost spent, traffic weighted response hit rate before/after (STATUS_KEY, logs, metrics)
+    """
+
+    def __init__(self):
+        self.agent = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._wake = threading.Event()
+
+    def request(self, reason: str, top_n: Optional[int] = None)->bool:
+        """queue a warm run, picked up by one api worker within WARM_POLL_INTERVAL. False if one is already pending"""
+        try:
+            queued = cache_service.client.set(REQUEST_KEY, json.dumps({"reason": reason, "top_n": top_n, "requested_at": time.time()}), nx=True, ex=3600)
+        except Exception as e:
+            logger.error({"event": "cache_warm_request_failed", "reason": reason, "error": type(e).__name__})
+            return False
+        self._wake.set()
+        logger.info({"event": "cache_warm_requested", "reason": reason, "queued": bool(queued)})
+        return bool(queued)
+
+    def status(self)->Optional[dict]:
+        try:
+            data = cache_service.client.get(STATUS_KEY)
+            return json.loads(data) if data else None
+        except Exception:
+            return None
+
+    def _publish(self, status: dict):
+        try:
+            cache_service.client.set(STATUS_KEY, json.dumps(status), ex=7*86400)
+        except Exception:
+            pass
+
+    def warm(self, reason: str, top_n: Optional[int] = None)->Optional[dict]:
+        """one warm run in the calling thread, None when another worker holds the lock"""
+        if self.agent is None:
+            return None
+        token = cache_service.acquire_lock(LOCK_KEY, expire=WARM_LOCK_TTL)
+        if not token:
+            logger.info({"event": "cache_warm_skipped", "reason": reason, "detail": "running on another worker"})
+            return None
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._hold_lock, args=(token, done), name="cache-warm-lock", daemon=True)
+        heartbeat.start()
+        try:
+            return self._warm(reason, top_n or WARM_TOP_N)
+        finally:
+            done.set()
+            heartbeat.join()
+            cache_service.release_lock(LOCK_KEY, token)
+            WARM_PROGRESS.set(0, stat="running")
+
+    def _hold_lock(self, token: str, done: threading.Event):
+        """refreshes the run lock until the run ends, stops once it's lost (redis flushed, expired during an outage)"""
+        while not done.wait(WARM_LOCK_TTL/3):
+            if cache_service.extend_lock(LOCK_KEY, token, WARM_LOCK_TTL) is False:
+                logger.warning({"event": "cache_warm_lock_lost", "detail": "another worker may start a run"})
+                return
+
+    def _warm(self, reason: str, top_n: int)->dict:
+        popular = cache_service.top_queries(top_n)
+        items = [(query, policy_id) for query, policy_id, _ in popular]
+        weights = [count for _, _, count in popular]
+        total_weight = sum(weights) or 1.0
+
+        def hit_rate(cached: list[bool])->float:
+            return round(sum(w for w, c in zip(weights, cached) if c)/total_weight, 4)
+
+        cached_before = cache_service.cached_responses(items)
+        status = {
+            "run_id": uuid.uuid4().hex[:12], "reason": reason, "state": "running", "started_at": time.time(),
+            "queries": len(items), "done": 0, "warmed": 0, "already_cached": 0, "failed": 0,
+            "layers": {}, "tokens": 0, "cost_usd": 0.0,
+            "cached_before": sum(cached_before), "hit_rate_before": hit_rate(cached_before),
+        }
+        lock = threading.Lock()
+        governor = _Governor(WARM_RATE_PER_S, WARM_MAX_IN_FLIGHT, self._stopping)
+        WARM_PROGRESS.set(1, stat="running")
+        WARM_PROGRESS.set(len(items), stat="queries")
+        WARM_PROGRESS.set(0, stat="done")
+        logger.info({"event": "cache_warm_start", "run_id": status["run_id"], "reason": reason, "queries": len(items), "hit_rate_before": status["hit_rate_before"]})
+        self._publish(status)
+
+        def replay(item):
+            query, policy_id = item
+            if not governor.wait():
+                return
+            outcome, summary = self._replay(query, policy_id)
+            WARM_QUERIES.inc(result=outcome)
+            with lock:
+                status["done"] += 1
+                status[outcome] += 1
+                layer = (summary or {}).get("cache_layer") or "none"
+                status["layers"][layer] = status["layers"].get(layer, 0) + 1
+                if summary:
+                    status["tokens"] += summary["prompt_tokens"] + summary["completion_tokens"]
+                    status["cost_usd"] += summary["cost_usd"]
+                done = status["done"]
+                WARM_PROGRESS.set(done, stat="done")
+                if done % WARM_PROGRESS_EVERY == 0:
+                    logger.info({"event": "cache_warm_progress", "run_id": status["run_id"], "done": done, "queries": len(items)})
+                    self._publish(status)
+
+        t0 = time.time()
+        with ThreadPoolExecutor(max_workers=WARM_CONCURRENCY, thread_name_prefix="cache-warm") as pool:
+            list(pool.map(replay, items))
+
+        cached_after = cache_service.cached_responses(items)
+        status.update({
+            "state": "stopped" if self._stopping.is_set() else "finished",
+            "duration_s": round(time.time()-t0, 2),
+            "paused_for_traffic_s": round(governor.paused_s, 2),
+            "cost_usd": round(status["cost_usd"], 6),
+            "cached_after": sum(cached_after),
+            "hit_rate_after": hit_rate(cached_after),
+        })
+        status["hit_rate_gain"] = round(status["hit_rate_after"]-status["hit_rate_before"], 4)
+        self._publish(status)
+        logger.info({"event": "cache_warm_complete", **{k: v for k, v in status.items() if k != "started_at"}})
+        return status
+
+    def _replay(self, query: str, policy_id: Optional[str])->tuple[str, Optional[dict]]:
+        telemetry = TelemetryService(request_id=f"warm-{uuid.uuid4()}")
+        db = db_session.SessionLocal()
+        try:
+            self.agent.analyze(query, db, policy_filter_id=policy_id, telemetry=telemetry)
+        except Exception as e:
+            logger.error({"event": "cache_warm_query_failed", "error": type(e).__name__})
+            return "failed", None
+        finally:
+            db.close()
+        summary = telemetry.get_summary()
+        if summary["cache_layer"] in ("response", "response_coalesced"):
+            return "already_cached", summary
+        #errors are cached as short lived negatives only, they don't count as warmed
+        return ("failed" if summary["error_type"] else "warmed"), summary
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(WARM_POLL_INTERVAL)
+            self._wake.clear()
+            if self._stopping.is_set():
+                return
+            try:
+                pending = cache_service.client.getdel(REQUEST_KEY) # only one worker gets the request
+                if pending:
+                    pending = json.loads(pending)
+                    self.warm(pending["reason"], pending.get("top_n"))
+            except Exception as e:
+                logger.error({"event": "cache_warm_error", "error": type(e).__name__})
+
+    def start(self, agent):
+        self.agent = agent
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="cache-warmer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """in flight replays finish, queued ones are dropped"""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+
+cache_warmer = CacheWarmer()
@@ -1,6 +1,6 @@
 import logging 
 import json
-from openai import OpenAI
+from openai import OpenAI, NOT_GIVEN
 from pydantic import BaseModel, ValidationError
 from typing import List, Literal, Optional
 import os
@@ -11,15 +11,26 @@ from app.services.retriever import retrieve_balanced_chunks
 from dotenv import load_dotenv
 from functools import lru_cache
 from app.services.telemetry import TelemetryService
+from app.services.openai_transport import openai_http_client
 from collections import OrderedDict
 from contextlib import nullcontext
 import time
 from app.services.cache import cache_service
+from app.services.token_budget import build_budgeted_context, CONTEXT_TOKEN_BUDGET
 
 # logging.basicConfig(level=logging.INFO, format="%(asctime)s - [%(levelname)s] - %(message)s")
 # logger = logging.getLogger(__name__)
 logger = logging.getLogger("json_logger")
 LLM_MODEL = "gpt-4o-mini"
+
+#MODEL CASCADE
+#"single": every audit goes to LLM_MODEL with the full prompt (default)
+#"cascade": cheap first pass with a minimal prompt, escalated only when the first answer is LOW confidence or AMBIGUOUS
+AUDIT_MODE = os.getenv("AUDIT_MODE", "single").lower()
+CASCADE_FAST_MODEL = os.getenv("CASCADE_FAST_MODEL", LLM_MODEL)
+CASCADE_ESCALATION_MODEL = os.getenv("CASCADE_ESCALATION_MODEL", "gpt-4o")
+CASCADE_FAST_MAX_TOKENS = int(os.getenv("CASCADE_FAST_MAX_TOKENS", 300))
+CASCADE_FAST_CONTEXT_BUDGET = int(os.getenv("CASCADE_FAST_CONTEXT_BUDGET", 1200))
 BANK_NAME = os.getenv("BANK NAME", "BAL")
 
 #Pydantic contracts - first level of anti-hallucination measure
@@ -34,6 +45,54 @@ class ComplianceResponse(BaseModel):
 class IntentResponse(BaseModel):
     category: Literal["COMPLIANCE_AUDIT", "SYSTEM_METADATA", "REJECT"]
 
+#PROMPT LAYOUT
+#openai caches the longest identical leading prefix of a request (min 1024 tokens, 128 token steps).
+#everything static lives in the system message, built once at import & byte-identical across calls;
+#per-request data (query + sources) always goes last, in the user message.
+#the audit instructions are well below the minimum, so today only cached_tokens accounting is in place: the prompt
+#is the auditor's judgment & is not padded to reach the cache, any rubric change goes through its own review
+
+INTENT_SYSTEM_PROMPT = """You are a Query Router for a Banking Compliance AI.
+Classify the user query into exactly one category:
+1. COMPLIANCE_AUDIT: Questions comparing internal policies to regulations.
+2. SYSTEM_METADATA: Questions asking "What is the bank's name?", "Who are you?".
+3. REJECT: Questions unrelated to banking/compliance (weather, jokes).
+OUTPUT JSON: {"category": "COMPLIANCE_AUDIT" | "SYSTEM_METADATA" | "REJECT"}"""
+
+AUDIT_INSTRUCTIONS = """Your are senior compliance officer for a tier-1 bank. Audit Internal policies against Regulatory obligations.
+
+INSTRUCTIONS:
+-Compare Policies vs Regulations
+-Mark PASS if fully compliant
+-Mark FAIL if a specific requirement is missing or contradicted
+-Mark AMBIGUOUS if language is vague
+-MARK INCONCLUSIVE if the retrieved context lacks sufficient info
+-Cite specific sources numbers(eg. source 1) for every claim
+-IGNORE external knowledge. Use only provided sources"""
+
+#single source of truth for the output contract (intent is added server side, never asked from the model)
+AUDIT_OUTPUT_SCHEMA = """{
+    "status": "PASS" | "FAIL" | "AMBIGUOUS" | "INCONCLUSIVE",
+    "confidence": "HIGH" | "MEDIUM" | "LOW",
+    "reasoning": "Explanation...",
+    "citations": ["Source 1", "Source 2"]
+}"""
+
+AUDIT_SYSTEM_PROMPT = f"{AUDIT_INSTRUCTIONS}\n\nOUTPUT JSON SCHEMA:\n{AUDIT_OUTPUT_SCHEMA}"
+
+#first pass of the cascade: shorter instructions + the same schema
+AUDIT_FAST_SYSTEM_PROMPT = f"""You are a compliance officer. Audit the POLICY sources against the REGULATION sources for the QUERY.
+PASS: fully compliant. FAIL: a requirement is missing, waived or contradicted. AMBIGUOUS: vague policy language.
+INCONCLUSIVE: sources are insufficient. Use LOW confidence whenever you are unsure.
+Cite sources as "Source N". Use only the provided sources. Reasoning under 80 words.
+
+OUTPUT JSON SCHEMA:
+{AUDIT_OUTPUT_SCHEMA}"""
+PROMPT_CACHE_MIN_TOKENS = 1024
+#routes requests with the same prefix to the same cache shard, bump the suffix whenever the prompt changes
+AUDIT_PROMPT_CACHE_KEY = "ball-audit-v2"
+INTENT_PROMPT_CACHE_KEY = "ball-intent-v1"
+
 # @lru_cache(maxsize=512)
 # def _cache_intent_classification(query: str, api_key: str, telemetry:Optional[TelemetryService]=None)->str:
 #     client = OpenAI(api_key=api_key)
@@ -62,18 +121,33 @@ class IntentResponse(BaseModel):
 #             logger.error({"event": "intent_classification_failed", "error": str(e)})
 #             telemetry.set_error("INTENT_FAILURE")
 #             return "ERROR"
-        
+
+#"Source N" inside a citation ("source 2", "Source 2 (policy)"...), shared by every citation parser
+SOURCE_CITATION = re.compile(r'source (\d+)', re.IGNORECASE)
+
+def cited_source_ids(citations: List[str], chunks: List)->List[str]:
+    """regulation / policy ids behind the "Source N" citations, the response cache tags its entry with them"""
+    ids = []
+    for cite in citations:
+        match = SOURCE_CITATION.search(cite)
+        if match and 0 < int(match.group(1)) <= len(chunks):
+            source_id = str(chunks[int(match.group(1))-1][0].source_id)
+            if source_id not in ids:
+                ids.append(source_id)
+    return ids
+
 class ComplianceAgent:
     def __init__(self):
         self.api_key = os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             raise ValueError("openai api key not found.")
-        self.client = OpenAI(api_key=self.api_key)
+        self.client = OpenAI(api_key=self.api_key, http_client=openai_http_client())
         #replacing initial LRU cache approach
         self._intent_cache = OrderedDict() 
         self._cache_max_size = 1000
 
 
+
         
     def classify_intent(self, query: str, telemetry: Optional[TelemetryService]=None)->str:
         #check cache layers first
@@ -85,24 +159,17 @@ class ComplianceAgent:
         
         cm = telemetry.measure("routing") if telemetry else nullcontext()
         with cm:
-            system_prompt="""
-                            You are a Query Router for a Banking Compliance AI.
-                            Classify the user query into exactly one category:
-                            1. COMPLIANCE_AUDIT: Questions comparing internal policies to regulations.
-                            2. SYSTEM_METADATA: Questions asking "What is the bank's name?", "Who are you?".
-                            3. REJECT: Questions unrelated to banking/compliance (weather, jokes).
-                            OUTPUT JSON: {"category": "COMPLIANCE_AUDIT" | "SYSTEM_METADATA" | "REJECT"}
-                            """
             try:
                 #LLM Toggle 
                 if os.getenv("MOCK_LLM", "false").lower() == "true" : intent = "COMPLIANCE_AUDIT"
                 else:
                     response= self.client.chat.completions.create(
                         model=LLM_MODEL,
-                        messages=[{"role": "system", "content": system_prompt},
+                        messages=[{"role": "system", "content": INTENT_SYSTEM_PROMPT},
                                 {"role": "user", "content": query}],
                         temperature=0.0,
                         max_tokens=50,
+                        prompt_cache_key=INTENT_PROMPT_CACHE_KEY,
                         response_format={"type":"json_object"},
                         timeout=5.0
                         )
@@ -122,9 +189,11 @@ class ComplianceAgent:
 
         
 
-    def assemble_context(self,chunks: List)->tuple[str, List[str],dict]:
+    def assemble_context(self,chunks: List, query: str = "", telemetry: Optional[TelemetryService]=None, token_budget: int = CONTEXT_TOKEN_BUDGET, tier: Optional[str]=None)->tuple[str, List[str],dict]:
         """
         formats/matches raw chunks into labels:
+        -chunk text goes through the token budgeter (dedupe + trim low scoring chunks), numbering is untouched
+        -tier (cascade mode): the context tokens are also recorded under that tier in telemetry
 
         returns:
         - formated text
@@ -137,7 +206,11 @@ class ComplianceAgent:
         entity_counts={"regulation":0, "policy":0}
 
         # logger.info('---- Start of Context Assembly Audit log----')
-        logger.info({"event":"context_assembly_start"})
+        logger.debug({"event":"context_assembly_start"})
+
+        texts, budget_stats = build_budgeted_context([(chunk.text_content, score) for chunk, score in chunks], query, token_budget)
+        if telemetry: telemetry.track_context(budget_stats["original_tokens"], budget_stats["final_tokens"], tier=tier)
+        logger.info({"event": "context_budget_applied", "budget": token_budget, **budget_stats})
 
         for i, (chunk,score) in enumerate(chunks):
             source_id = f'Source {i+1}'
@@ -155,14 +228,15 @@ class ComplianceAgent:
 
             #logging the mapping
             # logger.info(f"  mapped {source_id}: {chunk.source_type.upper()} ({ref}) [Score: {score:.2f}]")
-            logger.info({
-                "event":"source_mapped",
-                "source_id":source_id,
-                "type":ref,
-                "score":round(score, 2)
-                })
+            if logger.isEnabledFor(logging.DEBUG): #per source, don't even build the dict at INFO
+                logger.debug({
+                    "event":"source_mapped",
+                    "source_id":source_id,
+                    "type":ref,
+                    "score":round(score, 2)
+                    })
 
-            context_parts.append(f'{source_header}\n{chunk.text_content}\n')
+            context_parts.append(f'{source_header}\n{texts[i]}\n')
 
         return "\n".join(context_parts), valid_sources, entity_counts
     
@@ -171,7 +245,7 @@ class ComplianceAgent:
         valid_set = set(valid_sources)
 
         for cite in response.citations:
-            match = re.search(r'source \d+', cite, re.IGNORECASE)
+            match = SOURCE_CITATION.search(cite)
             if match:
                 extracted_source = match.group(0).title()
                 if extracted_source in valid_set:
@@ -197,7 +271,14 @@ class ComplianceAgent:
         #stampede protection sequence
         norm_query = cache_service._normalize(query)
         lock_key = f"lock:response:{cache_service._hash(f'{norm_query}_{policy_filter_id}')}"
-        lock_token = cache_service.acquire_lock(lock_key)
+        #lock + double check in one round trip (a response cached in between is returned with the lock already released)
+        lock_token, cached_double_check = cache_service.acquire_lock_and_get_response(lock_key, query, policy_filter_id)
+
+        if cached_double_check: #written while we were looking, whether or not we got the lock
+            if telemetry:
+                telemetry.metrics["cache_lookup_ms"] = round((time.time() - t0) * 1000, 2)
+                telemetry.mark_cache_hit("response")
+            return cached_double_check
 
         if not lock_token:
             # WAIT & RETRY (Coalescing)
@@ -210,15 +291,6 @@ class ComplianceAgent:
                         telemetry.metrics["cache_lookup_ms"] = round((time.time() - t0) * 1000, 2)
                         telemetry.mark_cache_hit("response_coalesced")
                     return cached_wait
-        else:
-            #if a lock is acquired, we double check for safety
-            cached_double_check = cache_service.get_response(query, policy_filter_id)
-            if cached_double_check:
-                cache_service.release_lock(lock_key, lock_token)
-                if telemetry:
-                    telemetry.metrics["cache_lookup_ms"] = round((time.time() - t0) * 1000, 2)
-                    telemetry.mark_cache_hit("response")
-                return cached_double_check
 
         if telemetry:
             telemetry.metrics["cache_lookup_ms"] = round((time.time() - t0) * 1000, 2)
@@ -270,7 +342,9 @@ class ComplianceAgent:
             
             #Circuit breaker logi: find a reg with no matching policy, do not audit
 
-            context_text, valid_sources, entity_counts = self.assemble_context(chunks)
+            context_budget = CASCADE_FAST_CONTEXT_BUDGET if AUDIT_MODE == "cascade" else CONTEXT_TOKEN_BUDGET
+            context_text, valid_sources, entity_counts = self.assemble_context(chunks, query, telemetry, token_budget=context_budget,
+                                                                               tier="fast" if AUDIT_MODE == "cascade" else None)
             if entity_counts["regulation"]==0:
                 # logger.warning("Circuit Break: Found 0 Regulations.")
                 logger.warning({"event": "circuit_break_no_regs"}) 
@@ -287,61 +361,30 @@ class ComplianceAgent:
                 cache_service.set_response(query, policy_filter_id, res, is_negative=True)
                 return res
             
-            system_prompt="""
-                        Your are senior compliance officer for a tier-1 bank. Audit Internal policies against Regulatory obligations.
-
-                        INSTRUCTIONS:
-                        -Compare Policies vs Regulations
-                        -Mark PASS if fully compliant
-                        -Mark FAIL if a specific requirement is missing or contradicted
-                        -Mark AMBIGUOUS if language is vague
-                        -MARK INCONCLUSIVE if the retrieved context lacks sufficient info
-                        -Cite specific sources numbers(eg. source 1) for every claim
-                        -IGNORE external knowledge. Use only provided sources
-
-                        OUTPUT JSON SCHEMA:
-                                        {
-                                            "status": "PASS" | "FAIL" | "AMBIGUOUS" | "INCONCLUSIVE",
-                                            "confidence": "HIGH" | "MEDIUM" | "LOW",
-                                            "reasoning": "Explanation...",
-                                            "citations": ["Source 1", "Source 2"]
-                                        }
-
-
-                        """
             user_message = f'QUERY: {query}\n\n--- sources ---\n{context_text}'
 
             try:
-                logger.info("Sending info to LLM")
                 logger.info({"event":"llm_analysis_start"})
                 cm_llm = telemetry.measure("llm") if telemetry else nullcontext()
                 with cm_llm:
-                    #LLM toggle
+                    #LLM toggle (fixed canned answer, OPENAI_TRANSPORT_MODE=replay serves recorded real answers instead)
                     if os.getenv("MOCK_LLM", "false").lower()=="true": 
                         time.sleep(0.5)
                         final_response = ComplianceResponse(
                             status="PASS",
                             confidence= "HIGH",
                             reasoning="MOCKED LLM RESPONSE FOR LOAD TESTING.",
-                            citation=valid_sources[:2],
+                            citations=valid_sources[:2],
                             intent = intent
                         ).model_dump()
-                    
-                    response = self.client.chat.completions.create(
-                        model=LLM_MODEL,
-                        messages=[
-                            {"role": "system", "content":system_prompt},
-                            {"role": "user", "content":user_message}
+                        cache_service.set_response(query, policy_filter_id, final_response, tags=cited_source_ids(final_response["citations"], chunks))
+                        return final_response
 
-                        ],
-                        temperature=0.0,
-                        response_format={"type":"json_object"},
-                        timeout=20.0
-                    )
-                if telemetry:
-                    telemetry.track_llm(response.usage, LLM_MODEL)
+                    if AUDIT_MODE == "cascade":
+                        raw_content = self._run_cascade(query, chunks, user_message, telemetry)
+                    else:
+                        raw_content = self._call_audit_llm(LLM_MODEL, AUDIT_SYSTEM_PROMPT, user_message, telemetry)
 
-                raw_content = response.choices[0].message.content
                 try:
                     data=json.loads(raw_content)
                     data['intent']=intent
@@ -353,7 +396,8 @@ class ComplianceAgent:
                         is_hard_failure = True
                     elif final_response.get("status") == "INCONCLUSIVE" and "No docs found" in final_response.get("reasoning", ""):
                         is_hard_failure = True
-                    cache_service.set_response(query, policy_filter_id, final_response, is_negative=is_hard_failure)
+                    cache_service.set_response(query, policy_filter_id, final_response, is_negative=is_hard_failure,
+                                               tags=cited_source_ids(final_response["citations"], chunks))
                     return final_response
                 
                 # except json.JSONDecodeError:
@@ -384,6 +428,55 @@ class ComplianceAgent:
 
         
         
+    def _call_audit_llm(self, model: str, system_prompt: str, user_message: str, telemetry: Optional[TelemetryService]=None, tier: Optional[str]=None, max_tokens: Optional[int]=None)->str:
+        """single audit completion, returns the raw json string. tier is only set in cascade mode (per tier latency & cost)"""
+        cm = telemetry.measure(f"llm_{tier}") if (telemetry and tier) else nullcontext()
+        with cm:
+            response = self.client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content":system_prompt},
+                    {"role": "user", "content":user_message}
+
+                ],
+                temperature=0.0,
+                max_tokens=max_tokens if max_tokens else NOT_GIVEN,
+                prompt_cache_key=AUDIT_PROMPT_CACHE_KEY if system_prompt is AUDIT_SYSTEM_PROMPT else NOT_GIVEN,
+                response_format={"type":"json_object"},
+                timeout=20.0
+            )
+            if telemetry:
+                telemetry.track_llm(response.usage, model, tier=tier)
+
+        return response.choices[0].message.content
+
+    def _run_cascade(self, query: str, chunks: List, fast_user_message: str, telemetry: Optional[TelemetryService]=None)->str:
+        """
+        **Model cascade**
+
+        -tier 1 (fast): minimal prompt, tight context budget, capped max_tokens
+        -escalate to tier 2 (full prompt, full context, bigger model) only if tier 1 is LOW confidence, AMBIGUOUS or unparseable
+        """
+        raw_fast = self._call_audit_llm(CASCADE_FAST_MODEL, AUDIT_FAST_SYSTEM_PROMPT, fast_user_message, telemetry, tier="fast", max_tokens=CASCADE_FAST_MAX_TOKENS)
+
+        try:
+            fast = ComplianceResponse(**json.loads(raw_fast))
+            escalate_reason = "low_confidence" if fast.confidence == "LOW" else "ambiguous" if fast.status == "AMBIGUOUS" else None
+        except Exception:
+            escalate_reason = "invalid_output" # truncated by max_tokens or schema mismatch
+
+        if not escalate_reason:
+            logger.info({"event": "cascade_resolved", "tier": "fast", "status": fast.status})
+            return raw_fast
+
+        logger.info({"event": "cascade_escalated", "reason": escalate_reason, "model": CASCADE_ESCALATION_MODEL})
+        if telemetry: telemetry.metrics["escalated"] = True
+
+        #same chunks & numbering, only the budget changes, so citations from either tier stay valid
+        full_context, _, _ = self.assemble_context(chunks, query, telemetry, token_budget=CONTEXT_TOKEN_BUDGET, tier="escalation")
+        full_user_message = f'QUERY: {query}\n\n--- sources ---\n{full_context}'
+        return self._call_audit_llm(CASCADE_ESCALATION_MODEL, AUDIT_SYSTEM_PROMPT, full_user_message, telemetry, tier="escalation")
+
     def _build_inconclusive_response(self, reason: str, intent: str = "UNKNOWN")->ComplianceResponse:
         return ComplianceResponse(
             status="INCONCLUSIVE",
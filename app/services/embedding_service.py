@@ -1,8 +1,12 @@
 import logging
+import os
 from openai import RateLimitError, APIConnectionError, OpenAI
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from app.services.telemetry import TelemetryService
+from app.services.openai_transport import openai_http_client
+from app.services.cache import cache_service
 from typing import Optional
 
 load_dotenv(override=True) # ensuring it reads open api key
@@ -12,25 +16,47 @@ load_dotenv(override=True) # ensuring it reads open api key
 logger = logging.getLogger("json_logger")
 
 EMBEDDING_MODEL = "text-embedding-3-small"
+OPENAI_EMBEDDING_DIM = 1536
 
-class EmbeddingService: 
+#backend toggle: "openai" (default, network) or "local" (on-box CPU model, no network at query time).
+#local needs the optional poetry group: poetry install --with local-embeddings. the model is downloaded into HF_HOME on
+#first load, backend.Dockerfile bakes it in (--build-arg LOCAL_EMBEDDINGS=true); offline hosts / CI: populate HF_HOME once
+#& set HF_HUB_OFFLINE=1
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai").lower()
 
-    def __init__(self):
-        self.client = OpenAI()
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+LOCAL_EMBEDDING_DIM = int(os.getenv("LOCAL_EMBEDDING_DIM", 384)) # must match the local model, qdrant collection is sized from this
+LOCAL_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", 32))
+LOCAL_THREADS = int(os.getenv("LOCAL_EMBEDDING_THREADS", 2))
 
-    def get_embeddings_batch(self, text: list[str], telemetry: Optional[TelemetryService]=None)->list[list[float]]:
-        """
-        creates batches of 20 text items & creates embeddings. 
-        """
-        clean_texts = [t.replace("\n", " ") for t in text]
 
+def _slug(model_name: str)->str:
+    return model_name.split("/")[-1].lower().replace(".", "-").replace("_", "-")
+
+#version tag shared by the embedding cache keys & the qdrant collection name.
+#"v1" is kept for openai so existing cached vectors & the existing collection stay valid
+EMBEDDING_VERSION = "v1" if EMBEDDING_BACKEND == "openai" else f"local-{_slug(LOCAL_EMBEDDING_MODEL)}"
+EMBEDDING_DIM = OPENAI_EMBEDDING_DIM if EMBEDDING_BACKEND == "openai" else LOCAL_EMBEDDING_DIM
+
+
+class OpenAIEmbeddingBackend:
+    """remote embeddings via openai text-embedding-3-small"""
+
+    name = "openai"
+
+    def __init__(self):
+        self.client = OpenAI(http_client=openai_http_client())
+        self.model_name = EMBEDDING_MODEL
+        self.dimension = OPENAI_EMBEDDING_DIM
+
+    def embed(self, texts: list[str], telemetry: Optional[TelemetryService]=None)->list[list[float]]:
         retries= 3
         delay =1
 
         for attempt in range(retries):
             try:
                 response = self.client.embeddings.create(
-                input=clean_texts,
+                input=texts,
                 model=EMBEDDING_MODEL,
 
                 )
@@ -41,7 +67,7 @@ class EmbeddingService:
                 sorted_data = sorted(response.data, key = lambda x: x.index)
 
                 return [item.embedding for item in sorted_data]
-        
+
             except RateLimitError:
                 # logger.warning(f'Rate Limit hit, please retry in {delay}s...')
                 logger.warning({"event": "embedding_rate_limit", "retry_in_s": delay})
@@ -58,17 +84,102 @@ class EmbeddingService:
                 # logger.error(f'Batch emebedding pipeline failed: {e}')
                 logger.error({"event": "embedding_pipeline_failed", "error": str(e)})
                 raise
-        
+
         raise Exception('Embedding pipeline failed after multiple retries!')
-    
+
+
+class LocalEmbeddingBackend:
+    """
+    on-box CPU embeddings (sentence-transformers on onnxruntime).
+    -model is loaded once per process
+    -large inputs are split into sub-batches & spread over a small thread pool (onnxruntime releases the GIL)
+    -single query embeddings skip the pool entirely
+    """
+
+    name = "local"
+
+    def __init__(self):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise RuntimeError("EMBEDDING_BACKEND=local requires the local-embeddings group (poetry install --with local-embeddings)") from e
+
+        self.model_name = LOCAL_EMBEDDING_MODEL
+        try:
+            self.model = SentenceTransformer(LOCAL_EMBEDDING_MODEL, device="cpu", backend="onnx")
+        except Exception as e:
+            #no exported onnx weights for this model, torch on cpu is still local & offline
+            logger.warning({"event": "local_embedding_onnx_unavailable", "model": LOCAL_EMBEDDING_MODEL, "error": type(e).__name__})
+            self.model = SentenceTransformer(LOCAL_EMBEDDING_MODEL, device="cpu")
+
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        if self.dimension != LOCAL_EMBEDDING_DIM:
+            raise ValueError(f"local model dimension {self.dimension} != LOCAL_EMBEDDING_DIM {LOCAL_EMBEDDING_DIM}")
+
+        self._pool = ThreadPoolExecutor(max_workers=LOCAL_THREADS, thread_name_prefix="embed")
+        logger.info({"event": "local_embedding_model_loaded", "model": LOCAL_EMBEDDING_MODEL, "dim": self.dimension})
+
+    def _encode(self, texts: list[str])->list[list[float]]:
+        vectors = self.model.encode(texts, batch_size=LOCAL_BATCH_SIZE, normalize_embeddings=True, convert_to_numpy=True)
+        return vectors.tolist()
+
+    def embed(self, texts: list[str], telemetry: Optional[TelemetryService]=None)->list[list[float]]:
+        if len(texts) <= LOCAL_BATCH_SIZE:
+            vectors = self._encode(texts)
+        else:
+            batches = [texts[i: i+LOCAL_BATCH_SIZE] for i in range(0, len(texts), LOCAL_BATCH_SIZE)]
+            vectors = [v for batch in self._pool.map(self._encode, batches) for v in batch] # map keeps input order
+
+        if telemetry:
+            #no token bill for local inference, still recorded so the model shows up in request_metrics
+            telemetry.track_embedding(0, self.model_name)
+        return vectors
+
+
+EMBEDDING_BACKENDS = {
+    "openai": OpenAIEmbeddingBackend,
+    "local": LocalEmbeddingBackend,
+}
+
+
+class EmbeddingService:
+
+    def __init__(self, backend=None):
+        #backend is built on first use, so importing this module never needs an api key or a model download
+        self._backend = backend
+        self.version = EMBEDDING_VERSION
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            if EMBEDDING_BACKEND not in EMBEDDING_BACKENDS:
+                raise ValueError(f"unknown EMBEDDING_BACKEND: {EMBEDDING_BACKEND}")
+            self._backend = EMBEDDING_BACKENDS[EMBEDDING_BACKEND]()
+        return self._backend
+
+    def get_embeddings_batch(self, text: list[str], telemetry: Optional[TelemetryService]=None)->list[list[float]]:
+        """
+        embeddings for a list of texts, in input order. batching is the backend's job
+        (one openai request per call, LOCAL_EMBEDDING_BATCH_SIZE sub-batches on the local model)
+        """
+        clean_texts = [t.replace("\n", " ") for t in text]
+        return self.backend.embed(clean_texts, telemetry=telemetry)
+
     def get_embedding(self, text: str, telemetry: Optional[TelemetryService]=None):
         """
         wrapper method for get_embeddings_batch: returns a single text embedding.
+        -query embeddings go through the versioned embedding cache layer first
         """
-        return self.get_embeddings_batch([text], telemetry=telemetry)[0]
-    
+        cached = cache_service.get_embedding(text, version=self.version)
+        if cached:
+            if telemetry: telemetry.mark_embedding_cache_hit()
+            return cached
+
+        embedding = self.get_embeddings_batch([text], telemetry=telemetry)[0]
+        cache_service.set_embedding(text, embedding, version=self.version)
+        return embedding
+
 embedding_service = EmbeddingService()
-        
 
 
 
@@ -0,0 +1,259 @@
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("json_logger")
+
+#multi worker mode: every uvicorn worker dumps its snapshot here, /metrics merges all of them.
+#unset = single process, /metrics serves this worker only
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR")
+METRICS_SNAPSHOT_INTERVAL = float(os.getenv("METRICS_SNAPSHOT_INTERVAL", 5.0))
+
+#latency buckets in ms, spans cache hits (~1ms) to slow llm calls (~30s)
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 20000, 30000)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values: Dict[tuple, object] = {}
+
+    def _key(self, labels: dict)->tuple:
+        return tuple(str(labels.get(l, "")) for l in self.labelnames)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def snapshot(self)->dict:
+        with self._lock:
+            return {json.dumps(k): v for k, v in self._values.items()}
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels)->float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def snapshot(self)->dict:
+        with self._lock:
+            return {json.dumps(k): v for k, v in self._values.items()}
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS_MS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        idx = bisect_left(self.buckets, value) # index of the first bucket with upper bound >= value (len(buckets) = +Inf)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0]*(len(self.buckets)+1), 0.0, 0]
+            state[0][idx] += 1
+            state[1] += value
+            state[2] += 1
+
+    def snapshot(self)->dict:
+        with self._lock:
+            return {json.dumps(k): [list(v[0]), v[1], v[2]] for k, v in self._values.items()}
+
+
+class MetricsRegistry:
+    """
+    **In-process metrics registry with Prometheus text exposition**
+
+    -hot path cost is a dict lookup + lock + a few adds (histograms bisect into fixed buckets)
+    -collectors are callbacks run only at scrape time (pool sizes, buffer depth...)
+    -multi worker: snapshots are written per pid to METRICS_MULTIPROC_DIR & merged on scrape, files of dead pids are dropped
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._snapshot_thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    def _register(self, metric: _Metric)->_Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ())->Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ())->Gauge:
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS_MS)->Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def register_collector(self, fn: Callable[[], None]):
+        """fn refreshes gauges right before a scrape"""
+        self._collectors.append(fn)
+
+    def _collect(self):
+        for fn in self._collectors:
+            try:
+                fn()
+            except Exception as e:
+                logger.warning({"event": "metrics_collector_failed", "error": type(e).__name__})
+
+    def snapshot(self)->dict:
+        self._collect()
+        return {name: m.snapshot() for name, m in self._metrics.items()}
+
+    #MULTI WORKER
+
+    def _snapshot_path(self)->str:
+        return os.path.join(METRICS_MULTIPROC_DIR, f"{os.getpid()}.json")
+
+    def write_snapshot(self):
+        if not METRICS_MULTIPROC_DIR:
+            return
+        os.makedirs(METRICS_MULTIPROC_DIR, exist_ok=True)
+        tmp = self._snapshot_path() + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"ts": time.time(), "metrics": self.snapshot()}, f)
+        os.replace(tmp, self._snapshot_path()) # atomic, a scrape never reads half a file
+
+    def _snapshot_loop(self):
+        while not self._stopping.wait(METRICS_SNAPSHOT_INTERVAL):
+            try:
+                self.write_snapshot()
+            except Exception as e:
+                logger.warning({"event": "metrics_snapshot_failed", "error": type(e).__name__})
+
+    def start(self):
+        if METRICS_MULTIPROC_DIR and not self._snapshot_thread:
+            self.write_snapshot() # replaces a stale file left under a reused pid right away
+            self._snapshot_thread = threading.Thread(target=self._snapshot_loop, name="metrics-snapshot", daemon=True)
+            self._snapshot_thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        try:
+            self.write_snapshot() # last counters of this worker survive it
+        except Exception:
+            pass
+
+    def _merged_snapshot(self)->dict:
+        if not METRICS_MULTIPROC_DIR:
+            return self.snapshot()
+
+        self.write_snapshot()
+        merged: dict = {}
+        gauge_horizon = time.time() - 3*METRICS_SNAPSHOT_INTERVAL
+        for path in glob.glob(os.path.join(METRICS_MULTIPROC_DIR, "*.json")):
+            if not _pid_alive(os.path.basename(path)[:-len(".json")]):
+                #worker gone (crash, restart, old deployment): its snapshot is removed, prometheus sees a counter reset
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, series in data["metrics"].items():
+                metric = self._metrics.get(name)
+                if metric is None:
+                    continue
+                #a live worker that stopped writing (stuck) keeps its counters & histograms, not its gauges
+                if metric.kind == "gauge" and data["ts"] < gauge_horizon:
+                    continue
+                target = merged.setdefault(name, {})
+                for key, value in series.items():
+                    if metric.kind == "histogram":
+                        cur = target.setdefault(key, [[0]*len(value[0]), 0.0, 0])
+                        cur[0] = [a+b for a, b in zip(cur[0], value[0])]
+                        cur[1] += value[1]
+                        cur[2] += value[2]
+                    else:
+                        target[key] = target.get(key, 0.0) + value
+        return merged
+
+    #EXPOSITION
+
+    def render(self)->str:
+        snapshot = self._merged_snapshot()
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key, value in sorted(snapshot.get(name, {}).items()):
+                labels = list(zip(metric.labelnames, json.loads(key)))
+                if metric.kind == "histogram":
+                    cumulative = 0
+                    for bound, count in zip(list(metric.buckets)+["+Inf"], value[0]):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_fmt_labels(labels + [('le', str(bound))])} {cumulative}")
+                    lines.append(f"{name}_sum{_fmt_labels(labels)} {value[1]}")
+                    lines.append(f"{name}_count{_fmt_labels(labels)} {value[2]}")
+                else:
+                    lines.append(f"{name}{_fmt_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _pid_alive(pid: str)->bool:
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        return True # exists, owned by another user
+    return True
+
+def _fmt_labels(labels: list)->str:
+    if not labels:
+        return ""
+    escaped = ",".join(f'{k}="{str(v).replace(chr(92), chr(92)*2).replace(chr(34), chr(92)+chr(34))}"' for k, v in labels)
+    return "{" + escaped + "}"
+
+
+metrics_registry = MetricsRegistry()
+
+#APP METRICS
+STAGE_LATENCY = metrics_registry.histogram("ball_stage_latency_ms", "pipeline stage latency (TelemetryService.measure)", ("stage",))
+REQUEST_LATENCY = metrics_registry.histogram("ball_request_latency_ms", "end to end http request latency", ("endpoint", "status"))
+REQUESTS_IN_FLIGHT = metrics_registry.gauge("ball_requests_in_flight", "http requests currently being served")
+CACHE_LOOKUPS = metrics_registry.counter("ball_cache_lookups_total", "cache lookups per layer", ("cache_layer", "result"))
+LLM_TOKENS = metrics_registry.counter("ball_llm_tokens_total", "tokens billed per model", ("model", "kind"))
+LLM_COST = metrics_registry.counter("ball_llm_cost_usd_total", "estimated spend per model", ("model",))
+DB_POOL = metrics_registry.gauge("ball_db_pool_connections", "sqlalchemy pool connections", ("state",))
+HASHING_POOL = metrics_registry.gauge("ball_hashing_pool", "bcrypt hashing pool", ("stat",))
+METRICS_BUFFER = metrics_registry.gauge("ball_metrics_buffer", "buffered request_metrics writer", ("stat",))
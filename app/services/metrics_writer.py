@@ -0,0 +1,182 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Optional
+from sqlalchemy import insert
+from app.db.models import RequestMetric
+from app.db.session import SessionLocal
+from app.services.rollups import apply_rollups, purge_expired
+
+logger = logging.getLogger("json_logger")
+
+METRICS_BUFFER_MAX = int(os.getenv("METRICS_BUFFER_MAX", 10_000)) # hard memory bound, newest rows are dropped beyond it
+METRICS_FLUSH_BATCH = int(os.getenv("METRICS_FLUSH_BATCH", 500)) # size trigger
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 2.0)) # time trigger (seconds)
+METRICS_WRITE_RETRIES = 2
+METRICS_PURGE_INTERVAL = float(os.getenv("METRICS_PURGE_INTERVAL", 3600)) # retention pass, seconds
+
+
+def build_metric_row(data: dict, intent: str, status_code: int, endpoint: str, user_id: Optional[str] = None)->dict:
+    """maps a TelemetryService.get_summary() record to a request_metrics row"""
+    return {
+        "id": uuid.uuid4(),
+        "request_id": data["request_id"],
+        #stamped here, server_default now() would give every row in a batch the flush time
+        "timestamp": datetime.now(timezone.utc),
+        "endpoint": endpoint,
+        "user_id": user_id,
+        "intent": intent,
+        "status_code": status_code,
+        "error_type": data.get("error_type"),
+        "cache_layer": data.get("cache_layer"),
+        "is_cache_hit": data.get("is_cache_hit", False),
+        "cache_lookup_ms": data.get("cache_lookup_ms", 0.0),
+        "total_latency_ms": data["total_latency_ms"],
+        "routing_latency_ms": data["routing_ms"],
+        "retrieval_latency_ms": data["retrieval_ms"],
+        "llm_latency_ms": data["llm_ms"],
+        "prompt_tokens": data["prompt_tokens"],
+        "completion_tokens": data["completion_tokens"],
+        "total_tokens": data["prompt_tokens"] + data["completion_tokens"],
+        "cached_tokens": data.get("cached_tokens", 0),
+        "cost_usd": data["cost_usd"],
+        "escalated": data.get("escalated", False),
+        "llm_tiers": data.get("llm_tiers") or None,
+        "model_name": data["model_str"],
+    }
+
+
+class MetricsWriter:
+    """
+    **Buffered request_metrics pipeline**
+
+    -request path only appends a row to an in-memory buffer (no session, no transaction)
+    -a background thread flushes in bulk (one multi-row INSERT per batch) on size or time triggers
+    -buffer is bounded: under backpressure (db slow/down) new rows are dropped & counted, never blocking requests
+    -every flushed batch is also merged into metric_rollups (minute & hour buckets) for the dashboards
+    -stop() flushes whatever is left, called from the app lifespan on shutdown
+    """
+
+    def __init__(self, max_size: int = METRICS_BUFFER_MAX, batch_size: int = METRICS_FLUSH_BATCH, interval: float = METRICS_FLUSH_INTERVAL):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.interval = interval
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_purge = time.time()
+        self.stats = {"enqueued": 0, "dropped": 0, "flushed": 0, "failed_rows": 0, "rollup_failures": 0}
+
+    def enqueue(self, row: dict)->bool:
+        with self._lock:
+            if len(self._buffer) >= self.max_size:
+                self.stats["dropped"] += 1
+                dropped = self.stats["dropped"]
+            else:
+                self._buffer.append(row)
+                self.stats["enqueued"] += 1
+                dropped = None
+                if len(self._buffer) >= self.batch_size:
+                    self._wake.set()
+
+        if dropped is not None:
+            if dropped % 1000 == 1: # first drop & then every 1000th, not one log line per dropped row
+                logger.warning({"event": "metrics_dropped", "dropped_total": dropped, "buffer_max": self.max_size})
+            return False
+        return True
+
+    def buffered(self)->int:
+        return len(self._buffer)
+
+    def _drain(self)->list:
+        with self._lock:
+            n = min(len(self._buffer), self.batch_size)
+            return [self._buffer.popleft() for _ in range(n)]
+
+    def _write(self, rows: list):
+        for attempt in range(METRICS_WRITE_RETRIES):
+            db = SessionLocal()
+            try:
+                db.execute(insert(RequestMetric), rows)
+                db.commit()
+                self.stats["flushed"] += len(rows)
+                break
+            except Exception as e:
+                db.rollback()
+                if attempt == METRICS_WRITE_RETRIES-1: # log only if the final attempt fails
+                    self.stats["failed_rows"] += len(rows)
+                    logger.error({"event": "metrics_save_failed", "error": type(e).__name__, "rows": len(rows)})
+                    return
+            finally:
+                db.close()
+
+        self._rollup(rows)
+
+    def _rollup(self, rows: list):
+        #own transaction, raw rows are already committed & a failed rollup must not lose them
+        db = SessionLocal()
+        try:
+            apply_rollups(db, rows)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            self.stats["rollup_failures"] += 1
+            logger.error({"event": "metrics_rollup_failed", "error": type(e).__name__, "rows": len(rows)})
+        finally:
+            db.close()
+
+    def _maybe_purge(self):
+        if time.time() - self._last_purge < METRICS_PURGE_INTERVAL:
+            return
+        self._last_purge = time.time()
+        db = SessionLocal()
+        try:
+            purge_expired(db)
+        except Exception as e:
+            db.rollback()
+            logger.error({"event": "metrics_retention_failed", "error": type(e).__name__})
+        finally:
+            db.close()
+
+    def flush(self):
+        while True:
+            rows = self._drain()
+            if not rows:
+                return
+            t0 = time.time()
+            self._write(rows)
+            logger.info({"event": "metrics_persisted", "rows": len(rows), "flush_ms": round((time.time()-t0)*1000, 2), "buffered": self.buffered()})
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                self._maybe_purge()
+            except Exception as e:
+                logger.error({"event": "metrics_flush_error", "error": type(e).__name__})
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stopping.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self.flush() # final drain on shutdown
+        logger.info({"event": "metrics_writer_stopped", **self.stats})
+
+
+metrics_writer = MetricsWriter()
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Optional
+import httpx
+from app.services import tracing
+from app.services.metrics_registry import metrics_registry
+
+logger = logging.getLogger("json_logger")
+
+#"live" = plain network calls (default), "record" = network calls saved to the cassette dir, "replay" = served from the cassette dir
+OPENAI_TRANSPORT_MODE = os.getenv("OPENAI_TRANSPORT_MODE", "live").lower()
+OPENAI_CASSETTE_DIR = os.getenv("OPENAI_CASSETTE_DIR", "cassettes/openai")
+#replayed responses wait for the recorded latency x this scale (0 = instant, 2 = slower upstream)
+OPENAI_REPLAY_LATENCY_SCALE = float(os.getenv("OPENAI_REPLAY_LATENCY_SCALE", 1.0))
+#replay miss: "error" answers 404 (sdk raises NotFoundError, no retries), "live" goes to the network & records the call
+OPENAI_REPLAY_MISS = os.getenv("OPENAI_REPLAY_MISS", "error").lower()
+
+#headers that no longer describe the stored body (httpx hands us the decoded content)
+_DROP_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection", "set-cookie"}
+
+CASSETTE_EVENTS = metrics_registry.counter("ball_openai_cassette_total", "openai record/replay transport", ("mode", "result"))
+
+
+def cassette_key(request: httpx.Request)->str:
+    """method + path + canonical json body. headers (api key, sdk version, retry count) never take part"""
+    body = request.content or b""
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode()
+    except ValueError:
+        pass
+    return hashlib.sha256(request.method.encode() + b" " + request.url.path.encode() + b"\n" + body).hexdigest()
+
+
+class CassetteStore:
+    """one json file per interaction, written atomically so concurrent workers can record into the same dir"""
+
+    def __init__(self, directory: str = OPENAI_CASSETTE_DIR):
+        self.directory = directory
+
+    def _path(self, key: str)->str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str)->Optional[dict]:
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, interaction: dict):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(interaction, f)
+        os.replace(tmp, path)
+
+
+class RecordReplayTransport(httpx.BaseTransport):
+    """
+    **Record / replay for the OpenAI SDK**
+
+    -record: forwards to <inner>, stores status, headers, body & latency (request body is only hashed, prompts aren't stored)
+    -replay: answers from the store after sleeping the recorded latency, the body (usage included) is byte for byte
+    the recorded one, so token accounting & cost in TelemetryService match the recorded run
+    """
+
+    def __init__(self, mode: str, inner: httpx.BaseTransport, store: CassetteStore, latency_scale: float = OPENAI_REPLAY_LATENCY_SCALE,
+                 on_miss: str = OPENAI_REPLAY_MISS):
+        self.mode = mode
+        self.inner = inner
+        self.store = store
+        self.latency_scale = latency_scale
+        self.on_miss = on_miss
+
+    def handle_request(self, request: httpx.Request)->httpx.Response:
+        key = cassette_key(request)
+
+        if self.mode == "replay":
+            interaction = self.store.get(key)
+            if interaction is not None:
+                CASSETTE_EVENTS.inc(mode="replay", result="hit")
+                if self.latency_scale > 0:
+                    time.sleep(interaction["latency_ms"]*self.latency_scale/1000)
+                return httpx.Response(interaction["status_code"], headers=interaction["headers"], content=interaction["body"].encode(), request=request)
+
+            CASSETTE_EVENTS.inc(mode="replay", result="miss")
+            logger.warning({"event": "openai_cassette_miss", "path": request.url.path, "key": key[:16]})
+            if self.on_miss != "live":
+                return httpx.Response(404, json={"error": {"message": f"no recorded response for {request.url.path} ({key[:16]})", "type": "cassette_miss"}}, request=request)
+
+        t0 = time.perf_counter()
+        response = self.inner.handle_request(request)
+        response.read()
+        latency_ms = (time.perf_counter()-t0)*1000
+
+        if response.status_code < 500 and response.status_code != 429: # throttling & outages aren't worth replaying
+            model = None
+            try:
+                model = json.loads(request.content).get("model")
+            except (ValueError, AttributeError):
+                pass
+            self.store.put(key, {
+                "request": {"method": request.method, "path": request.url.path, "model": model},
+                "status_code": response.status_code,
+                "headers": [(k, v) for k, v in response.headers.items() if k.lower() not in _DROP_HEADERS],
+                "body": response.text,
+                "latency_ms": round(latency_ms, 2),
+                "recorded_at": time.time(),
+            })
+            CASSETTE_EVENTS.inc(mode=self.mode, result="recorded")
+
+        return httpx.Response(response.status_code, headers=[(k, v) for k, v in response.headers.items() if k.lower() not in _DROP_HEADERS],
+                              content=response.content, request=request)
+
+    def close(self):
+        self.inner.close()
+
+
+def openai_http_client(mode: str = None, cassette_dir: str = None):
+    """
+    httpx client for the OpenAI SDK (ComplianceAgent, EmbeddingService):
+    -tracing span per attempt when tracing is on (outermost, so replayed calls are traced too)
+    -record/replay layer when OPENAI_TRANSPORT_MODE is record or replay
+    None when neither applies (the sdk then builds its default client)
+    """
+    mode = (mode or OPENAI_TRANSPORT_MODE).lower()
+    transport = None
+    if mode in ("record", "replay"):
+        transport = RecordReplayTransport(mode, httpx.HTTPTransport(), CassetteStore(cassette_dir or OPENAI_CASSETTE_DIR))
+        logger.info({"event": "openai_transport_configured", "mode": mode, "cassette_dir": cassette_dir or OPENAI_CASSETTE_DIR})
+    elif mode != "live":
+        raise ValueError(f"unknown OPENAI_TRANSPORT_MODE: {mode}")
+
+    transport = tracing.openai_transport(transport) or transport
+    if transport is None:
+        return None
+
+    from openai import DefaultHttpxClient
+    return DefaultHttpxClient(transport=transport)
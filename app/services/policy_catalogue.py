@@ -0,0 +1,103 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import List, Optional
+from starlette.concurrency import run_in_threadpool
+from app.db.queries import list_policy_items
+from app.services.cache import cache_service
+
+logger = logging.getLogger("json_logger")
+
+GENERATION_KEY = "catalogue:policies:generation" # bumped by ingest / invalidate, shared by every worker
+CATALOGUE_CHECK_INTERVAL = float(os.getenv("CATALOGUE_CHECK_INTERVAL", 1.0)) # seconds between generation reads
+CATALOGUE_MAX_AGE = float(os.getenv("CATALOGUE_MAX_AGE", 300)) # hard refresh even without a bump (redis down, missed invalidation)
+CATALOGUE_MAX_PAGE = 500
+
+
+class PolicyCatalogue:
+    """
+    **In-memory policy catalogue (id & name only)**
+
+    -snapshot per worker, loaded with a 2 column projection (never text_content)
+    -version = hash of the snapshot, served as the ETag, so unchanged catalogues answer 304
+    -staleness: a redis generation counter is checked at most every CATALOGUE_CHECK_INTERVAL,
+    ingest/invalidate bumps it & every worker reloads on its next request
+    """
+
+    def __init__(self):
+        self._items: List[dict] = []
+        self._version: Optional[str] = None
+        self._generation: Optional[int] = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _read_generation(self)->Optional[int]:
+        try:
+            return int(cache_service.client.get(GENERATION_KEY) or 0)
+        except Exception:
+            return None # redis down, CATALOGUE_MAX_AGE still bounds staleness
+
+    async def _remote_generation(self)->Optional[int]:
+        #sync redis client, off the event loop (a slow redis would otherwise stall every request on the worker)
+        return await run_in_threadpool(self._read_generation)
+
+    async def _is_fresh(self)->bool:
+        if self._version is None:
+            return False
+        now = time.monotonic()
+        if now - self._loaded_at > CATALOGUE_MAX_AGE:
+            return False
+        if now - self._checked_at < CATALOGUE_CHECK_INTERVAL:
+            return True
+        self._checked_at = now
+        remote = await self._remote_generation()
+        return remote is None or remote == self._generation
+
+    async def _refresh(self):
+        async with self._lock:
+            if await self._is_fresh(): # another request refreshed while we waited
+                return
+            generation = await self._remote_generation()
+            t0 = time.time()
+            items = sorted(await list_policy_items(), key=lambda p: (p["name"], p["id"]))
+            self._items = items
+            self._version = hashlib.sha256(json.dumps(items, separators=(",", ":")).encode()).hexdigest()[:16]
+            self._generation = generation
+            self._loaded_at = self._checked_at = time.monotonic()
+            logger.info({"event": "policy_catalogue_loaded", "policies": len(items), "version": self._version, "load_ms": round((time.time()-t0)*1000, 2)})
+
+    async def snapshot(self)->tuple[str, List[dict]]:
+        """(version, items), reloads first if stale"""
+        if not await self._is_fresh():
+            await self._refresh()
+        return self._version, self._items
+
+    async def page(self, offset: int = 0, limit: Optional[int] = None)->dict:
+        version, items = await self.snapshot()
+        end = len(items) if limit is None else offset + min(limit, CATALOGUE_MAX_PAGE)
+        return {"version": version, "total": len(items), "offset": offset, "items": items[offset:end]}
+
+    def invalidate(self):
+        """call after policies change (ingest, rename, delete): local snapshot dropped, other workers follow via the counter"""
+        self._version = None
+        try:
+            cache_service.client.incr(GENERATION_KEY)
+        except Exception as e:
+            logger.error({"event": "redis_invalidate_error", "layer": "policy_catalogue", "error": type(e).__name__})
+
+
+def etag_for(version: str, offset: int = 0, limit: Optional[int] = None)->str:
+    return f'"{version}"' if (offset == 0 and limit is None) else f'"{version}-{offset}-{limit}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str)->bool:
+    if not if_none_match:
+        return False
+    candidates = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+policy_catalogue = PolicyCatalogue()
@@ -0,0 +1,156 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from typing import Optional
+from app.db.models import RequestProfile
+from app.db.session import SessionLocal
+
+try:
+    from pyinstrument import Profiler as _PyinstrumentProfiler #optional, sampling profiler with a readable call tree
+except ImportError:
+    _PyinstrumentProfiler = None
+
+logger = logging.getLogger("json_logger")
+
+#opt-in only: an admin sends the header, or a small share of requests is sampled. both 0/absent = profiling fully off
+PROFILE_HEADER = "x-profile"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0.0))
+#tracemalloc is process wide & slows every thread while it runs, PROFILE_TRACEMALLOC=false keeps only the call tree
+PROFILE_TRACEMALLOC = os.getenv("PROFILE_TRACEMALLOC", "true").lower() == "true"
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", 5))
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", 30))
+
+#one profiled request at a time per worker: tracemalloc & the allocation snapshot are global,
+#two overlapping profiles would attribute each other's allocations
+_active = threading.Lock()
+
+
+def profile_reason(header_value: Optional[str], role: Optional[str])->Optional[str]:
+    """why this request gets profiled, None for the common case (one header lookup + one float compare)"""
+    if header_value and header_value.lower() in ("1", "true") and role == "admin":
+        return "header"
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return "sampled"
+    return None
+
+
+class ProfileSession:
+    """collects one request's profile, finished report is in .report after the block exits"""
+
+    def __init__(self, request_id: str, endpoint: str, reason: str):
+        self.request_id = request_id
+        self.endpoint = endpoint
+        self.reason = reason
+        self.report: Optional[dict] = None
+
+    @contextmanager
+    def run(self):
+        trace_alloc = PROFILE_TRACEMALLOC and not tracemalloc.is_tracing()
+        if trace_alloc:
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+
+        if _PyinstrumentProfiler:
+            profiler = _PyinstrumentProfiler(async_mode="disabled")
+            start, stop = profiler.start, profiler.stop
+        else:
+            profiler = cProfile.Profile() # deterministic, more overhead per call but always available
+            start, stop = profiler.enable, profiler.disable
+
+        t0, c0 = time.perf_counter(), time.thread_time()
+        start()
+        try:
+            yield self
+        finally:
+            stop()
+            wall_ms, cpu_ms = (time.perf_counter()-t0)*1000, (time.thread_time()-c0)*1000
+
+            allocations = None
+            if trace_alloc:
+                snapshot = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                allocations = _allocation_report(snapshot, current, peak)
+
+            self.report = {
+                "wall_ms": round(wall_ms, 2),
+                "cpu_ms": round(cpu_ms, 2),
+                "profiler": "pyinstrument" if _PyinstrumentProfiler else "cprofile",
+                **_call_tree_report(profiler),
+                "allocations": allocations,
+            }
+
+
+def _call_tree_report(profiler)->dict:
+    if not isinstance(profiler, cProfile.Profile):
+        return {"call_tree": profiler.output_text(unicode=False, color=False, show_all=False), "top_functions": []}
+
+    stats = pstats.Stats(profiler, stream=io.StringIO()).sort_stats("cumulative")
+    top = []
+    for (filename, line, func), (cc, nc, tt, ct, _) in sorted(stats.stats.items(), key=lambda kv: -kv[1][3])[:PROFILE_TOP_N]:
+        top.append({"function": f"{os.path.relpath(filename) if filename.startswith(os.getcwd()) else filename}:{line}({func})",
+                    "calls": nc, "tottime_ms": round(tt*1000, 3), "cumtime_ms": round(ct*1000, 3)})
+    stats.stream = io.StringIO()
+    stats.print_callees(PROFILE_TOP_N) # cumulative order, callees per function = readable call tree
+    return {"call_tree": stats.stream.getvalue(), "top_functions": top}
+
+def _allocation_report(snapshot, current: int, peak: int)->dict:
+    snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__),
+                                       tracemalloc.Filter(False, "<frozen importlib._bootstrap>")))
+    top = [{"location": str(stat.traceback[0]), "size_kb": round(stat.size/1024, 1), "count": stat.count}
+           for stat in snapshot.statistics("lineno")[:PROFILE_TOP_N]]
+    return {"current_kb": round(current/1024, 1), "peak_kb": round(peak/1024, 1), "top": top}
+
+
+def maybe_profile(request_id: str, endpoint: str, header_value: Optional[str], role: Optional[str]):
+    """
+    context manager around the request work: a shared nullcontext when not profiled,
+    otherwise a ProfileSession (skipped if this worker is already profiling another request)
+    """
+    reason = profile_reason(header_value, role)
+    if reason is None:
+        return nullcontext()
+    if not _active.acquire(blocking=False):
+        logger.info({"event": "profile_skipped_busy", "request_id": request_id, "reason": reason})
+        return nullcontext()
+    return _locked_profile(ProfileSession(request_id, endpoint, reason))
+
+@contextmanager
+def _locked_profile(profile: ProfileSession):
+    try:
+        with profile.run():
+            yield profile
+    finally:
+        _active.release()
+
+
+def save_profile(profile: ProfileSession):
+    """background task, one insert per profiled request (rare by design, not worth batching)"""
+    if profile.report is None:
+        return
+    report = profile.report
+    db = SessionLocal()
+    try:
+        db.add(RequestProfile(
+            request_id=profile.request_id,
+            endpoint=profile.endpoint,
+            reason=profile.reason,
+            profiler=report["profiler"],
+            wall_ms=report["wall_ms"],
+            cpu_ms=report["cpu_ms"],
+            alloc_peak_kb=(report["allocations"] or {}).get("peak_kb"),
+            report=report,
+        ))
+        db.commit()
+        logger.info({"event": "request_profile_saved", "request_id": profile.request_id, "reason": profile.reason, "wall_ms": report["wall_ms"], "cpu_ms": report["cpu_ms"]})
+    except Exception as e:
+        db.rollback()
+        logger.error({"event": "request_profile_save_failed", "request_id": profile.request_id, "error": type(e).__name__})
+    finally:
+        db.close()
@@ -0,0 +1,276 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Optional
+import redis
+from app.services.metrics_registry import metrics_registry
+
+logger = logging.getLogger("json_logger")
+
+#trip rules, evaluated over the calls of the last BREAKER_WINDOW_S seconds (at least BREAKER_MIN_CALLS of them)
+BREAKER_WINDOW_S = float(os.getenv("REDIS_BREAKER_WINDOW_S", 10))
+BREAKER_MIN_CALLS = int(os.getenv("REDIS_BREAKER_MIN_CALLS", 10))
+BREAKER_ERROR_RATE = float(os.getenv("REDIS_BREAKER_ERROR_RATE", 0.5)) # share of connection errors / timeouts
+BREAKER_SLOW_MS = float(os.getenv("REDIS_BREAKER_SLOW_MS", 250)) # a cache call slower than this counts as slow
+BREAKER_SLOW_RATE = float(os.getenv("REDIS_BREAKER_SLOW_RATE", 0.5))
+#recovery: background PINGs while open, this many fast ones in a row close the breaker
+BREAKER_PROBE_INTERVAL = float(os.getenv("REDIS_BREAKER_PROBE_INTERVAL", 2))
+BREAKER_PROBE_SUCCESSES = int(os.getenv("REDIS_BREAKER_PROBE_SUCCESSES", 3))
+
+#errors that say redis (or the network to it) is unhealthy. ResponseError (WRONGTYPE, unknown command...) is a bug, not an outage
+FAILURES = (redis.ConnectionError, redis.TimeoutError, OSError)
+
+STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+BREAKER_STATE = metrics_registry.gauge("ball_redis_breaker", "redis circuit breaker: state (0 closed, 1 half open, 2 open) & current window", ("stat",))
+BREAKER_TRANSITIONS = metrics_registry.counter("ball_redis_breaker_transitions_total", "redis circuit breaker state changes", ("state", "reason"))
+BREAKER_REJECTED = metrics_registry.counter("ball_redis_breaker_rejected_total", "redis calls short circuited while the breaker was open")
+
+
+class RedisUnavailable(redis.ConnectionError):
+    """raised instead of calling redis while the breaker is open, existing fail-open handlers catch it like any connection error"""
+
+
+class RedisCircuitBreaker:
+    """
+    **Circuit breaker for the redis cache client**
+
+    -closed: every call is timed, connection errors / timeouts & slow calls go into a rolling window
+    -trips (open) when the window holds at least BREAKER_MIN_CALLS calls & the error or slow share crosses its limit:
+    calls fail immediately (RedisUnavailable) instead of each one waiting on the socket timeout
+    -a background thread PINGs redis every BREAKER_PROBE_INTERVAL (half open after the first fast reply),
+    BREAKER_PROBE_SUCCESSES fast replies in a row close it again. user requests are never used as probes
+    """
+
+    def __init__(self, ping: Optional[Callable[[], object]] = None):
+        self.ping = ping
+        self.state = "closed"
+        self.opened_at: Optional[float] = None
+        self._window = deque() # (monotonic time, failed, slow)
+        self._failed = 0
+        self._slow = 0
+        self._lock = threading.Lock()
+        self._probe_thread: Optional[threading.Thread] = None
+        self._listeners: list[Callable[[str], None]] = []
+
+    def on_change(self, fn: Callable[[str], None]):
+        """fn(new_state) after every transition, outside the breaker lock"""
+        self._listeners.append(fn)
+
+    def allow(self)->bool:
+        return self.state == "closed"
+
+    def record(self, elapsed_ms: float, failed: bool):
+        if self.state != "closed":
+            return # late replies of calls started before the trip
+        slow = elapsed_ms > BREAKER_SLOW_MS
+        now = time.monotonic()
+        with self._lock:
+            self._window.append((now, failed, slow))
+            self._failed += failed
+            self._slow += slow
+            while self._window and self._window[0][0] < now - BREAKER_WINDOW_S:
+                _, old_failed, old_slow = self._window.popleft()
+                self._failed -= old_failed
+                self._slow -= old_slow
+            calls = len(self._window)
+            if calls < BREAKER_MIN_CALLS or self.state != "closed":
+                return
+            if self._failed/calls >= BREAKER_ERROR_RATE:
+                reason = "errors"
+            elif self._slow/calls >= BREAKER_SLOW_RATE:
+                reason = "latency"
+            else:
+                return
+            stats = {"calls": calls, "failed": self._failed, "slow": self._slow}
+            self._set_state("open")
+        logger.error({"event": "redis_breaker_open", "reason": reason, **stats})
+        BREAKER_TRANSITIONS.inc(state="open", reason=reason)
+        self._notify("open")
+        self._start_probe()
+
+    def call(self, fn: Callable, *args, **kwargs):
+        if self.state != "closed":
+            BREAKER_REJECTED.inc()
+            raise RedisUnavailable("redis circuit breaker open")
+        t0 = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except FAILURES:
+            self.record((time.perf_counter()-t0)*1000, True)
+            raise
+        self.record((time.perf_counter()-t0)*1000, False)
+        return result
+
+    def _set_state(self, state: str):
+        """caller holds the lock"""
+        self.state = state
+        if state == "open":
+            self.opened_at = time.time()
+        if state == "closed":
+            self.opened_at = None
+            self._window.clear()
+            self._failed = self._slow = 0
+
+    def _notify(self, state: str):
+        for fn in self._listeners:
+            try:
+                fn(state)
+            except Exception as e:
+                logger.error({"event": "redis_breaker_listener_error", "error": type(e).__name__})
+
+    def _start_probe(self):
+        if self.ping is None or (self._probe_thread and self._probe_thread.is_alive()):
+            return
+        self._probe_thread = threading.Thread(target=self._probe, name="redis-breaker-probe", daemon=True)
+        self._probe_thread.start()
+
+    def _probe(self):
+        successes = 0
+        while self.state != "closed":
+            time.sleep(BREAKER_PROBE_INTERVAL)
+            t0 = time.perf_counter()
+            try:
+                self.ping()
+                ok = (time.perf_counter()-t0)*1000 <= BREAKER_SLOW_MS
+            except Exception:
+                ok = False
+            successes = successes+1 if ok else 0
+            state = "closed" if successes >= BREAKER_PROBE_SUCCESSES else "half_open" if successes else "open"
+            if state == self.state:
+                continue
+            with self._lock:
+                opened_at = self.opened_at
+                self._set_state(state)
+            BREAKER_TRANSITIONS.inc(state=state, reason="probe")
+            if state == "closed":
+                logger.info({"event": "redis_breaker_closed", "open_for_s": round(time.time()-(opened_at or time.time()), 1)})
+            self._notify(state)
+
+    def stats(self)->dict:
+        with self._lock:
+            calls = len(self._window)
+            return {
+                "state": STATES[self.state],
+                "window_calls": calls,
+                "error_rate": round(self._failed/calls, 4) if calls else 0.0,
+                "slow_rate": round(self._slow/calls, 4) if calls else 0.0,
+                "open_for_s": round(time.time()-self.opened_at, 1) if self.opened_at else 0.0,
+            }
+
+
+class GuardedPipeline:
+    """pipeline whose execute() goes through the breaker, commands are only buffered until then"""
+
+    def __init__(self, pipe, breaker: RedisCircuitBreaker):
+        self._pipe = pipe
+        self._breaker = breaker
+
+    def execute(self, *args, **kwargs):
+        return self._breaker.call(self._pipe.execute, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._pipe, name)
+
+
+class GuardedRedis:
+    """
+    redis client proxy: every command goes through the breaker, pipelines are guarded on execute.
+    callers keep using the redis api (cache_service.client.get(...)), while open they get RedisUnavailable right away
+    """
+
+    PASSTHROUGH = {"get_cache", "close", "connection_pool"} # no network round trip
+
+    def __init__(self, client, breaker: RedisCircuitBreaker):
+        self.raw = client
+        self._breaker = breaker
+
+    def pipeline(self, *args, **kwargs)->GuardedPipeline:
+        return GuardedPipeline(self.raw.pipeline(*args, **kwargs), self._breaker)
+
+    def __getattr__(self, name):
+        attr = getattr(self.raw, name)
+        if name in self.PASSTHROUGH or not callable(attr):
+            return attr
+
+        def guarded(*args, **kwargs):
+            return self._breaker.call(attr, *args, **kwargs)
+        return guarded
+
+
+class LocalCache:
+    """bounded, thread safe LRU with a per entry ttl. the in-process fallback while redis is unavailable"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict() # key -> (expires at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return item[1]
+
+    def set(self, key: str, value, ttl: Optional[float] = None):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self)->int:
+        return len(self._data)
+
+
+class LocalLocks:
+    """
+    single flight inside this process while redis locks are unavailable: the first caller per key gets a token,
+    the others None (they wait on the cache like they do for a redis lock). expired locks can be taken over
+    """
+
+    def __init__(self):
+        self._locks = {} # key -> (token, expires at)
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, token: str, expire: float)->bool:
+        now = time.monotonic()
+        with self._lock:
+            held = self._locks.get(key)
+            if held and held[1] > now:
+                return False
+            self._locks[key] = (token, now + expire)
+            return True
+
+    def extend(self, key: str, token: str, expire: float)->bool:
+        with self._lock:
+            held = self._locks.get(key)
+            if not held or held[0] != token:
+                return False
+            self._locks[key] = (token, time.monotonic() + expire)
+            return True
+
+    def release(self, key: str, token: str)->bool:
+        with self._lock:
+            held = self._locks.get(key)
+            if not held or held[0] != token:
+                return False
+            del self._locks[key]
+            return True
+
+    def __len__(self)->int:
+        return len(self._locks)
@@ -5,7 +5,9 @@ from qdrant_client.http import models
 from app.db.session import init_db_connection, SessionLocal
 from app.services.vector_store import COLLECTION_NAME, get_qdrant_client
 from app.db.models import DocumentChunk
+from app.db.queries import fetch_chunks_sync
 from app.services.telemetry import TelemetryService
+from app.services.tracing import span
 from typing import Optional
 from contextlib import nullcontext
 
@@ -24,7 +26,9 @@ SIMILARITY_THRESHOLD = 0.3
 REGULATION_TOP_K=3
 POLICY_TOP_K=3
 
-def retrieve_balanced_chunks(query: str, session: Session,policy_filter_id: str= None, telemetry: Optional[TelemetryService]=None)-> list[tuple[DocumentChunk, float]]:
+def retrieve_balanced_chunks(query: str, session: Session,policy_filter_id: str= None, telemetry: Optional[TelemetryService]=None,
+                             regulation_top_k: int = REGULATION_TOP_K, policy_top_k: int = POLICY_TOP_K,
+                             score_threshold: float = SIMILARITY_THRESHOLD, search_params: Optional[models.SearchParams] = None)-> list[tuple[DocumentChunk, float]]:
     """
     **Semantic Search Layer**
 
@@ -32,6 +36,8 @@ def retrieve_balanced_chunks(query: str, session: Session,policy_filter_id: str=
     -Search qdrant from similar vectors
     -apply similarity threshold to filter & return top_k
     -join with postgres to capture full relevant text
+
+    top_k / threshold / search_params default to the module settings, overridden by the retrieval eval (benchmarks.retrieval_eval)
     
     return: list of tuples
     """
@@ -53,14 +59,17 @@ def retrieve_balanced_chunks(query: str, session: Session,policy_filter_id: str=
             reg_filter= models.Filter(
                 must = [models.FieldCondition(key="source_type", match=models.MatchValue(value="regulation"))]
             )
-            reg_results = client.query_points(
-                collection_name=COLLECTION_NAME,
-                query=query_vector,
-                limit=REGULATION_TOP_K,
-                query_filter=reg_filter,
-                with_payload=True,
-                score_threshold=SIMILARITY_THRESHOLD
-            ).points
+            with span("qdrant.query_points", **{"qdrant.source_type": "regulation", "qdrant.limit": regulation_top_k, "qdrant.score_threshold": score_threshold}) as s:
+                reg_results = client.query_points(
+                    collection_name=COLLECTION_NAME,
+                    query=query_vector,
+                    limit=regulation_top_k,
+                    query_filter=reg_filter,
+                    search_params=search_params,
+                    with_payload=True,
+                    score_threshold=score_threshold
+                ).points
+                s.set_attributes({"qdrant.hits": len(reg_results), "qdrant.top_score": reg_results[0].score if reg_results else 0.0})
 
     except Exception as e:
         # logger.error(f'Qdrant search failed: {e}')
@@ -75,20 +84,23 @@ def retrieve_balanced_chunks(query: str, session: Session,policy_filter_id: str=
             policy_conditions= [models.FieldCondition(key="source_type", match=models.MatchValue(value="policy"))]
             #scoped results
             if policy_filter_id:
-                logger.info(f"Scoping retrieval to Policy ID: {policy_filter_id}")
+                logger.info({"event": "retrieval_scoped", "policy_filter_id": str(policy_filter_id)})
                 policy_conditions.append(
                     models.FieldCondition(key="source_id", match=models.MatchValue(value=str(policy_filter_id)))
                     )
             pol_filter = models.Filter(must=policy_conditions)
 
-            pol_results = client.query_points(
-                collection_name=COLLECTION_NAME,
-                query=query_vector,
-                limit=POLICY_TOP_K,
-                query_filter=pol_filter,
-                with_payload=True,
-                score_threshold=SIMILARITY_THRESHOLD
-            ).points
+            with span("qdrant.query_points", **{"qdrant.source_type": "policy", "qdrant.limit": policy_top_k, "qdrant.score_threshold": score_threshold, "qdrant.scoped": bool(policy_filter_id)}) as s:
+                pol_results = client.query_points(
+                    collection_name=COLLECTION_NAME,
+                    query=query_vector,
+                    limit=policy_top_k,
+                    query_filter=pol_filter,
+                    search_params=search_params,
+                    with_payload=True,
+                    score_threshold=score_threshold
+                ).points
+                s.set_attributes({"qdrant.hits": len(pol_results), "qdrant.top_score": pol_results[0].score if pol_results else 0.0})
 
     except Exception as e:
         # logger.error(f'Qdrant search failed: {e}')
@@ -122,7 +134,7 @@ def retrieve_balanced_chunks(query: str, session: Session,policy_filter_id: str=
     try:
         cm = telemetry.measure("db_fetch") if telemetry else nullcontext()
         with cm:
-            chunks = session.query(DocumentChunk).filter(DocumentChunk.id.in_(target_ids)).all()
+            chunks = fetch_chunks_sync(session, target_ids)
     except Exception as e:
         logger.error({"event": "db_fetch_failed", "error": str(e)})
         if telemetry: telemetry.set_error("DB_FETCH_FAILURE")
@@ -137,7 +149,8 @@ def retrieve_balanced_chunks(query: str, session: Session,policy_filter_id: str=
             doc_chunk = chunk_map[chunk_id]
             score= points.score
             relevant_chunks.append((doc_chunk, score))
-            logger.info(f'Found: [{score:.2f}] {doc_chunk.source_type.upper()}: {doc_chunk.text_content[:50]}')
+            if logger.isEnabledFor(logging.DEBUG): #one per hit, skipped entirely at INFO
+                logger.debug({"event": "retrieval_hit", "chunk_id": chunk_id, "source_type": doc_chunk.source_type, "score": round(score, 2)})
         else:
             logger.error("data drift detected: did not find corresponding id in postgres")
 
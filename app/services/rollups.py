@@ -0,0 +1,235 @@
+import logging
+import math
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy import select, delete, text
+from sqlalchemy.orm import Session
+from app.db.models import MetricRollup, RequestMetric, RequestProfile
+
+logger = logging.getLogger("json_logger")
+
+GRANULARITIES = {"minute": timedelta(minutes=1), "hour": timedelta(hours=1)}
+DIMENSIONS = ("endpoint", "intent", "cache_layer", "model_name")
+
+#retention, raw rows are only needed until their rollups exist & for ad-hoc debugging
+RAW_RETENTION_DAYS = int(os.getenv("METRICS_RAW_RETENTION_DAYS", 30))
+MINUTE_RETENTION_DAYS = int(os.getenv("METRICS_MINUTE_RETENTION_DAYS", 7))
+HOUR_RETENTION_DAYS = int(os.getenv("METRICS_HOUR_RETENTION_DAYS", 400))
+PROFILE_RETENTION_DAYS = int(os.getenv("METRICS_PROFILE_RETENTION_DAYS", 7)) # request_profiles, large json reports
+PURGE_BATCH = 5000
+
+SKETCH_RELATIVE_ACCURACY = 0.02
+_GAMMA = (1+SKETCH_RELATIVE_ACCURACY)/(1-SKETCH_RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+
+
+class LatencySketch:
+    """
+    mergeable quantile sketch (log-bucket histogram, DDSketch style):
+    -every value lands in bucket ceil(log_gamma(v)), percentiles are within ~2% relative error
+    -merge = add bucket counts, so minute buckets roll into hours & any window without raw rows
+    -stored as {bucket_index: count} json, a few dozen keys for typical latency spreads
+    """
+
+    def __init__(self, buckets: Optional[Dict[str, int]] = None):
+        self.buckets: Dict[int, int] = {int(k): v for k, v in (buckets or {}).items()}
+
+    def add(self, value_ms: float, count: int = 1):
+        idx = 0 if value_ms <= 1.0 else math.ceil(math.log(value_ms)/_LOG_GAMMA) # everything under 1ms shares bucket 0
+        self.buckets[idx] = self.buckets.get(idx, 0) + count
+
+    def merge(self, other: "LatencySketch"):
+        for idx, count in other.buckets.items():
+            self.buckets[idx] = self.buckets.get(idx, 0) + count
+
+    @property
+    def count(self)->int:
+        return sum(self.buckets.values())
+
+    def quantile(self, q: float)->Optional[float]:
+        total = self.count
+        if total == 0:
+            return None
+        rank = q*(total-1)
+        seen = 0
+        for idx in sorted(self.buckets):
+            seen += self.buckets[idx]
+            if seen > rank:
+                return 1.0 if idx == 0 else round(2*_GAMMA**idx/(_GAMMA+1), 2) # bucket midpoint
+        return None
+
+    def to_json(self)->Dict[str, int]:
+        return {str(k): v for k, v in self.buckets.items()}
+
+
+def _bucket_start(ts: datetime, granularity: str)->datetime:
+    if granularity == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(second=0, microsecond=0)
+
+def _dims(row: dict)->tuple:
+    return tuple(str(row.get(d) or "none") for d in DIMENSIONS)
+
+
+def aggregate_rows(rows: Iterable[dict])->Dict[tuple, dict]:
+    """request_metrics rows -> partial rollups keyed by (granularity, bucket_start, *dimensions)"""
+    groups: Dict[tuple, dict] = {}
+    for row in rows:
+        ts = row.get("timestamp") or datetime.now(timezone.utc)
+        for granularity in GRANULARITIES:
+            key = (granularity, _bucket_start(ts, granularity)) + _dims(row)
+            g = groups.get(key)
+            if g is None:
+                g = groups[key] = {"request_count": 0, "error_count": 0, "cache_hit_count": 0, "latency_sum_ms": 0.0,
+                                   "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0, "escalated_count": 0,
+                                   "escalation_cost_usd": 0.0, "sketch": LatencySketch()}
+            latency = row.get("total_latency_ms") or 0.0
+            g["request_count"] += 1
+            g["error_count"] += 1 if (row.get("status_code") or 0) >= 500 or row.get("error_type") else 0
+            g["cache_hit_count"] += 1 if row.get("is_cache_hit") else 0
+            g["latency_sum_ms"] += latency
+            g["prompt_tokens"] += row.get("prompt_tokens") or 0
+            g["completion_tokens"] += row.get("completion_tokens") or 0
+            g["cost_usd"] += row.get("cost_usd") or 0.0
+            g["escalated_count"] += 1 if row.get("escalated") else 0
+            g["escalation_cost_usd"] += ((row.get("llm_tiers") or {}).get("escalation") or {}).get("cost_usd", 0.0)
+            g["sketch"].add(latency)
+    return groups
+
+
+def apply_rollups(db: Session, rows: List[dict]):
+    """
+    merges a flushed batch into metric_rollups (caller commits).
+    -ensure every bucket row exists (insert .. on conflict do nothing), then lock & merge
+    -keys are processed in sorted order so concurrent workers lock rows in the same order (no deadlocks)
+    """
+    groups = aggregate_rows(rows)
+    if not groups:
+        return
+
+    dialect = db.bind.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as upsert_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as upsert_insert
+
+    for key in sorted(groups):
+        granularity, bucket_start, *dims = key
+        ident = dict(granularity=granularity, bucket_start=bucket_start, **dict(zip(DIMENSIONS, dims)))
+        db.execute(upsert_insert(MetricRollup).values(latency_sketch={}, **ident).on_conflict_do_nothing())
+
+        rollup = db.execute(
+            select(MetricRollup).filter_by(**ident).with_for_update()
+        ).scalar_one()
+
+        g = groups[key]
+        rollup.request_count = (rollup.request_count or 0) + g["request_count"]
+        rollup.error_count = (rollup.error_count or 0) + g["error_count"]
+        rollup.cache_hit_count = (rollup.cache_hit_count or 0) + g["cache_hit_count"]
+        rollup.latency_sum_ms = (rollup.latency_sum_ms or 0.0) + g["latency_sum_ms"]
+        rollup.prompt_tokens = (rollup.prompt_tokens or 0) + g["prompt_tokens"]
+        rollup.completion_tokens = (rollup.completion_tokens or 0) + g["completion_tokens"]
+        rollup.cost_usd = (rollup.cost_usd or 0.0) + g["cost_usd"]
+        rollup.escalated_count = (rollup.escalated_count or 0) + g["escalated_count"]
+        rollup.escalation_cost_usd = (rollup.escalation_cost_usd or 0.0) + g["escalation_cost_usd"]
+        sketch = LatencySketch(rollup.latency_sketch)
+        sketch.merge(g["sketch"])
+        rollup.latency_sketch = sketch.to_json()
+
+
+def summarize(db: Session, hours: int = 24, group_by: Optional[str] = None, granularity: Optional[str] = None)->dict:
+    """
+    **dashboard read path**: only touches metric_rollups (at most hours x groups rows), never raw request_metrics
+    """
+    if group_by is not None and group_by not in DIMENSIONS:
+        raise ValueError(f"group_by must be one of {DIMENSIONS}")
+    granularity = granularity or ("minute" if hours <= 6 else "hour")
+    since = _bucket_start(datetime.now(timezone.utc) - timedelta(hours=hours), granularity)
+
+    rollups = db.execute(
+        select(MetricRollup).where(MetricRollup.granularity == granularity, MetricRollup.bucket_start >= since)
+    ).scalars().all()
+
+    groups: Dict[str, dict] = defaultdict(lambda: {"requests": 0, "errors": 0, "cache_hits": 0, "latency_sum_ms": 0.0,
+                                                    "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0, "escalated": 0,
+                                                    "escalation_cost_usd": 0.0, "sketch": LatencySketch()})
+    for r in rollups:
+        g = groups[getattr(r, group_by) if group_by else "all"]
+        g["requests"] += r.request_count
+        g["errors"] += r.error_count
+        g["cache_hits"] += r.cache_hit_count
+        g["latency_sum_ms"] += r.latency_sum_ms
+        g["prompt_tokens"] += r.prompt_tokens
+        g["completion_tokens"] += r.completion_tokens
+        g["cost_usd"] += r.cost_usd
+        g["escalated"] += r.escalated_count or 0
+        g["escalation_cost_usd"] += r.escalation_cost_usd or 0.0
+        g["sketch"].merge(LatencySketch(r.latency_sketch))
+
+    result = {}
+    for name, g in groups.items():
+        n = g["requests"] or 1
+        sketch = g.pop("sketch")
+        result[name] = {
+            "requests": g["requests"],
+            "error_rate": round(g["errors"]/n, 4),
+            "cache_hit_rate": round(g["cache_hits"]/n, 4),
+            "avg_latency_ms": round(g["latency_sum_ms"]/n, 2),
+            "p50_latency_ms": sketch.quantile(0.50),
+            "p95_latency_ms": sketch.quantile(0.95),
+            "p99_latency_ms": sketch.quantile(0.99),
+            "prompt_tokens": g["prompt_tokens"],
+            "completion_tokens": g["completion_tokens"],
+            "cost_usd": round(g["cost_usd"], 6),
+            "cost_per_request_usd": round(g["cost_usd"]/n, 6),
+            "escalation_rate": round(g["escalated"]/n, 4),
+            "escalation_cost_usd": round(g["escalation_cost_usd"], 6),
+        }
+
+    return {"window_hours": hours, "granularity": granularity, "group_by": group_by, "since": since.isoformat(), "groups": result}
+
+
+def ensure_metrics_storage(engine):
+    """
+    create_all never alters tables that already exist (no migrations in this repo), this backfills on old deployments:
+    -columns added to request_metrics / metric_rollups since the tables were created
+    -the brin index on timestamp
+    """
+    if engine is None or engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE request_metrics ADD COLUMN IF NOT EXISTS cached_tokens INTEGER DEFAULT 0"))
+        conn.execute(text("ALTER TABLE request_metrics ADD COLUMN IF NOT EXISTS escalated BOOLEAN DEFAULT FALSE"))
+        conn.execute(text("ALTER TABLE request_metrics ADD COLUMN IF NOT EXISTS llm_tiers JSON"))
+        conn.execute(text("ALTER TABLE metric_rollups ADD COLUMN IF NOT EXISTS escalated_count INTEGER NOT NULL DEFAULT 0"))
+        conn.execute(text("ALTER TABLE metric_rollups ADD COLUMN IF NOT EXISTS escalation_cost_usd DOUBLE PRECISION NOT NULL DEFAULT 0"))
+        conn.execute(text('CREATE INDEX IF NOT EXISTS ix_request_metrics_timestamp_brin ON request_metrics USING brin ("timestamp")'))
+
+
+def purge_expired(db: Session)->dict:
+    """retention: raw rows, minute rollups & request profiles age out, hourly rollups are kept long term. Deletes run in small batches"""
+    now = datetime.now(timezone.utc)
+    removed = {"raw": 0, "minute": 0, "hour": 0, "profiles": 0}
+
+    raw_cutoff = now - timedelta(days=RAW_RETENTION_DAYS)
+    while True:
+        ids = select(RequestMetric.id).where(RequestMetric.timestamp < raw_cutoff).limit(PURGE_BATCH)
+        n = db.execute(delete(RequestMetric).where(RequestMetric.id.in_(ids))).rowcount
+        db.commit()
+        removed["raw"] += n
+        if n < PURGE_BATCH:
+            break
+
+    for granularity, days in (("minute", MINUTE_RETENTION_DAYS), ("hour", HOUR_RETENTION_DAYS)):
+        removed[granularity] = db.execute(
+            delete(MetricRollup).where(MetricRollup.granularity == granularity, MetricRollup.bucket_start < now - timedelta(days=days))
+        ).rowcount
+        db.commit()
+
+    removed["profiles"] = db.execute(delete(RequestProfile).where(RequestProfile.created_at < now - timedelta(days=PROFILE_RETENTION_DAYS))).rowcount
+    db.commit()
+
+    logger.info({"event": "metrics_retention_applied", **removed})
+    return removed
@@ -2,9 +2,13 @@ import time
 import logging
 from contextlib import contextmanager
 from typing import Optional
+from app.services.metrics_registry import STAGE_LATENCY, LLM_TOKENS, LLM_COST
+from app.services import tracing
 
+#usd per 1M tokens. "cached_input" is the discounted rate for prompt tokens served from openai's prompt cache
 PRICING_REGISTRY={
-    "gpt-4o-mini": {"input": 0.15, "output": 0.60},
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+    "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
     "text-embedding-3-small": {"input": 0.02, "output": 0.0},
     "default": {"input": 0.0, "output": 0.0}
 }
@@ -27,12 +31,20 @@ class TelemetryService:
             # Costs & Metadata
             "prompt_tokens": 0,
             "completion_tokens": 0,
+            "cached_tokens": 0,
             "cost_usd": 0.0,
+            "context_tokens": 0,
+            "context_tokens_saved": 0,
             "models_used": set(),
+            # cascade mode: per tier model/tokens/cost/context, latency lands in llm_<tier>_ms (persisted in request_metrics)
+            "llm_tiers": {},
+            "escalated": False,
             "error_type": None, 
             "is_cache_hit": False,
             "cache_lookup_ms": 0.0,
-            "cache_layer": None
+            "cache_layer": None,
+            # query embedding served from cache, the request itself may still run the full pipeline
+            "embedding_cache_hit": False
         }
 
         self.start_time = time.time()
@@ -40,26 +52,35 @@ class TelemetryService:
     def mark_cache_hit(self, layer: str):
         self.metrics["cache_layer"]=layer
         self.metrics["is_cache_hit"]=True
+        tracing.set_attributes(**{"cache.tier": layer, "cache.hit": True})
+
+    def mark_embedding_cache_hit(self):
+        """sub-stage hit, kept out of is_cache_hit / cache_layer (those mean the request was answered from cache)"""
+        self.metrics["embedding_cache_hit"]=True
+        tracing.set_attributes(**{"cache.embedding_hit": True})
 
     @contextmanager
     def measure(self, stage: str):
         """
         measure latency of each stage & log start & end event
+        also opens a tracing span named after the stage (no-op when tracing is off)
         """
 
         t0 = time.time()
 
-        self.logger.info({
+        self.logger.debug({ #start events only matter when debugging, the _complete event has the duration
             "event": f'{stage}_start',
             "request_id": self.request_id 
         })
 
         try:
-            yield
+            with tracing.span(stage, **{"request.id": self.request_id}):
+                yield
         finally:
             duration = (time.time()-t0)*1000
             key = f'{stage}_ms'
             self.metrics[key] = self.metrics.get(key, 0.0) + round(duration,2)
+            STAGE_LATENCY.observe(duration, stage=stage)
 
             self.logger.info({
                 "event": f'{stage}_complete',
@@ -68,32 +89,79 @@ class TelemetryService:
 
             })
 
-    def _calculate_cost(self, model: str, p_tokens: int, c_tokens: int)-> float:
+    def span(self, name: str, **attributes):
+        """sub-call span (qdrant query, sql, http attempt...) nested under the current stage, no latency metric"""
+        return tracing.span(name, **{"request.id": self.request_id}, **attributes)
+
+    def _calculate_cost(self, model: str, p_tokens: int, c_tokens: int, cached_tokens: int = 0)-> float:
         pricing= PRICING_REGISTRY.get(model, PRICING_REGISTRY["default"])
-        input_cost = (p_tokens/1_000_000)*pricing["input"]
+        #cached tokens are a subset of prompt tokens, billed at the cached rate
+        input_cost = ((p_tokens-cached_tokens)/1_000_000)*pricing["input"]
+        cached_cost = (cached_tokens/1_000_000)*pricing.get("cached_input", pricing["input"])
         output_cost = (c_tokens/1_000_000)*pricing["output"]
 
-        return input_cost+output_cost
+        return input_cost+cached_cost+output_cost
     
-    def track_llm(self, usage_object, model: str):
+    def track_llm(self, usage_object, model: str, tier: Optional[str] = None):
         if not usage_object:
             return
         
         p= usage_object.prompt_tokens
         c = usage_object.completion_tokens
+        details = getattr(usage_object, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", 0) or 0) if details else 0
 
         self.metrics["prompt_tokens"] += p
         self.metrics["completion_tokens"] += c
+        self.metrics["cached_tokens"] += cached
+        cost = self._calculate_cost(model, p, c, cached)
         self.metrics["models_used"].add(model)
-        self.metrics["cost_usd"] += self._calculate_cost(model, p, c)
+        self.metrics["cost_usd"] += cost
+        LLM_TOKENS.inc(p, model=model, kind="prompt")
+        LLM_TOKENS.inc(c, model=model, kind="completion")
+        if cached: LLM_TOKENS.inc(cached, model=model, kind="cached")
+        LLM_COST.inc(cost, model=model)
+        tracing.set_attributes(**{"llm.model": model, "llm.tier": tier, "llm.prompt_tokens": p, "llm.completion_tokens": c,
+                                  "llm.cached_tokens": cached, "llm.cost_usd": cost})
+
+        if tier:
+            t = self._tier(tier)
+            t["model"] = model
+            t["calls"] += 1
+            t["prompt_tokens"] += p
+            t["completion_tokens"] += c
+            t["cost_usd"] += cost
+
+    def _tier(self, tier: str)->dict:
+        return self.metrics["llm_tiers"].setdefault(tier, {"model": None, "calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0,
+                                                            "context_tokens": 0, "context_tokens_saved": 0})
 
     def track_embedding(self, token_count: int, model: str = "text-embedding-3-small"):
+        cost = self._calculate_cost(model, token_count, 0)
         self.metrics["prompt_tokens"] += token_count
         self.metrics["models_used"].add(model)
-        self.metrics["cost_usd"] += self._calculate_cost(model, token_count, 0)
+        self.metrics["cost_usd"] += cost
+        LLM_TOKENS.inc(token_count, model=model, kind="prompt")
+        LLM_COST.inc(cost, model=model)
+        tracing.set_attributes(**{"embedding.model": model, "embedding.tokens": token_count})
     
+    def track_context(self, original_tokens: int, final_tokens: int, tier: Optional[str] = None):
+        """
+        prompt tokens removed by the context budgeter before the llm call.
+        request totals add up every context sent (cascade: fast + escalation), tier splits them in llm_tiers
+        """
+        saved = max(0, original_tokens - final_tokens)
+        self.metrics["context_tokens"] += final_tokens
+        self.metrics["context_tokens_saved"] += saved
+        if tier:
+            t = self._tier(tier)
+            t["context_tokens"] += final_tokens
+            t["context_tokens_saved"] += saved
+        tracing.set_attributes(**{"context.original_tokens": original_tokens, "context.final_tokens": final_tokens, "context.tier": tier})
+
     def set_error(self, error_type: str):
         self.metrics["error_type"]= error_type
+        tracing.mark_error(error_type)
     
     def get_summary(self):
         sorted_models = sorted(list(self.metrics["models_used"]))
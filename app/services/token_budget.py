@@ -0,0 +1,143 @@
+import logging
+import os
+import re
+from functools import lru_cache
+from typing import List, Optional
+
+logger = logging.getLogger("json_logger")
+
+#token ceiling for the retrieved sources block of the audit prompt (headers not included)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 2500))
+#a trimmed source never drops below this, so every Source N label still points at real evidence
+MIN_SOURCE_TOKENS = 40
+TOKENIZER_ENCODING = "o200k_base" # gpt-4o family
+
+_SENTENCE_SPLIT = re.compile(r'(?<=[.!?;])\s+|\n+')
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset("a an and are as at be by does do for from has have in is it of on or the to what which with".split())
+
+
+@lru_cache(maxsize=1)
+def _get_encoder():
+    """
+    tiktoken, its bpe file is read from TIKTOKEN_CACHE_DIR (baked into the image by backend.Dockerfile).
+    falls back to a ~4 chars/token estimate if it's missing or can't load the file (offline without the cache)
+    """
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception as e:
+        logger.warning({"event": "tokenizer_fallback", "error": type(e).__name__})
+        return None
+
+def tokenizer_name()->str:
+    """"tiktoken" or "estimate" (the fallback), token counts are only comparable between runs with the same one"""
+    return "tiktoken" if _get_encoder() is not None else "estimate"
+
+def count_tokens(text: str)->int:
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder is None:
+        return max(1, len(text)//4)
+    return len(encoder.encode(text, disallowed_special=()))
+
+def _normalize_sentence(sentence: str)->str:
+    return " ".join(_WORD.findall(sentence.lower()))
+
+def split_sentences(text: str)->List[str]:
+    return [s.strip() for s in _SENTENCE_SPLIT.split(text) if s.strip()]
+
+def _truncate_words(text: str, max_tokens: int)->str:
+    words = text.split()
+    ratio = max_tokens/max(count_tokens(text), 1)
+    return " ".join(words[:max(1, int(len(words)*ratio))]) + " ..."
+
+def extract_sentences(text: str, query: str, max_tokens: int)->str:
+    """
+    sentence extraction for a low scoring chunk:
+    -rank sentences by overlap with the query terms
+    -keep the best ones that fit in max_tokens
+    -emit them in original order so the clause still reads naturally
+    """
+    sentences = split_sentences(text)
+    if not sentences:
+        return text
+
+    query_terms = set(_WORD.findall(query.lower())) - _STOPWORDS
+    ranked = sorted(
+        range(len(sentences)),
+        key=lambda i: (-len(query_terms & set(_WORD.findall(sentences[i].lower()))), i)
+    )
+
+    keep, used = [], 0
+    for i in ranked:
+        cost = count_tokens(sentences[i])
+        if used + cost > max_tokens:
+            continue
+        keep.append(i)
+        used += cost
+
+    if not keep: #even the best sentence is over budget
+        return _truncate_words(sentences[ranked[0]], max_tokens)
+
+    return " ".join(sentences[i] for i in sorted(keep)) + " ..."
+
+def build_budgeted_context(sources: List[tuple[str, float]], query: str, budget: int = CONTEXT_TOKEN_BUDGET)->tuple[List[str], dict]:
+    """
+    **Context compressor**
+
+    sources: (text, score) in prompt order. Output keeps the same order & length, so Source N labels never shift.
+
+    -dedupe: a sentence already present in a higher scoring source (e.g. a policy quoting the regulation) is dropped
+    -budget: if still over budget, lowest scoring sources are sentence-extracted first, the best ones stay verbatim
+
+    returns: (texts, stats)
+    """
+    by_score = sorted(range(len(sources)), key=lambda i: -sources[i][1])
+    texts = [text for text, _ in sources]
+    original_tokens = [count_tokens(t) for t in texts]
+
+    #1. dedupe overlapping sentences, highest score wins
+    seen = {}
+    deduped_sentences = 0
+    for i in by_score:
+        sentences = split_sentences(texts[i])
+        kept, duplicate_of = [], None
+        for sentence in sentences:
+            norm = _normalize_sentence(sentence)
+            if len(norm) > 20 and norm in seen: # very short sentences ("Section 2.") are too generic to count as overlap
+                deduped_sentences += 1
+                duplicate_of = seen[norm]
+                continue
+            seen.setdefault(norm, i)
+            kept.append(sentence)
+        if sentences and not kept:
+            texts[i] = f"(same text as Source {duplicate_of+1})"
+        elif len(kept) < len(sentences):
+            texts[i] = " ".join(kept)
+
+    #2. enforce budget, trimming from the lowest score up
+    tokens = [count_tokens(t) for t in texts]
+    over = sum(tokens) - budget
+    trimmed = 0
+    for i in reversed(by_score):
+        if over <= 0:
+            break
+        target = max(MIN_SOURCE_TOKENS, tokens[i] - over)
+        if target >= tokens[i]:
+            continue
+        texts[i] = extract_sentences(texts[i], query, target)
+        new_count = count_tokens(texts[i])
+        over -= tokens[i] - new_count
+        tokens[i] = new_count
+        trimmed += 1
+
+    stats = {
+        "original_tokens": sum(original_tokens),
+        "final_tokens": sum(tokens),
+        "tokens_saved": max(0, sum(original_tokens) - sum(tokens)),
+        "sources_trimmed": trimmed,
+        "sentences_deduped": deduped_sentences,
+    }
+    return texts, stats
@@ -0,0 +1,265 @@
+import logging
+import os
+import random
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+logger = logging.getLogger("json_logger")
+
+#tracing is off unless an OTLP collector is configured (opentelemetry sdk & otlp exporter ship with the image,
+#still imported lazily so scripts & tests without them run untraced)
+OTEL_EXPORTER_OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "ball-compliance-engine")
+#head = keep/drop decided at the root span (cheap), tail = buffer each trace & keep errors, slow ones + a ratio baseline
+TRACE_SAMPLER = os.getenv("TRACE_SAMPLER", "head")
+TRACE_SAMPLE_RATIO = float(os.getenv("TRACE_SAMPLE_RATIO", 0.1))
+TRACE_TAIL_LATENCY_MS = float(os.getenv("TRACE_TAIL_LATENCY_MS", 2000))
+TRACE_TAIL_MAX_PENDING = 2000 # traces buffered at once in tail mode, beyond that new traces are dropped
+
+_tracer = None
+_provider = None
+
+
+class _NoopSpan:
+    """shared span & context manager for the tracing-off path, no allocation per call"""
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+    def set_attribute(self, key, value): pass
+    def set_attributes(self, attributes): pass
+    def record_exception(self, exception): pass
+    def update_name(self, name): pass
+    def is_recording(self): return False
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def tracing_enabled()->bool:
+    return _tracer is not None
+
+def span(name: str, **attributes):
+    """
+    child span of whatever span is current (contextvars, so it follows the request into the threadpool).
+    tracing off = one global check & a shared no-op span
+    """
+    if _tracer is None:
+        return _NOOP_SPAN
+    return _recording_span(name, attributes)
+
+@contextmanager
+def _recording_span(name: str, attributes: dict):
+    with _tracer.start_as_current_span(name) as s:
+        if attributes and s.is_recording():
+            s.set_attributes({k: v for k, v in attributes.items() if v is not None})
+        yield s
+
+def set_attributes(**attributes):
+    """annotate the current span (tokens, scores, cache tier...), no-op when tracing is off or the trace isn't sampled"""
+    if _tracer is None:
+        return
+    from opentelemetry import trace
+    s = trace.get_current_span()
+    if s.is_recording():
+        s.set_attributes({k: v for k, v in attributes.items() if v is not None})
+
+def mark_error(error_type: str):
+    """handled failures (retrieval empty, llm schema mismatch...) never raise, flag the span so tail sampling keeps the trace"""
+    if _tracer is None:
+        return
+    from opentelemetry import trace
+    from opentelemetry.trace import Status, StatusCode
+    s = trace.get_current_span()
+    if s.is_recording():
+        s.set_attribute("error.type", error_type)
+        s.set_status(Status(StatusCode.ERROR, error_type))
+
+
+def _build_tail_processor(delegate):
+    from opentelemetry.sdk.trace import SpanProcessor
+    from opentelemetry.trace import StatusCode
+
+    class TailSamplingProcessor(SpanProcessor):
+        """
+        buffers finished spans per trace until the local root ends, then forwards the whole trace or nothing:
+        -any span errored -> keep
+        -root slower than TRACE_TAIL_LATENCY_MS -> keep
+        -otherwise keep TRACE_SAMPLE_RATIO of them as a baseline
+        """
+
+        def __init__(self):
+            self._pending = {}
+            self._lock = threading.Lock()
+            self.dropped_overflow = 0
+
+        def on_start(self, span, parent_context=None):
+            pass
+
+        def on_end(self, span):
+            trace_id = span.context.trace_id
+            is_root = span.parent is None or span.parent.is_remote
+            with self._lock:
+                spans = self._pending.get(trace_id)
+                if spans is None:
+                    if len(self._pending) >= TRACE_TAIL_MAX_PENDING and not is_root:
+                        self.dropped_overflow += 1
+                        return
+                    spans = self._pending[trace_id] = []
+                spans.append(span)
+                if not is_root:
+                    return
+                spans = self._pending.pop(trace_id)
+
+            duration_ms = (span.end_time - span.start_time)/1e6
+            keep = (
+                any(s.status.status_code == StatusCode.ERROR for s in spans)
+                or duration_ms >= TRACE_TAIL_LATENCY_MS
+                or random.random() < TRACE_SAMPLE_RATIO
+            )
+            if keep:
+                for s in spans:
+                    delegate.on_end(s)
+
+        def shutdown(self):
+            delegate.shutdown()
+
+        def force_flush(self, timeout_millis: int = 30000):
+            return delegate.force_flush(timeout_millis)
+
+    return TailSamplingProcessor()
+
+
+def init_tracing(service_name: str = OTEL_SERVICE_NAME)->bool:
+    """called once from the app lifespan, returns False (tracing stays a no-op) if unconfigured or opentelemetry is missing"""
+    global _tracer, _provider
+    if _tracer is not None:
+        return True
+    if not OTEL_EXPORTER_OTLP_ENDPOINT:
+        return False
+
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.sdk.trace.sampling import ALWAYS_ON, ParentBased, TraceIdRatioBased
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    except ImportError as e:
+        logger.warning({"event": "tracing_unavailable", "error": str(e)})
+        return False
+
+    #tail mode has to record everything, the keep/drop decision happens once the trace has finished
+    sampler = ALWAYS_ON if TRACE_SAMPLER == "tail" else ParentBased(TraceIdRatioBased(TRACE_SAMPLE_RATIO))
+    _provider = TracerProvider(resource=Resource.create({"service.name": service_name}), sampler=sampler)
+
+    exporter = OTLPSpanExporter(endpoint=OTEL_EXPORTER_OTLP_ENDPOINT.rstrip("/") + "/v1/traces")
+    processor = BatchSpanProcessor(exporter)
+    _provider.add_span_processor(_build_tail_processor(processor) if TRACE_SAMPLER == "tail" else processor)
+
+    trace.set_tracer_provider(_provider)
+    _tracer = trace.get_tracer("ball.telemetry")
+    logger.info({"event": "tracing_enabled", "sampler": TRACE_SAMPLER, "ratio": TRACE_SAMPLE_RATIO, "endpoint": OTEL_EXPORTER_OTLP_ENDPOINT})
+    return True
+
+def shutdown_tracing():
+    global _tracer, _provider
+    if _provider is not None:
+        _provider.shutdown() # flushes the batch processor
+    _tracer = _provider = None
+
+
+#OUTBOUND HTTP (openai)
+
+def openai_transport(inner=None):
+    """
+    httpx transport for the OpenAI SDK with one span per http attempt around <inner> (default: a plain HTTPTransport),
+    so the sdk's internal retries show up. None when tracing is off. composed in app.services.openai_transport
+    """
+    if _tracer is None:
+        return None
+    import httpx
+    inner = inner or httpx.HTTPTransport()
+
+    class TracingTransport(httpx.BaseTransport):
+        def handle_request(self, request):
+            with span("openai.http", **{"http.method": request.method, "http.url": str(request.url.copy_with(query=None))}) as s:
+                response = inner.handle_request(request)
+                s.set_attribute("http.status_code", response.status_code)
+                return response
+
+        def close(self):
+            inner.close()
+
+    return TracingTransport()
+
+
+#POSTGRES
+
+def instrument_engine(engine):
+    """one span per sql statement, listeners bail out immediately while tracing is off"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if _tracer is None:
+            return
+        s = _tracer.start_span("postgres.query")
+        if s.is_recording():
+            s.set_attributes({"db.system": conn.dialect.name, "db.statement": statement[:500], "db.executemany": executemany})
+        conn.info.setdefault("_trace_spans", []).append(s)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get("_trace_spans")
+        if spans:
+            s = spans.pop()
+            if s.is_recording() and cursor.rowcount is not None and cursor.rowcount >= 0:
+                s.set_attribute("db.rowcount", cursor.rowcount)
+            s.end()
+
+    @event.listens_for(engine, "handle_error")
+    def _error(exception_context):
+        conn = exception_context.connection
+        spans = conn.info.get("_trace_spans") if conn is not None else None
+        if spans:
+            from opentelemetry.trace import Status, StatusCode
+            s = spans.pop()
+            s.record_exception(exception_context.original_exception)
+            s.set_status(Status(StatusCode.ERROR))
+            s.end()
+
+
+#ROOT SPAN
+
+class TracingMiddleware:
+    """
+    pure ASGI: one root span per http request, continues an incoming W3C traceparent.
+    span is renamed to the route template once routing is done (bounded span names)
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if _tracer is None or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        from opentelemetry import propagate
+        from opentelemetry.trace import SpanKind, Status, StatusCode
+
+        carrier = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        status_holder = {"status": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+            await send(message)
+
+        with _tracer.start_as_current_span(f'{scope["method"]} request', context=propagate.extract(carrier), kind=SpanKind.SERVER) as s:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = getattr(scope.get("route"), "path", "unmatched")
+                s.update_name(f'{scope["method"]} {route}')
+                s.set_attributes({"http.method": scope["method"], "http.route": route, "http.status_code": status_holder["status"]})
+                if status_holder["status"] >= 500:
+                    s.set_status(Status(StatusCode.ERROR))
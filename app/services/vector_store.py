@@ -3,15 +3,20 @@ import os
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
 import time
+from app.services.embedding_service import EMBEDDING_VERSION, EMBEDDING_DIM
 
 # logging.basicConfig(level=logging.INFO, format="%(asctime)s - [%(levelname)s] - %(message)s")
 # logger = logging.getLogger(__name__)
 
 logger = logging.getLogger("json_logger")
 
-COLLECTION_NAME = "compliance_chunks"
+BASE_COLLECTION_NAME = "compliance_chunks"
 
-VECTOR_SIZE  = 1536 # this is model specific, an embedding model & dimension mismatch will cause a crash. 
+#one collection per embedding version, vectors from different models can't share a collection.
+#the openai "v1" collection keeps its original name so existing deployments don't need a re-ingest
+COLLECTION_NAME = BASE_COLLECTION_NAME if EMBEDDING_VERSION == "v1" else f"{BASE_COLLECTION_NAME}_{EMBEDDING_VERSION}"
+
+VECTOR_SIZE  = EMBEDDING_DIM # this is model specific, an embedding model & dimension mismatch will cause a crash. 
 
 DEFAULT_TIMEOUT=10.0
 
@@ -0,0 +1,149 @@
+"""
+offline checks of the Batch API path (app.services.batch_audit) end to end, no network & no api keys.
+
+BatchAuditRunner talks to FakeBatchAPI over a local http server (OPENAI_BATCH_BASE_URL), retrieval runs on the
+benchmark fixtures (in-memory qdrant, sqlite, fakeredis). checked:
+-request building: one jsonl line per auditable query, same system prompt & cache key as the live path, manifest source map
+-submit / poll: file upload, batch creation, status transitions up to completed
+-result loading: loaded / invalid / errored counts, compliance_results rows & their regulation / policy foreign keys
+-cost accounting: tokens from the output file, priced like the live path at the batch discount
+-cache tagging: loaded responses are cached & listed under tags:source:{id} of every cited source, invalidate_source drops them
+
+usage:
+    python -m benchmarks.batch_check    # exit code 1 on the first failed check
+"""
+import os
+import tempfile
+
+#before any app import: the agent refuses to build without a key, batch_audit reads BATCH_OUTPUT_DIR at import
+os.environ.setdefault("OPENAI_API_KEY", "sk-offline-benchmark")
+os.environ["EMBEDDING_BACKEND"] = "openai"
+os.environ["MOCK_LLM"] = "false"
+os.environ["BATCH_OUTPUT_DIR"] = tempfile.mkdtemp(prefix="batch_check_")
+
+import json
+import logging
+import sys
+from app.core.logger import stop_logging
+from app.db.models import ComplianceResult
+from app.services.batch_audit import BatchAuditRunner, BATCH_ENDPOINT, BATCH_PRICE_MULTIPLIER, _citation_labels
+from app.services.cache import cache_service
+from app.services.compliance_agent import ComplianceAgent, AUDIT_SYSTEM_PROMPT, AUDIT_PROMPT_CACHE_KEY
+from app.services.telemetry import TelemetryService
+from benchmarks.fakes import FakeOpenAI, FakeBatchAPI, LatencyModel, serve_batch_api
+from benchmarks.fixtures import build_fixtures, install_fakes
+
+#one line answered with an error record, one with a completion that isn't json
+FAIL_ID, INVALID_ID = "audit-1", "audit-2"
+
+
+def check(condition: bool, what: str):
+    if not condition:
+        raise AssertionError(what)
+    print(f"ok   {what}")
+
+
+def check_citation_labels():
+    labels = _citation_labels(["Source 1", "source 2 (policy)", "see SOURCE 10", "policy clause", "Source 3, Source 4"])
+    check(labels == ["Source 1", "Source 2", "Source 10", "Source 3"], f"citation labels parsed like verify_citations: {labels}")
+
+
+def check_build(runner: BatchAuditRunner, queries: list[str], session)->tuple[str, str, dict]:
+    jsonl_path, manifest_path = runner.build_requests(queries, session, run_id="check")
+    with open(jsonl_path, encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f]
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    check(len(lines) == len(manifest["requests"]) == len(queries), f"{len(lines)} request lines, one per query")
+    check(len({line["custom_id"] for line in lines}) == len(lines), "custom_ids are unique")
+    check(all(line["method"] == "POST" and line["url"] == BATCH_ENDPOINT for line in lines), "lines target the chat completions endpoint")
+    check(all(line["body"]["messages"][0]["content"] == AUDIT_SYSTEM_PROMPT and line["body"]["prompt_cache_key"] == AUDIT_PROMPT_CACHE_KEY
+              for line in lines), "system prompt & prompt cache key match the live path")
+    for line in lines:
+        meta = manifest["requests"][line["custom_id"]]
+        user = line["body"]["messages"][1]["content"]
+        check(user.startswith(f"QUERY: {meta['query']}\n\n--- sources ---\n") and all(f"[{label}:" in user for label in meta["valid_sources"]),
+              f"{line['custom_id']}: user message carries the query & every valid source")
+        check(set(meta["valid_sources"]) <= set(meta["source_ids"]) and {t for t, _ in meta["source_ids"].values()} == {"regulation", "policy"},
+              f"{line['custom_id']}: manifest maps every source label to a regulation / policy id")
+    return jsonl_path, manifest_path, manifest
+
+
+def check_results(runner: BatchAuditRunner, api: FakeBatchAPI, batch, manifest_path: str, manifest: dict, session, redis):
+    summary = runner.load_results(batch, manifest_path, session)
+    n = len(manifest["requests"])
+    check(summary["errored"] == 1 and summary["invalid"] == 1 and summary["loaded"] == n-2, f"summary counts: {summary}")
+
+    rows = session.query(ComplianceResult).all()
+    check(len(rows) == summary["loaded"], f"{len(rows)} compliance_results rows")
+    for row in rows:
+        meta = manifest["requests"][row.agent_metadata["custom_id"]]
+        cited = [meta["source_ids"][label] for label in _citation_labels(row.agent_metadata["citations"])]
+        expected = {t: next((i for s, i in cited if s == t), None) for t in ("regulation", "policy")}
+        check(str(row.regulation_id) == expected["regulation"] and (str(row.policy_id) if row.policy_id else None) == expected["policy"],
+              f"{row.agent_metadata['custom_id']}: foreign keys are the first cited regulation & policy")
+
+    #every answered line is billed, invalid ones included (the tokens were spent), at the live price x batch discount
+    telemetry = TelemetryService(request_id="expected")
+    for record in api.output_records(batch.id):
+        usage = record["response"]["body"]["usage"]
+        telemetry.metrics["cost_usd"] += telemetry._calculate_cost(manifest["model"], usage["prompt_tokens"], usage["completion_tokens"],
+                                                                  usage["prompt_tokens_details"]["cached_tokens"])
+        telemetry.metrics["prompt_tokens"] += usage["prompt_tokens"]
+    check(summary["cost_usd"] == round(telemetry.metrics["cost_usd"]*BATCH_PRICE_MULTIPLIER, 6) and summary["cost_usd"] > 0,
+          f"cost {summary['cost_usd']} = live price x {BATCH_PRICE_MULTIPLIER}")
+    check(summary["prompt_tokens"] == telemetry.metrics["prompt_tokens"], f"{summary['prompt_tokens']} prompt tokens from the output file")
+
+    for row in rows:
+        meta = manifest["requests"][row.agent_metadata["custom_id"]]
+        key = cache_service._response_key(meta["query"], None, cache_service._known_generations(None))
+        check(cache_service.get_response(meta["query"], None) is not None, f"{row.agent_metadata['custom_id']}: response cached")
+        source_ids = {meta["source_ids"][label][1] for label in _citation_labels(row.agent_metadata["citations"])}
+        check(all(redis.sismember(f"tags:source:{source_id}", key) for source_id in source_ids),
+              f"{row.agent_metadata['custom_id']}: tagged with its {len(source_ids)} cited source(s)")
+
+    row = rows[0]
+    meta = manifest["requests"][row.agent_metadata["custom_id"]]
+    cache_service.invalidate_source(str(row.policy_id or row.regulation_id))
+    check(cache_service.get_response(meta["query"], None) is None, "invalidate_source drops the batch loaded response")
+
+
+def main()->int:
+    logging.getLogger("json_logger").setLevel(logging.ERROR)
+    fixtures = build_fixtures()
+    fake = FakeOpenAI(LatencyModel(scale=0))
+    redis = install_fakes(fixtures, fake)
+    api = FakeBatchAPI(fake, fail_ids={FAIL_ID}, invalid_ids={INVALID_ID})
+    server = serve_batch_api(api)
+    os.environ["OPENAI_BATCH_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    agent = ComplianceAgent()
+    agent.client = fake
+    runner = BatchAuditRunner(agent=agent) # real sdk client, pointed at the fake server
+    session = fixtures.SessionLocal()
+    try:
+        check_citation_labels()
+        jsonl_path, manifest_path, manifest = check_build(runner, fixtures.questions, session)
+
+        batch_id = runner.submit(jsonl_path, manifest["run_id"])
+        check(api.batches[batch_id]["status"] == "validating" and api.batches[batch_id]["metadata"]["run_id"] == "check", "batch created, validating")
+        batch = runner.poll(batch_id, interval=0, timeout=10)
+        check(batch.status == "completed" and batch.request_counts.failed == 1 and batch.request_counts.total == len(manifest["requests"]),
+              f"poll returns the completed batch: {batch.request_counts}")
+
+        check_results(runner, api, batch, manifest_path, manifest, session, redis)
+    except AssertionError as e:
+        print(f"FAIL {e}")
+        return 1
+    finally:
+        session.close()
+        server.shutdown()
+        fixtures.close()
+        stop_logging()
+    print("all batch checks passed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
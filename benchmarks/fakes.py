@@ -0,0 +1,279 @@
+"""
+offline stand-ins for the openai client, deterministic so two runs of the same commit produce the same work.
+
+-FakeOpenAI: chat.completions.create & embeddings.create, returns real openai sdk response types
+-latency model: base + per prompt token + per completion token (ms), scaled by latency_scale (0 = no sleep)
+-prompt cache model: a prompt_cache_key seen before with a >=1024 token system prompt reports the prefix as cached_tokens
+-embeddings: hashed bag of (stemmed) words, texts sharing words land close together in cosine space
+-FakeBatchAPI: /v1/files & /v1/batches for BatchAuditRunner, as an httpx transport or a local http server (serve_batch_api)
+"""
+import email.parser
+import email.policy
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+import httpx
+from openai.types import CreateEmbeddingResponse
+from openai.types.chat import ChatCompletion
+from app.services.compliance_agent import INTENT_SYSTEM_PROMPT, PROMPT_CACHE_MIN_TOKENS
+from app.services.embedding_service import EMBEDDING_DIM
+from app.services.token_budget import count_tokens
+
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset("a an and are as at be by does do for from has have in is it of on or the to what which with".split())
+_STATUSES = ("PASS", "FAIL", "AMBIGUOUS")
+
+
+@dataclass
+class LatencyModel:
+    """ms per call, roughly gpt-4o-mini / text-embedding-3-small seen from a nearby region"""
+    chat_base_ms: float = 250.0
+    chat_prompt_token_ms: float = 0.02
+    chat_completion_token_ms: float = 8.0
+    embedding_base_ms: float = 40.0
+    embedding_token_ms: float = 0.01
+    scale: float = 1.0
+
+    def sleep(self, ms: float):
+        if self.scale > 0:
+            time.sleep(ms*self.scale/1000)
+
+
+def _stable_int(text: str)->int:
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "big")
+
+def hashed_embedding(text: str, dim: int = EMBEDDING_DIM)->list[float]:
+    vector = [0.0]*dim
+    for word in _WORD.findall(text.lower()):
+        if word in _STOPWORDS:
+            continue
+        h = _stable_int(word[:5]) # crude stemming, "tested" & "testing" share a bucket
+        vector[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = math.sqrt(sum(v*v for v in vector)) or 1.0
+    return [v/norm for v in vector]
+
+
+class _Completions:
+    def __init__(self, owner: "FakeOpenAI"):
+        self.owner = owner
+
+    def create(self, model: str, messages: list, max_tokens=None, prompt_cache_key=None, **kwargs)->ChatCompletion:
+        system = next((m["content"] for m in messages if m["role"] == "system"), "")
+        user = next((m["content"] for m in messages if m["role"] == "user"), "")
+
+        if system == INTENT_SYSTEM_PROMPT:
+            content = '{"category": "COMPLIANCE_AUDIT"}'
+        else:
+            #status picked from the query text, so the same query always gets the same verdict
+            status = _STATUSES[_stable_int(user.split("\n", 1)[0]) % len(_STATUSES)]
+            #cites the first regulation & the first policy source of the sources block, like a real audit answer
+            regulation = re.search(r"\[(Source \d+): REGULATION", user)
+            policy = re.search(r"\[(Source \d+): POLICY", user)
+            regulation, policy = regulation.group(1) if regulation else "Source 1", policy.group(1) if policy else "Source 2"
+            content = ('{"status": "%s", "confidence": "HIGH", "reasoning": "%s sets the obligation and %s '
+                       'is the matching policy clause, compared on frequency, ownership and approval level.", '
+                       '"citations": ["%s", "%s"]}') % (status, regulation, policy, regulation, policy)
+
+        prompt_tokens = count_tokens(system) + count_tokens(user) + 7*len(messages) # chat format overhead
+        completion_tokens = count_tokens(content)
+        if isinstance(max_tokens, int):
+            completion_tokens = min(completion_tokens, max_tokens)
+        cached_tokens = self.owner.cached_prefix(prompt_cache_key, system)
+
+        lm = self.owner.latency
+        lm.sleep(lm.chat_base_ms + (prompt_tokens-cached_tokens)*lm.chat_prompt_token_ms + completion_tokens*lm.chat_completion_token_ms)
+        self.owner.count("chat")
+
+        return ChatCompletion.model_validate({
+            "id": f"chatcmpl-fake-{self.owner.calls['chat']}",
+            "object": "chat.completion",
+            "created": 0,
+            "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            },
+        })
+
+
+class _Chat:
+    def __init__(self, owner: "FakeOpenAI"):
+        self.completions = _Completions(owner)
+
+
+class _Embeddings:
+    def __init__(self, owner: "FakeOpenAI"):
+        self.owner = owner
+
+    def create(self, input, model: str, **kwargs)->CreateEmbeddingResponse:
+        texts = [input] if isinstance(input, str) else list(input)
+        tokens = sum(count_tokens(t) for t in texts)
+
+        lm = self.owner.latency
+        lm.sleep(lm.embedding_base_ms + tokens*lm.embedding_token_ms)
+        self.owner.count("embeddings")
+
+        return CreateEmbeddingResponse.model_validate({
+            "object": "list",
+            "model": model,
+            "data": [{"object": "embedding", "index": i, "embedding": hashed_embedding(t)} for i, t in enumerate(texts)],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+
+class FakeOpenAI:
+    """drop-in for openai.OpenAI on the two endpoints the app calls"""
+
+    def __init__(self, latency: LatencyModel = None):
+        self.latency = latency or LatencyModel()
+        self.chat = _Chat(self)
+        self.embeddings = _Embeddings(self)
+        self.calls = {"chat": 0, "embeddings": 0}
+        self._seen_cache_keys = set()
+        self._lock = threading.Lock()
+
+    def count(self, endpoint: str):
+        with self._lock:
+            self.calls[endpoint] += 1
+
+    def cached_prefix(self, prompt_cache_key, system_prompt: str)->int:
+        if not prompt_cache_key:
+            return 0
+        prefix_tokens = count_tokens(system_prompt)
+        with self._lock:
+            warm = prompt_cache_key in self._seen_cache_keys
+            self._seen_cache_keys.add(prompt_cache_key)
+        if not warm or prefix_tokens < PROMPT_CACHE_MIN_TOKENS:
+            return 0
+        return (prefix_tokens//128)*128 # openai caches in 128 token steps
+
+    def reset(self):
+        self.calls = {"chat": 0, "embeddings": 0}
+        self._seen_cache_keys.clear()
+
+
+class FakeBatchAPI(httpx.BaseTransport):
+    """
+    the Batch API endpoints BatchAuditRunner calls: upload file, file content, create & retrieve batch.
+    -a batch is "validating" when created, "in_progress" on the first retrieve & "completed" on the next one,
+    every request line is then answered by <fake>'s chat completions (same verdicts & usage as the live path)
+    -fail_ids: custom_ids answered with a per request error (error file), invalid_ids: custom_ids whose completion isn't json
+    """
+
+    def __init__(self, fake: FakeOpenAI, fail_ids: Optional[set] = None, invalid_ids: Optional[set] = None):
+        self.fake = fake
+        self.fail_ids = set(fail_ids or ())
+        self.invalid_ids = set(invalid_ids or ())
+        self.files = {} # id -> (purpose, filename, bytes)
+        self.batches = {} # id -> batch json
+        self._lock = threading.Lock()
+
+    def handle_request(self, request: httpx.Request)->httpx.Response:
+        path = request.url.path.removeprefix("/v1")
+        with self._lock:
+            if request.method == "POST" and path == "/files":
+                return self._upload(request)
+            if request.method == "GET" and path.startswith("/files/") and path.endswith("/content") and path.split("/")[2] in self.files:
+                return httpx.Response(200, content=self.files[path.split("/")[2]][2], request=request)
+            if request.method == "POST" and path == "/batches":
+                return self._create_batch(request)
+            if request.method == "GET" and path.startswith("/batches/") and path.split("/")[2] in self.batches:
+                return httpx.Response(200, json=self._advance(self.batches[path.split("/")[2]]), request=request)
+        return httpx.Response(404, json={"error": {"message": f"no fake for {request.method} {request.url.path}", "type": "invalid_request_error"}}, request=request)
+
+    def _add_file(self, purpose: str, filename: str, data: bytes)->dict:
+        file_id = f"file-fake-{len(self.files)+1}"
+        self.files[file_id] = (purpose, filename, data)
+        return {"id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()), "filename": filename,
+                "purpose": purpose, "status": "processed"}
+
+    def _upload(self, request: httpx.Request)->httpx.Response:
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            b"Content-Type: " + request.headers["content-type"].encode() + b"\r\n\r\n" + request.read())
+        fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+        upload = fields["file"]
+        purpose = fields["purpose"].get_payload(decode=True).decode()
+        return httpx.Response(200, json=self._add_file(purpose, upload.get_filename() or "upload.jsonl", upload.get_payload(decode=True)), request=request)
+
+    def _create_batch(self, request: httpx.Request)->httpx.Response:
+        body = json.loads(request.read())
+        if body["input_file_id"] not in self.files:
+            return httpx.Response(400, json={"error": {"message": "unknown input_file_id", "type": "invalid_request_error"}}, request=request)
+        batch_id = f"batch-fake-{len(self.batches)+1}"
+        self.batches[batch_id] = {
+            "id": batch_id, "object": "batch", "endpoint": body["endpoint"], "input_file_id": body["input_file_id"],
+            "completion_window": body["completion_window"], "status": "validating", "created_at": int(time.time()),
+            "metadata": body.get("metadata"), "output_file_id": None, "error_file_id": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        return httpx.Response(200, json=self.batches[batch_id], request=request)
+
+    def _advance(self, batch: dict)->dict:
+        if batch["status"] == "validating":
+            batch["status"] = "in_progress"
+            batch["in_progress_at"] = int(time.time())
+        elif batch["status"] == "in_progress":
+            self._complete(batch)
+        return batch
+
+    def _complete(self, batch: dict):
+        outputs, errors = [], []
+        for n, line in enumerate(self.files[batch["input_file_id"]][2].decode().splitlines()):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            record = {"id": f"batch_req_{n}", "custom_id": item["custom_id"], "response": None, "error": None}
+            if item["custom_id"] in self.fail_ids:
+                record["error"] = {"code": "server_error", "message": "fake per request failure"}
+                errors.append(record)
+                continue
+            completion = self.fake.chat.completions.create(**item["body"]).model_dump()
+            if item["custom_id"] in self.invalid_ids:
+                completion["choices"][0]["message"]["content"] = "not json"
+            record["response"] = {"status_code": 200, "request_id": f"req-fake-{n}", "body": completion}
+            outputs.append(record)
+
+        jsonl = lambda records: "".join(json.dumps(r) + "\n" for r in records).encode()
+        batch.update({
+            "status": "completed", "completed_at": int(time.time()),
+            "output_file_id": self._add_file("batch_output", "output.jsonl", jsonl(outputs))["id"] if outputs else None,
+            "error_file_id": self._add_file("batch_output", "errors.jsonl", jsonl(errors))["id"] if errors else None,
+            "request_counts": {"total": len(outputs)+len(errors), "completed": len(outputs), "failed": len(errors)},
+        })
+
+    def output_records(self, batch_id: str)->list[dict]:
+        """the answered lines of a completed batch, as written to its output file"""
+        file_id = self.batches[batch_id]["output_file_id"]
+        return [json.loads(line) for line in self.files[file_id][2].decode().splitlines()] if file_id else []
+
+
+def serve_batch_api(api: FakeBatchAPI, host: str = "127.0.0.1", port: int = 0)->ThreadingHTTPServer:
+    """<api> on a local http server (daemon thread), point the runner at it with OPENAI_BATCH_BASE_URL=http://host:port/v1"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def _handle(self):
+            body = self.rfile.read(int(self.headers.get("content-length") or 0))
+            response = api.handle_request(httpx.Request(self.command, f"http://{host}{self.path}", headers=dict(self.headers), content=body))
+            self.send_response(response.status_code)
+            self.send_header("content-type", response.headers.get("content-type", "application/octet-stream"))
+            self.send_header("content-length", str(len(response.content)))
+            self.end_headers()
+            self.wfile.write(response.content)
+
+        do_GET = do_POST = _handle
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="fake-batch-api", daemon=True).start()
+    return server
@@ -0,0 +1,148 @@
+"""
+synthetic corpus loaded into the same stores the app reads from:
+-sql: regulations, internal_policies & document_chunks (in-memory sqlite by default, any sqlalchemy url works)
+-qdrant: QdrantClient(":memory:") collection with the production name, payload & indexes
+-vectors come from benchmarks.fakes.hashed_embedding, same function the fake embeddings endpoint uses
+
+chunk texts come from a fixed seed, the corpus only changes when this file changes.
+row ids are random so a postgres database can be reused across runs (rows are added, never deleted)
+"""
+import random
+import uuid
+import warnings
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.db.models import Base, Regulation, InternalPolicy, DocumentChunk
+from app.services import retriever
+from app.services.cache import cache_service
+from app.services.embedding_service import embedding_service, OpenAIEmbeddingBackend
+from app.services.vector_store import COLLECTION_NAME, VECTOR_SIZE
+from benchmarks.fakes import FakeOpenAI, hashed_embedding
+
+SEED = 1042
+
+#(topic, regulation obligation, policy clause, audit question)
+TOPICS = [
+    ("exit strategies", "FRFIs should develop exit strategies for critical third-party arrangements and test exit plans periodically.",
+     "Exit strategies for critical third-party vendors are documented by the business owner; testing of exit plans is not required.",
+     "Does the bank test exit strategies for critical third-party arrangements?"),
+    ("service levels", "FRFIs should monitor third-party performance against defined service levels and escalate service level breaches.",
+     "Procurement reviews vendor performance against service levels where appropriate and escalates repeated breaches.",
+     "Are vendor service levels monitored and breaches escalated?"),
+    ("due diligence", "Due diligence on a third party should be proportionate to risk and completed before the arrangement is entered into.",
+     "Third-party due diligence is completed by the risk team before contract signature, for material vendors only.",
+     "Is third-party due diligence completed before the arrangement is entered into?"),
+    ("subcontracting", "Contracts should require notification and approval before material subcontracting of critical services.",
+     "Vendors must notify the bank of subcontracting; approval is required only for offshore subcontractors.",
+     "Does the policy require approval before vendors subcontract critical services?"),
+    ("audit rights", "The written agreement should grant the FRFI and OSFI access and audit rights over the third party.",
+     "The written agreement grants the bank audit and access rights; OSFI access is negotiated case by case.",
+     "Does the written agreement grant audit and access rights to the FRFI and OSFI?"),
+    ("incident reporting", "Third parties should report incidents affecting the FRFI promptly and within defined timelines.",
+     "Vendors report security incidents to the bank within 72 hours; timelines for other incidents are not defined.",
+     "Are vendors required to report incidents to the bank within defined timelines?"),
+    ("concentration risk", "FRFIs should identify and manage concentration risk arising from reliance on a single third party.",
+     "Concentration risk from reliance on a single third-party vendor is reviewed annually by the risk committee.",
+     "How does the bank manage third-party concentration risk?"),
+    ("business continuity", "Critical third parties should maintain business continuity and disaster recovery plans tested at least annually.",
+     "Critical vendors provide business continuity plans at onboarding; continuity plan testing evidence is requested every two years.",
+     "Are vendor business continuity plans tested at least annually?"),
+]
+
+#filler sentences mixed into chunks, so chunks are longer than one sentence & not all equally similar
+FILLER = [
+    "This requirement applies across all business lines and legal entities of the group.",
+    "Records supporting this control are retained for seven years and made available on request.",
+    "Accountability sits with the first line, with oversight by the second line risk function.",
+    "Exceptions must be documented, time bound and approved by a senior officer.",
+    "The requirement is reviewed whenever there is a material change to the arrangement.",
+    "Reporting to the board risk committee occurs at least quarterly.",
+]
+
+
+class Fixtures:
+    """handles to the seeded stores, plus the question list used to build benchmark requests"""
+
+    def __init__(self, engine, session_factory, qdrant: QdrantClient, questions: list[str], policy_ids: list[str], chunks: int):
+        self.engine = engine
+        self.SessionLocal = session_factory
+        self.qdrant = qdrant
+        self.questions = questions
+        self.policy_ids = policy_ids
+        self.chunks = chunks
+
+    def close(self):
+        self.qdrant.close()
+        self.engine.dispose()
+
+
+def _chunk_text(rng: random.Random, sentence: str)->str:
+    return f"{sentence} {rng.choice(FILLER)}"
+
+def build_fixtures(database_url: str = "sqlite://", chunks_per_topic: int = 4)->Fixtures:
+    """
+    chunks_per_topic regulation & policy chunks for each topic (corpus size = 2 * topics * chunks_per_topic).
+    database_url "sqlite://" is an in-memory db shared by every thread of the run
+    """
+    rng = random.Random(SEED)
+
+    if database_url.startswith("sqlite"):
+        from sqlalchemy.pool import StaticPool
+        engine = create_engine(database_url, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    else:
+        engine = create_engine(database_url, pool_size=20, max_overflow=0)
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+
+    qdrant = QdrantClient(":memory:")
+    qdrant.create_collection(COLLECTION_NAME, vectors_config=models.VectorParams(size=VECTOR_SIZE, distance=models.Distance.COSINE))
+    with warnings.catch_warnings(): # no-op in local mode, kept so the collection matches init_qdrant_collection
+        warnings.simplefilter("ignore")
+        for field in ("source_type", "source_id"):
+            qdrant.create_payload_index(COLLECTION_NAME, field_name=field, field_schema=models.PayloadSchemaType.KEYWORD)
+
+    points, policy_ids, n_chunks = [], [], 0
+    with session_factory() as db:
+        run_tag = uuid.uuid4().hex[:8] # unique names per run, see uq_regulations_name_section / uq_policy_name_version
+        regulation = Regulation(id=uuid.uuid4(), name=f"OSFI B-10 bench {run_tag}", section="all", text_content="synthetic")
+        db.add(regulation)
+
+        for t, (topic, obligation, clause, _) in enumerate(TOPICS):
+            policy = InternalPolicy(id=uuid.uuid4(), name=f"{topic.title()} Policy {run_tag}", version="V1", text_content=clause)
+            db.add(policy)
+            policy_ids.append(str(policy.id))
+
+            for source_type, source_id, sentence, meta in (("regulation", regulation.id, obligation, {"section": f"2.{t+1}"}),
+                                                           ("policy", policy.id, clause, {"version": "V1"})):
+                for i in range(chunks_per_topic):
+                    chunk = DocumentChunk(id=uuid.uuid4(), source_id=source_id, source_type=source_type,
+                                          chunk_index=t*chunks_per_topic + i, text_content=_chunk_text(rng, sentence), chunk_metadata=meta)
+                    chunk.embedding_id = str(chunk.id)
+                    db.add(chunk)
+                    points.append(models.PointStruct(id=str(chunk.id), vector=hashed_embedding(chunk.text_content),
+                                                     payload={"source_id": str(source_id), "source_type": source_type,
+                                                              "text_content": chunk.text_content, "chunk_index": chunk.chunk_index}))
+                    n_chunks += 1
+        db.commit()
+
+    qdrant.upsert(COLLECTION_NAME, points=points)
+    return Fixtures(engine, session_factory, qdrant, [q for *_, q in TOPICS], policy_ids, n_chunks)
+
+
+def install_fakes(fixtures: Fixtures, fake: FakeOpenAI):
+    """
+    points the app singletons at the stand-ins: redis -> fakeredis, retriever -> fixture qdrant, embeddings -> fake openai.
+    the ComplianceAgent client is swapped by the caller (the agent is built after this). returns the fakeredis client
+    """
+    import fakeredis # bench only dependency
+
+    redis = fakeredis.FakeRedis() # bytes, like CacheService's client
+    cache_service.client = redis
+    cache_service.tracked = None # fakeredis has no CLIENT TRACKING, reads take the pipelined path
+    retriever.get_qdrant_client = lambda: fixtures.qdrant
+    backend = OpenAIEmbeddingBackend()
+    backend.client = fake
+    embedding_service._backend = backend
+    return redis
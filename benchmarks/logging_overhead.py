@@ -0,0 +1,134 @@
+"""
+per request logging overhead, measured in the request thread.
+
+replays the log calls of one audit (cache miss -> routing -> retrieval -> context -> llm) against:
+-legacy: old setup, sync StreamHandler + json.dumps, every event at INFO
+-sync: orjson (if installed) + hot path events at DEBUG, still writing inline
+-async: QueueHandler/QueueListener, formatting & writing happen in the listener thread
+-async+sampling: async + 1 in 10 sampling for the remaining per-stage events
+
+drain_ms is the deferred cost paid by the listener thread for the whole run.
+
+usage: python -m benchmarks.logging_overhead [--requests 5000]
+"""
+import argparse
+import json
+import logging
+import statistics
+import tempfile
+import time
+from app.core.logger import build_handler, orjson
+
+STAGES = ("routing", "embedding", "vector_search", "vector_search", "db_fetch", "retrieval", "llm")
+HITS = 6
+
+
+class _LegacyFormatter(logging.Formatter):
+    """formatter as it was before the queue handler (json.dumps, inline)"""
+
+    def format(self, record):
+        log_obj = {"level": record.levelname, "timestamp": self.formatTime(record), "module": record.module}
+        if isinstance(record.msg, dict):
+            log_obj.update(record.msg)
+        else:
+            log_obj["message"] = record.getMessage()
+        return json.dumps(log_obj)
+
+
+def legacy_request(logger: logging.Logger, i: int):
+    logger.info({"event": "cache_miss", "layer": "response"})
+    logger.info({"event": "intent_classified", "intent": "COMPLIANCE_AUDIT"})
+    logger.info({"event": "retrieval_start", "query": f"does policy {i} define exit strategies?", "policy_filter_id": None})
+    for stage in STAGES:
+        logger.info({"event": f"{stage}_start", "request_id": str(i)})
+        logger.info({"event": f"{stage}_complete", "request_id": str(i), "duration_ms": 12.5})
+    for n in range(HITS):
+        logger.info(f'Found: [{0.8123:.2f}] REGULATION: {"Institutions should have exit strategies for critical arrangements"[:50]}')
+    logger.info({"event": "context_assembly_start"})
+    logger.info({"event": "context_budget_applied", "budget": 2500, "original_tokens": 3100, "final_tokens": 2480})
+    for n in range(HITS):
+        logger.info({"event": "source_mapped", "source_id": f"Source {n+1}", "type": "Section 2.1", "score": 0.81})
+    logger.info("Sending info to LLM")
+    logger.info({"event": "llm_analysis_start"})
+    logger.info({"event": "cache_write", "layer": "response", "key": f"response:{i}", "is_negative": False})
+
+def current_request(logger: logging.Logger, i: int):
+    """same request with the levels & guards now used in the app"""
+    logger.debug({"event": "cache_miss", "layer": "response"})
+    logger.info({"event": "intent_classified", "intent": "COMPLIANCE_AUDIT"})
+    logger.info({"event": "retrieval_start", "query": f"does policy {i} define exit strategies?", "policy_filter_id": None})
+    for stage in STAGES:
+        logger.debug({"event": f"{stage}_start", "request_id": str(i)})
+        logger.info({"event": f"{stage}_complete", "request_id": str(i), "duration_ms": 12.5})
+    for n in range(HITS):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug({"event": "retrieval_hit", "chunk_id": str(n), "source_type": "regulation", "score": 0.81})
+    logger.debug({"event": "context_assembly_start"})
+    logger.info({"event": "context_budget_applied", "budget": 2500, "original_tokens": 3100, "final_tokens": 2480})
+    for n in range(HITS):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug({"event": "source_mapped", "source_id": f"Source {n+1}", "type": "Section 2.1", "score": 0.81})
+    logger.info({"event": "llm_analysis_start"})
+    logger.info({"event": "cache_write", "layer": "response", "key": f"response:{i}", "is_negative": False})
+
+
+def _make_logger(name: str, stream, mode: str):
+    logger = logging.getLogger(f"bench.{name}")
+    logger.handlers.clear()
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+
+    if mode == "legacy":
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(_LegacyFormatter())
+        listener = None
+    else:
+        sample_rates = {f"{s}_complete": 0.1 for s in STAGES} if mode == "async+sampling" else None
+        handler, listener = build_handler(stream, async_mode=mode != "sync", sample_rates=sample_rates)
+
+    logger.addHandler(handler)
+    return logger, listener
+
+
+def run(mode: str, requests: int)->dict:
+    replay = legacy_request if mode == "legacy" else current_request
+    with tempfile.TemporaryFile("w") as stream: # real file writes, a tty would dominate every number
+        logger, listener = _make_logger(mode, stream, mode)
+
+        #async: the listener only starts after the loop, so request samples are the pure enqueue cost
+        #(a live listener in this tight single threaded loop mostly measures GIL hand-offs, not request work)
+        samples = []
+        for i in range(requests):
+            t0 = time.perf_counter()
+            replay(logger, i)
+            samples.append((time.perf_counter()-t0)*1e6)
+
+        t_drain = time.perf_counter()
+        if listener:
+            listener.start()
+            listener.stop() # deferred formatting & writes, off the request path
+        drain_ms = (time.perf_counter()-t_drain)*1000
+        stream.flush()
+        bytes_written = stream.tell()
+
+    samples.sort()
+    return {
+        "mode": mode,
+        "mean_us": round(statistics.fmean(samples), 1),
+        "p50_us": round(samples[len(samples)//2], 1),
+        "p99_us": round(samples[int(len(samples)*0.99)], 1),
+        "drain_ms": round(drain_ms, 1),
+        "kb_per_request": round(bytes_written/requests/1024, 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="per request logging overhead")
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    print(f"json encoder: {'orjson' if orjson else 'json (orjson not installed)'}, {args.requests} simulated audits\n")
+    print(f"{'mode':<16}{'mean_us':>10}{'p50_us':>10}{'p99_us':>10}{'drain_ms':>10}{'kb/req':>10}")
+    for mode in ("legacy", "sync", "async", "async+sampling"):
+        r = run(mode, args.requests)
+        print(f"{r['mode']:<16}{r['mean_us']:>10}{r['p50_us']:>10}{r['p99_us']:>10}{r['drain_ms']:>10}{r['kb_per_request']:>10}")
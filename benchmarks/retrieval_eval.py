@@ -0,0 +1,239 @@
+"""
+retrieval quality vs latency over a grid of retriever settings.
+
+for every configuration (score threshold x top_k x qdrant search params) each labeled query goes through
+retrieve_balanced_chunks and gets scored:
+-recall: share of the labeled evidence found in the returned chunks
+-mrr: 1/rank of the first relevant chunk
+-ndcg: graded gain (label grade) by rank, normalized by the ideal ordering at the same cutoff
+-circuit_break_rate: queries the agent would answer INCONCLUSIVE (no regulation or no policy returned)
+-search_ms: vector_search + db_fetch per query (embeddings are cached after the first repeat, so the model isn't measured)
+-context_tokens: sources block after the token budgeter, i.e. what the config costs in prompt tokens
+
+ranking metrics use score order (the retriever returns regulations first, then policies).
+configs on the pareto front (no other config is at least as good on ndcg, search_ms p50 & context tokens and better on one) are flagged.
+
+labels (benchmarks/data/retrieval_labels.json format): relevant chunks are matched by source_type + substring of the chunk text.
+
+usage:
+    python -m benchmarks.retrieval_eval                                   # offline, synthetic corpus (benchmarks.fixtures)
+    python -m benchmarks.retrieval_eval --live --labels my_labels.json    # configured postgres/qdrant/openai/redis
+    python -m benchmarks.retrieval_eval --thresholds 0.2,0.3,0.4 --top-k 2,3,5 --search default,exact --output eval.json
+"""
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-offline-benchmark") # offline only, --live needs the real key in the env
+
+import argparse
+import json
+import logging
+import math
+import statistics
+import uuid
+import warnings
+from dataclasses import dataclass, asdict
+from qdrant_client.http import models
+from app.core.logger import stop_logging
+from app.services.retriever import retrieve_balanced_chunks, SIMILARITY_THRESHOLD, REGULATION_TOP_K, POLICY_TOP_K
+from app.services.telemetry import TelemetryService
+from app.services.token_budget import build_budgeted_context, CONTEXT_TOKEN_BUDGET
+
+DEFAULT_LABELS = os.path.join(os.path.dirname(__file__), "data", "retrieval_labels.json")
+
+#named qdrant search params, "rescore" only changes anything on a collection with quantization enabled
+SEARCH_PARAMS = {
+    "default": None,
+    "exact": models.SearchParams(exact=True),
+    "ef32": models.SearchParams(hnsw_ef=32),
+    "ef128": models.SearchParams(hnsw_ef=128),
+    "quant-rescore": models.SearchParams(quantization=models.QuantizationSearchParams(rescore=True, oversampling=2.0)),
+    "quant-no-rescore": models.SearchParams(quantization=models.QuantizationSearchParams(rescore=False)),
+}
+
+
+@dataclass(frozen=True)
+class RetrieverConfig:
+    score_threshold: float = SIMILARITY_THRESHOLD
+    regulation_top_k: int = REGULATION_TOP_K
+    policy_top_k: int = POLICY_TOP_K
+    search: str = "default"
+
+    @property
+    def name(self)->str:
+        return f"t{self.score_threshold:g}_k{self.regulation_top_k}+{self.policy_top_k}_{self.search}"
+
+    @property
+    def is_current(self)->bool:
+        return self == RetrieverConfig()
+
+
+def _matches(chunk, label: dict)->bool:
+    return chunk.source_type == label["source_type"] and label["contains"].lower() in chunk.text_content.lower()
+
+def score_query(results: list, labels: list[dict], cutoff: int)->dict:
+    """results = [(chunk, score)] as returned by the retriever"""
+    ranked = [chunk for chunk, _ in sorted(results, key=lambda r: -r[1])]
+
+    first_rank = {} # label index -> rank of its first matching chunk
+    first_relevant = None
+    for rank, chunk in enumerate(ranked, start=1):
+        hit = False
+        for i, label in enumerate(labels):
+            if _matches(chunk, label):
+                hit = True
+                first_rank.setdefault(i, rank)
+        if hit and first_relevant is None:
+            first_relevant = rank
+
+    dcg = sum((2**labels[i].get("grade", 1)-1)/math.log2(rank+1) for i, rank in first_rank.items())
+    ideal = sorted((l.get("grade", 1) for l in labels), reverse=True)[:cutoff]
+    idcg = sum((2**g-1)/math.log2(rank+1) for rank, g in enumerate(ideal, start=1))
+    sides = {chunk.source_type for chunk in ranked}
+
+    return {
+        "recall": len(first_rank)/len(labels) if labels else 0.0,
+        "mrr": 1/first_relevant if first_relevant else 0.0,
+        "ndcg": dcg/idcg if idcg else 0.0,
+        "circuit_break": not {"regulation", "policy"} <= sides,
+        "returned": len(ranked),
+    }
+
+
+def evaluate(config: RetrieverConfig, queries: list[dict], session_factory, repeats: int = 3)->dict:
+    per_query, search_ms, context_tokens = [], [], []
+
+    for item in queries:
+        for attempt in range(repeats):
+            telemetry = TelemetryService(request_id=str(uuid.uuid4()))
+            db = session_factory()
+            try:
+                results = retrieve_balanced_chunks(item["query"], db, policy_filter_id=item.get("policy_filter_id"), telemetry=telemetry,
+                                                   regulation_top_k=config.regulation_top_k, policy_top_k=config.policy_top_k,
+                                                   score_threshold=config.score_threshold, search_params=SEARCH_PARAMS[config.search])
+            finally:
+                db.close()
+            if attempt == 0 and repeats > 1:
+                continue # cold embedding cache, not part of the latency sample
+            search_ms.append(telemetry.metrics["vector_search_ms"] + telemetry.metrics["db_fetch_ms"])
+
+        #results are identical across repeats, the last one is scored
+        per_query.append(score_query(results, item["relevant"], config.regulation_top_k + config.policy_top_k))
+        _, stats = build_budgeted_context([(chunk.text_content, score) for chunk, score in results], item["query"], CONTEXT_TOKEN_BUDGET)
+        context_tokens.append(stats["final_tokens"])
+
+    search_ms.sort()
+    mean = lambda key: round(statistics.fmean(q[key] for q in per_query), 4)
+    return {
+        "config": config.name,
+        "current": config.is_current,
+        **asdict(config),
+        "recall": mean("recall"),
+        "mrr": mean("mrr"),
+        "ndcg": mean("ndcg"),
+        "circuit_break_rate": mean("circuit_break"),
+        "chunks_per_query": mean("returned"),
+        "context_tokens_mean": round(statistics.fmean(context_tokens), 1),
+        "search_ms_p50": round(search_ms[len(search_ms)//2], 2),
+        "search_ms_p95": round(search_ms[min(len(search_ms)-1, int(len(search_ms)*0.95))], 2),
+    }
+
+
+def pareto_front(rows: list[dict])->set[str]:
+    """configs not dominated on (ndcg up, search_ms_p50 down, context_tokens_mean down)"""
+    def key(r):
+        return (r["ndcg"], -r["search_ms_p50"], -r["context_tokens_mean"])
+
+    front = set()
+    for r in rows:
+        kr = key(r)
+        dominated = any(all(a >= b for a, b in zip(key(o), kr)) and key(o) != kr for o in rows if o is not r)
+        if not dominated:
+            front.add(r["config"])
+    return front
+
+
+def unmatched_labels(queries: list[dict], chunks: list)->list[str]:
+    """labels that match no chunk in the corpus at all: a typo, or the corpus changed"""
+    return [f'{q["query"][:50]} -> {l["contains"]}' for q in queries for l in q["relevant"] if not any(_matches(c, l) for c in chunks)]
+
+
+def build_grid(thresholds: list[float], top_ks: list[int], searches: list[str])->list[RetrieverConfig]:
+    grid = [RetrieverConfig(t, k, k, s) for t in thresholds for k in top_ks for s in searches]
+    if RetrieverConfig() not in grid:
+        grid.append(RetrieverConfig()) # the production setting is always part of the report
+    return grid
+
+
+def print_report(rows: list[dict]):
+    print(f"\n{'config':<28}{'recall':>8}{'mrr':>8}{'ndcg':>8}{'cb_rate':>9}{'chunks':>8}{'ctx_tok':>9}{'p50_ms':>9}{'p95_ms':>9}")
+    for r in sorted(rows, key=lambda r: (-r["ndcg"], r["search_ms_p50"])):
+        flags = ("*" if r["pareto"] else " ") + ("<" if r["current"] else "")
+        print(f"{r['config']:<28}{r['recall']:>8.3f}{r['mrr']:>8.3f}{r['ndcg']:>8.3f}{r['circuit_break_rate']:>9.2f}"
+              f"{r['chunks_per_query']:>8.1f}{r['context_tokens_mean']:>9.0f}{r['search_ms_p50']:>9.2f}{r['search_ms_p95']:>9.2f} {flags}")
+    print("\n* pareto front (ndcg / search latency / context tokens), < current retriever settings")
+
+
+def _floats(spec: str)->list[float]:
+    return [float(x) for x in spec.split(",") if x]
+
+def _ints(spec: str)->list[int]:
+    return [int(x) for x in spec.split(",") if x]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="retrieval quality vs latency")
+    parser.add_argument("--labels", default=DEFAULT_LABELS)
+    parser.add_argument("--live", action="store_true", help="use the configured DATABASE_URL / QDRANT_URL / openai / redis instead of the offline fixtures")
+    parser.add_argument("--thresholds", default="0.2,0.3,0.4,0.5")
+    parser.add_argument("--top-k", default="2,3,5", help="applied to regulations & policies alike")
+    parser.add_argument("--search", help=f"named search params: {', '.join(SEARCH_PARAMS)} (default: default,exact live, default offline)")
+    parser.add_argument("--repeats", type=int, default=3, help="runs per query, the first one only warms the embedding cache")
+    parser.add_argument("--output", help="write the report json here")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.getLogger("json_logger").setLevel(args.log_level.upper())
+
+    with open(args.labels) as f:
+        queries = json.load(f)["queries"]
+
+    fixtures = None
+    if args.live:
+        from app.db import session as db_session
+        db_session.init_db_connection()
+        session_factory = db_session.SessionLocal
+        corpus_label = "live"
+    else:
+        from benchmarks.fakes import FakeOpenAI, LatencyModel
+        from benchmarks.fixtures import build_fixtures, install_fakes
+        fixtures = build_fixtures()
+        install_fakes(fixtures, FakeOpenAI(LatencyModel(scale=0))) # no simulated network, only search & fetch are timed
+        session_factory = fixtures.SessionLocal
+        corpus_label = "fixtures"
+        #local qdrant is always brute force, search params are accepted & ignored
+        warnings.filterwarnings("ignore", message="Local mode performs exact")
+
+        from app.db.models import DocumentChunk
+        with session_factory() as db:
+            for missing in unmatched_labels(queries, db.query(DocumentChunk).all()):
+                print(f"label matches no chunk: {missing}")
+
+    try:
+        searches = args.search or ("default,exact" if args.live else "default")
+        grid = build_grid(_floats(args.thresholds), _ints(args.top_k), [s for s in searches.split(",") if s])
+        rows = [evaluate(config, queries, session_factory, args.repeats) for config in grid]
+    finally:
+        if fixtures:
+            fixtures.close()
+
+    front = pareto_front(rows)
+    for r in rows:
+        r["pareto"] = r["config"] in front
+
+    stop_logging()
+    print(f"{len(queries)} labeled queries, {len(grid)} configurations, corpus: {corpus_label}")
+    print_report(rows)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"corpus": corpus_label, "labels": args.labels, "queries": len(queries), "configs": rows}, f, indent=2)
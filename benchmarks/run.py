@@ -0,0 +1,240 @@
+"""
+offline end to end benchmark of ComplianceAgent.analyze, no network & no api keys.
+
+stand-ins (see fakes.py / fixtures.py):
+-openai: FakeOpenAI, deterministic latency & token models
+-qdrant: QdrantClient(":memory:") seeded with a synthetic corpus
+-redis: fakeredis (pip install fakeredis, bench only)
+-sql: in-memory sqlite, or --database-url for a real postgres
+
+scenarios:
+-cold: empty redis, every query distinct -> intent llm call, embedding, retrieval & audit llm call per request
+-warm: the same queries again -> served by the response cache layer
+
+per scenario: p50/p95/p99 of every TelemetryService stage (*_ms) & total latency, throughput at --concurrency,
+cache hit rate, tokens & cost per request.
+
+usage:
+    python -m benchmarks.run --requests 200 --concurrency 8 --output bench.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json   # exit code 1 on regression
+"""
+import os
+
+#before any app import: the agent & embedding backend refuse to build without a key, the fakes replace their clients anyway
+os.environ.setdefault("OPENAI_API_KEY", "sk-offline-benchmark")
+os.environ["EMBEDDING_BACKEND"] = "openai"
+os.environ["MOCK_LLM"] = "false"
+
+import argparse
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from app.core.logger import stop_logging
+from app.services.compliance_agent import ComplianceAgent, AUDIT_MODE
+from app.services.telemetry import TelemetryService
+from app.services.token_budget import tokenizer_name
+from benchmarks.fakes import FakeOpenAI, LatencyModel
+from benchmarks.fixtures import build_fixtures, install_fakes
+
+SCENARIOS = ("cold", "warm")
+#a stage regresses when its p50 is REGRESSION_TOLERANCE slower than the baseline (p95: TAIL_TOLERANCE, thread scheduling
+#moves the tail of the cpu bound stages by 20-40% run to run) AND at least REGRESSION_MIN_MS slower (sub-ms stages jitter)
+REGRESSION_TOLERANCE = 0.10
+TAIL_TOLERANCE = 0.50
+REGRESSION_MIN_MS = 1.0
+#throughput of a scenario that finished faster than this is mostly scheduler noise (the warm scenario), not compared
+THROUGHPUT_MIN_WALL_S = 1.0
+
+
+def percentile(sorted_values: list[float], q: float)->float:
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values)-1)*q
+    lo, hi = int(k), min(int(k)+1, len(sorted_values)-1)
+    return sorted_values[lo] + (sorted_values[hi]-sorted_values[lo])*(k-lo)
+
+def stage_stats(values: list[float])->dict:
+    values = sorted(values)
+    return {
+        "n": len(values),
+        "mean": round(statistics.fmean(values), 2) if values else 0.0,
+        "p50": round(percentile(values, 0.50), 2),
+        "p95": round(percentile(values, 0.95), 2),
+        "p99": round(percentile(values, 0.99), 2),
+    }
+
+def build_queries(questions: list[str], n: int)->list[str]:
+    #distinct text per request so cold requests never share a cache entry, same list every run
+    return [f"{questions[i % len(questions)]} (business unit {i//len(questions)+1})" for i in range(n)]
+
+
+class Harness:
+    def __init__(self, fixtures, fake: FakeOpenAI):
+        self.fixtures = fixtures
+        self.fake = fake
+        self.redis = install_fakes(fixtures, fake)
+        self.agent = ComplianceAgent()
+        self.agent.client = fake
+
+    def one_request(self, query: str)->dict:
+        telemetry = TelemetryService(request_id=str(uuid.uuid4()))
+        db = self.fixtures.SessionLocal()
+        try:
+            result = self.agent.analyze(query, db, telemetry=telemetry)
+        except Exception as e:
+            telemetry.set_error(type(e).__name__)
+            result = {}
+        finally:
+            db.close()
+        summary = telemetry.get_summary()
+        summary["status"] = result.get("status")
+        return summary
+
+    def run_scenario(self, name: str, queries: list[str], concurrency: int)->dict:
+        if name == "cold":
+            self.redis.flushall()
+            self.fake.reset()
+        calls_before = dict(self.fake.calls)
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bench") as pool:
+            summaries = list(pool.map(self.one_request, queries))
+        wall_s = time.perf_counter()-t0
+
+        stages = {"total": [s["total_latency_ms"] for s in summaries]}
+        for s in summaries:
+            for key, value in s.items():
+                if key.endswith("_ms") and key != "total_latency_ms" and isinstance(value, (int, float)) and value > 0:
+                    stages.setdefault(key[:-3], []).append(value)
+
+        n = len(summaries)
+        return {
+            "requests": n,
+            "concurrency": concurrency,
+            "wall_s": round(wall_s, 3),
+            "throughput_rps": round(n/wall_s, 2),
+            "errors": sum(1 for s in summaries if s["error_type"]),
+            "cache_hit_rate": round(sum(1 for s in summaries if s["is_cache_hit"])/n, 4),
+            "tokens_per_request": round(sum(s["prompt_tokens"]+s["completion_tokens"] for s in summaries)/n, 1),
+            "cached_tokens_per_request": round(sum(s["cached_tokens"] for s in summaries)/n, 1),
+            "cost_per_request_usd": round(sum(s["cost_usd"] for s in summaries)/n, 8),
+            "openai_calls": {k: v-calls_before[k] for k, v in self.fake.calls.items()},
+            "stages_ms": {stage: stage_stats(values) for stage, values in sorted(stages.items())},
+        }
+
+
+def _git_commit()->str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5).stdout.strip() or "unknown"
+    except Exception:
+        return "unknown"
+
+def run(requests: int, concurrency: int, latency: LatencyModel, database_url: str, chunks_per_topic: int)->dict:
+    fixtures = build_fixtures(database_url, chunks_per_topic)
+    try:
+        harness = Harness(fixtures, FakeOpenAI(latency))
+        queries = build_queries(fixtures.questions, requests)
+        harness.one_request(f"warmup {queries[0]}") # imports, tokenizer load, first sqlite connection
+        scenarios = {name: harness.run_scenario(name, queries, concurrency) for name in SCENARIOS}
+    finally:
+        fixtures.close()
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "database": database_url.split("://")[0],
+            "corpus_chunks": fixtures.chunks,
+            "audit_mode": AUDIT_MODE,
+            "tokenizer": tokenizer_name(), # the fakes count tokens with it, see compare()
+            "latency_model": vars(latency),
+        },
+        "scenarios": scenarios,
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float = REGRESSION_TOLERANCE, tail_tolerance: float = TAIL_TOLERANCE, min_ms: float = REGRESSION_MIN_MS)->list[dict]:
+    """
+    per scenario vs the baseline, returns the regressions:
+    -p50 & p95 of every stage, throughput (timing, tolerance based)
+    -errors, tokens & openai calls per request (deterministic with the fakes, any increase counts).
+    tokens are only compared when both runs counted them with the same tokenizer (tiktoken vs the estimate)
+    """
+    regressions = []
+    same_tokenizer = current["meta"].get("tokenizer") == baseline.get("meta", {}).get("tokenizer", "estimate")
+    def check(name, metric, base_value, value, worse):
+        if base_value is not None and worse:
+            regressions.append({"scenario": name, "metric": metric, "baseline": base_value, "current": value})
+
+    for name, scenario in current["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        for stage, stats in scenario["stages_ms"].items():
+            base_stats = base["stages_ms"].get(stage)
+            if not base_stats:
+                continue
+            for q, tol in (("p50", tolerance), ("p95", tail_tolerance)):
+                check(name, f"{stage}.{q}_ms", base_stats[q], stats[q], stats[q] > base_stats[q]*(1+tol) and stats[q]-base_stats[q] >= min_ms)
+
+        if scenario["wall_s"] >= THROUGHPUT_MIN_WALL_S:
+            check(name, "throughput_rps", base["throughput_rps"], scenario["throughput_rps"], scenario["throughput_rps"] < base["throughput_rps"]*(1-tolerance))
+        check(name, "errors", base["errors"], scenario["errors"], scenario["errors"] > base["errors"])
+        if same_tokenizer:
+            check(name, "tokens_per_request", base["tokens_per_request"], scenario["tokens_per_request"], scenario["tokens_per_request"] > base["tokens_per_request"])
+        for endpoint, calls in scenario["openai_calls"].items():
+            base_calls = base["openai_calls"].get(endpoint)
+            check(name, f"openai_calls.{endpoint}", base_calls, calls, base_calls is not None and calls/scenario["requests"] > base_calls/base["requests"])
+    return regressions
+
+
+def print_report(result: dict):
+    for name, s in result["scenarios"].items():
+        print(f"\n[{name}] {s['requests']} requests @ concurrency {s['concurrency']}: {s['throughput_rps']} req/s, "
+              f"hit rate {s['cache_hit_rate']:.0%}, errors {s['errors']}, {s['tokens_per_request']} tokens/req, ${s['cost_per_request_usd']:.6f}/req")
+        print(f"  {'stage':<16}{'n':>6}{'p50_ms':>10}{'p95_ms':>10}{'p99_ms':>10}")
+        for stage, st in s["stages_ms"].items():
+            print(f"  {stage:<16}{st['n']:>6}{st['p50']:>10}{st['p95']:>10}{st['p99']:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="offline ComplianceAgent benchmark")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiplier on the fake openai latency model, 0 = no simulated network time")
+    parser.add_argument("--database-url", default="sqlite://")
+    parser.add_argument("--chunks-per-topic", type=int, default=4)
+    parser.add_argument("--output", help="write the result json here")
+    parser.add_argument("--baseline", help="result json to compare against, exit code 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE, help="allowed p50 & throughput slowdown")
+    parser.add_argument("--tail-tolerance", type=float, default=TAIL_TOLERANCE, help="allowed p95 slowdown")
+    parser.add_argument("--log-level", default="WARNING", help="app log level during the run, INFO prints every stage event")
+    args = parser.parse_args()
+
+    logging.getLogger("json_logger").setLevel(args.log_level.upper())
+
+    result = run(args.requests, args.concurrency, LatencyModel(scale=args.latency_scale), args.database_url, args.chunks_per_topic)
+    stop_logging() # flush the app's queued log lines before the report
+    print_report(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, tolerance=args.tolerance, tail_tolerance=args.tail_tolerance)
+        print(f"\nbaseline {args.baseline} ({baseline['meta'].get('commit')}): {len(regressions)} regression(s)")
+        if result["meta"]["tokenizer"] != baseline["meta"].get("tokenizer", "estimate"):
+            print(f"  tokens_per_request not compared: baseline counted with {baseline['meta'].get('tokenizer', 'estimate')}, "
+                  f"this run with {result['meta']['tokenizer']}")
+        for r in regressions:
+            print(f"  {r['scenario']:<6} {r['metric']:<24} {r['baseline']} -> {r['current']}")
+        sys.exit(1 if regressions else 0)
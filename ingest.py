@@ -5,6 +5,7 @@ from app.db.session import init_db_connection, SessionLocal
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 from app.db.models import Regulation, InternalPolicy
+from app.services.policy_catalogue import policy_catalogue
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - [%(levelname)s] - %(message)s")
 
@@ -130,6 +131,8 @@ def main():
         if total_changes > 0:
             session.commit()
             logger.info(f'Commit Success: Written {reg_count} Regs & {pol_count} Policies to DB.')
+            if pol_count:
+                policy_catalogue.invalidate() # running api workers reload the /policies catalogue
 
         else: 
             logger.info("No new data found, DB is upto date.")
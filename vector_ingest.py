@@ -5,6 +5,8 @@ from sqlalchemy.orm import Session
 from app.services.vector_store import init_qdrant_collection, get_qdrant_client, COLLECTION_NAME
 from app.db.models import DocumentChunk
 from app.db.session import init_db_connection, SessionLocal
+from app.services.cache import cache_service
+from app.services.cache_warmer import cache_warmer
 
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - [%(levelname)s] - %(message)s")
@@ -82,6 +84,12 @@ def process_vector_ingestion(session: Session):
 
     logger.info(f'Ingestion completed. Total processed: {total_success}')
 
+    if total_success:
+        #retrieval now sees new chunks: cached answers built from the old corpus are orphaned on every api worker,
+        #then one worker re-runs the popular queries against the new corpus
+        cache_service.bump_corpus_generation()
+        cache_warmer.request("ingest")
+
 def main():
     try:
         init_db_connection()